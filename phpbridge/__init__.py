@@ -1,64 +1,226 @@
+import array
 import base64
-import json
 import math
 import os
 import subprocess as sp
 import sys
+import threading
+import time
 import types
 
-from collections import ChainMap, OrderedDict
+from collections import ChainMap, OrderedDict, deque
+from contextlib import contextmanager
+from itertools import islice
 from typing import (Any, Callable, IO, Iterator, List, Dict,  # noqa: F401
-                    Iterable, Optional, Set, Union)
-from weakref import finalize
+                    Iterable, Optional, Set, Type, Union)
+from weakref import WeakSet, finalize
 
-from phpbridge import functions, modules, objects
+from phpbridge import (batching, expressions, functions, iteration,
+                       metacache, modules, objects, prebuilt, scopes, streams,
+                       values, wire)
+
+MYPY = False
+if MYPY:
+    from typing import Deque  # noqa: F401
 
 php_server_path = os.path.join(
     os.path.dirname(__file__), 'server.php')
 
 
 class PHPBridge:
-    def __init__(self, input_: IO[str], output: IO[str], name: str) -> None:
+    # The maximum number of elements fetched at once while iterating
+    iteration_chunk_size = 1000
+    # The number of calls sent at once by map and starmap
+    map_chunk_size = 1000
+    # The number of chunks PHP may send ahead when it pushes them, or 0 if
+    # the bridge doesn't support that
+    iteration_window = 4
+    # Whether send_command returns awaitables instead of results
+    asynchronous = False
+    # The maximum number of garbage keys sent along with a single command
+    garbage_chunk_size = 10000
+    # Send garbage right away once this many keys are waiting
+    garbage_flush_count = 10000
+    # Or, with the garbage timer, once garbage has waited this many seconds
+    garbage_flush_age = 5.0
+
+    def __init__(self, input_: IO[bytes], output: IO[bytes],
+                 name: str) -> None:
         self.input = input_
         self.output = output
+        self.codec = wire.JSONCodec()  # type: wire.Codec
         self.classes = {}        # type: Dict[str, objects.PHPClass]
         self.functions = {}      # type: Dict[str, Callable]
         self.constants = {}      # type: Dict[str, Any]
         self.cache = ChainMap(self.classes, self.functions, self.constants)
-        self._remotes = {}       # type: Dict[Union[int, str], finalize]
-        self._collected = set()  # type: Set[Union[int, str]]
+        self._remotes = {}       # type: Dict[int, finalize]
+        self._collected = set()  # type: Set[int]
+        # When the oldest garbage that wasn't sent yet was collected
+        self._garbage_since = None  # type: Optional[float]
+        self._confirmed = 0
+        self._garbage_timer = None  # type: Optional[threading.Event]
+        # Held while a command is sent and its result is decoded, so that the
+        # garbage timer can tell whether the bridge is in use
+        self._lock = threading.RLock()
+        # The server sends each class name once, and then refers to it by
+        # its position in this list
+        self._class_names = []   # type: List[str]
+        # The class names of objects, by key
+        self._key_classes = {}   # type: Dict[int, str]
+        self._batch = None       # type: Optional[batching.Batch]
+        self._scope = None       # type: Optional[scopes.Scope]
+        # Requests for pushed chunks, with the number of chunks that may
+        # still arrive for each
+        self._pushes = deque()   # type: Deque[List[Any]]
+        # Iterators holding pushed chunks that weren't decoded yet. The
+        # chunks may refer to objects whose proxies were collected, so no
+        # garbage is sent until they're decoded or the iterators are gone.
+        self._undecoded = WeakSet()  # type: WeakSet[Any]
+        # How many responses are being decoded right now
+        self._decoding_depth = 0
+        self.metadata_cache = None  # type: Optional[metacache.AnyCache]
+        # Class info that was sent along with another class's info
+        self._prefetched = {}    # type: Dict[str, Dict[str, Any]]
+        self._prebuilt = None    # type: Optional[prebuilt.Prebuilt]
+        # Names that resolved to nothing, and the generation of the server's
+        # name index when that happened
+        self._missing = set()    # type: Set[str]
+        self._names_generation = None  # type: Optional[int]
+        # How deeply to send objects by value, for the current commands
+        self._by_value = 0
+        # Whether lists of numbers in results are sent packed
+        self._buffers = False
+        # Strings in results longer than this are sent as streams, if it's
+        # not 0
+        self._stream_strings = 0
         self._debug = False
         self.__name__ = name
 
     def send(self, command: str, data: Any) -> None:
+        self.codec.write(self.input, self.make_message(command, data))
+
+    def make_message(self, command: str, data: Any) -> Dict[str, Any]:
+        """Build a command message, including the garbage to collect."""
         if self._debug:
             print(command, data)
-        garbage = list(self._collected.copy())
+        if self._missing and command not in _name_neutral_commands:
+            # The command might declare new names
+            self._missing.clear()
+        if self._collected and self._may_send_garbage():
+            garbage = list(islice(self._collected, self.garbage_chunk_size))
+            # Whatever is left gets a new chance to wait
+            self._garbage_since = (None if len(garbage) == len(self._collected)
+                                   else time.monotonic())
+        else:
+            garbage = []
         if self._debug and garbage:
             print("Asking to collect {}".format(garbage))
-        json.dump({'cmd': command,
+        message = {'cmd': command,
                    'data': data,
-                   'garbage': garbage},
-                  self.input)
-        self.input.write('\n')
-        self.input.flush()
+                   'garbage': garbage}
+        if self._by_value:
+            message['byValue'] = self._by_value
+        if self._buffers:
+            message['buffers'] = True
+        if self._stream_strings:
+            message['streamStrings'] = self._stream_strings
+        return message
+
+    def _may_send_garbage(self) -> bool:
+        """Return whether garbage can be sent with the next command."""
+        return not (self._decoding_depth or self._undecoded)
+
+    @contextmanager
+    def _decoding(self) -> Iterator[None]:
+        """Hold back garbage until the responses received inside are decoded.
+
+        Decoding can send commands, and the garbage timer can send garbage at
+        any time. The garbage may include objects that are in the responses.
+        """
+        with self._lock:
+            self._decoding_depth += 1
+            try:
+                yield
+            finally:
+                self._decoding_depth -= 1
+
+    def exchange(self, command: str, data: Any) -> Any:
+        """Send a command and return the data of its response."""
+        # The response would arrive after the pushed chunks, and PHP can't
+        # read a long command while it's blocked writing them
+        while self._pushes:
+            self.receive_push()
+        self.send(command, data)
+        return self.receive()
+
+    def push_iteration(self, iterator: iteration.PushedIterator,
+                       count: int) -> None:
+        """Let PHP send chunks of a generator without being asked."""
+        with self._lock:
+            if self._batch is not None:
+                # The queued commands come first, and their response can't
+                # arrive in the middle of the chunks
+                self._batch.flush()
+            self.send('pushIteration',
+                      {'obj': self.encode(iterator.generator),
+                       'size': iterator.chunk_size,
+                       'count': count})
+            self._pushes.append([iterator, count])
+
+    def receive_push(self) -> None:
+        """Receive a single chunk that PHP pushed, and hand it over."""
+        with self._lock:
+            response = self.codec.read(self.output)
+            if self._debug:
+                print(response)
+            self.confirm_collected(response['collected'])
+            self.learn_keys(response)
+            request = self._pushes[0]
+            iterator = request[0]
+            request[1] -= 1
+            unsent = 0
+            if response['type'] != 'result' or response['data']['done']:
+                # PHP stops after the last chunk or an exception
+                unsent, request[1] = request[1], 0
+            if not request[1]:
+                self._pushes.popleft()
+            iterator.receive(response, unsent)
 
     def receive(self) -> Any:
-        line = self.output.readline()
+        response = self.codec.read(self.output)
         if self._debug:
-            print(line, end='')
-        if not line:
-            # Empty response, not even a newline
-            raise RuntimeError("Connection closed")
-        response = json.loads(line)
-        for key in response['collected']:
-            if self._debug:
+            print(response)
+        self.confirm_collected(response['collected'])
+        self.learn_keys(response)
+        return self.unpack_response(response)
+
+    def learn_keys(self, response: Dict[str, Any]) -> None:
+        """Remember the classes of the new objects in a response.
+
+        This has to be done for every response, in the order they arrive.
+        """
+        self._class_names.extend(response.get('classes', ()))
+        for key, class_id in response.get('keys', ()):
+            self._key_classes[key] = self._class_names[class_id]
+
+    def confirm_collected(self, keys: Iterable[int]) -> None:
+        """Forget about garbage that the server has collected."""
+        if self._debug:
+            for key in keys:
                 print("Confirmed {} collected".format(key))
-            if key in self._collected:
-                self._collected.remove(key)
-            else:
-                if self._debug:
+                if key not in self._collected:
                     print("But {} is not pending collection".format(key))
+        self._collected.difference_update(keys)
+        self._forget_keys(keys)
+
+    def _forget_keys(self, keys: Iterable[int]) -> None:
+        # Keys aren't reused, so their classes aren't needed anymore
+        for key in keys:
+            self._key_classes.pop(key, None)
+            self._confirmed += 1
+
+    def unpack_response(self, response: dict) -> Any:
+        """Return the data of a response, or raise the exception it holds."""
         if response['type'] == 'exception':
             try:
                 exception = self.decode(response['data']['value'])
@@ -73,7 +235,10 @@ class PHPBridge:
             raise Exception("Received response with unknown type {}".format(
                 response['type']))
 
-    def encode(self, data: Any) -> dict:
+    def encode(self, data: Any) -> Any:
+        if self.codec.native:
+            return self._encode_native(data)
+
         if isinstance(data, str):
             try:
                 data.encode()
@@ -105,28 +270,43 @@ class PHPBridge:
         if isinstance(data, dict) and all(
                 isinstance(key, str) or isinstance(key, int)
                 for key in data):
+            if _is_plain(data.values()):
+                return {'type': 'scalars', 'value': dict(data.items())}
             return {'type': 'array', 'value': {k: self.encode(v)
                                                for k, v in data.items()}}
         if isinstance(data, list):
+            if _is_plain(data):
+                return {'type': 'scalars', 'value': list(data)}
             return {'type': 'array', 'value': [self.encode(item)
                                                for item in data]}
 
+        if _is_buffer(data):
+            numbers = _pack_buffer(data)
+            if numbers is None:
+                return self.encode(data.tolist())
+            return {'type': 'numbers',
+                    'value': {'format': numbers.format,
+                              'data': base64.b64encode(
+                                  numbers.data).decode()}}
+
         if isinstance(data, objects.PHPObject) and data._bridge is self:
-            return {'type': 'object',
-                    'value': {'class': data.__class__._name,  # type: ignore
-                              'hash': data._hash}}
+            if self._batch is not None:
+                self._batch.keep(data)
+            return {'type': 'object', 'value': data._hash}
 
         if isinstance(data, objects.PHPResource) and data._bridge is self:
+            if self._batch is not None:
+                self._batch.keep(data)
             return {'type': 'resource',
                     'value': {'type': data._type,
-                              'hash': data._id}}
+                              'hash': -data._id}}
 
         if isinstance(data, objects.PHPClass) and data._bridge is self:
             # PHP uses strings to represent functions and classes
             # This unfortunately means they will be strings if they come back
             return {'type': 'string', 'value': data._name}
 
-        if (isinstance(data, types.FunctionType) and
+        if (isinstance(data, (functions.PHPFunction, types.FunctionType)) and
                 getattr(data, '_bridge', None) is self):
             return {'type': 'string', 'value': data.__name__}
 
@@ -134,9 +314,68 @@ class PHPBridge:
                 getattr(data.__self__, '_bridge', None) is self):
             return self.encode([data.__self__, data.__name__])
 
+        if isinstance(data, batching.Deferred) and data._bridge is self:
+            return data._encode()
+
+        raise RuntimeError("Can't encode {!r}".format(data))
+
+    def _encode_native(self, data: Any) -> Any:
+        """Encode a value for a codec that supports native values."""
+        if type(data) in _native_types:
+            return data
+
+        if isinstance(data, dict) and all(
+                isinstance(key, str) or isinstance(key, int)
+                for key in data):
+            if wire.scalar_type(data.values()) is not None:
+                return dict(data.items())
+            return {k: self._encode_native(v) for k, v in data.items()}
+        if isinstance(data, list):
+            if wire.scalar_type(data) is not None:
+                return list(data)
+            return [self._encode_native(item) for item in data]
+
+        if _is_buffer(data):
+            numbers = _pack_buffer(data)
+            if numbers is None:
+                return self._encode_native(data.tolist())
+            return numbers
+
+        if isinstance(data, objects.PHPObject) and data._bridge is self:
+            if self._batch is not None:
+                self._batch.keep(data)
+            return wire.ObjectHandle(data._hash)
+
+        if isinstance(data, objects.PHPResource) and data._bridge is self:
+            if self._batch is not None:
+                self._batch.keep(data)
+            return wire.ResourceHandle(-data._id, data._type)
+
+        if isinstance(data, objects.PHPClass) and data._bridge is self:
+            return data._name
+
+        if (isinstance(data, (functions.PHPFunction, types.FunctionType)) and
+                getattr(data, '_bridge', None) is self):
+            return data.__name__
+
+        if (isinstance(data, types.MethodType) and
+                getattr(data.__self__, '_bridge', None) is self):
+            return [self._encode_native(data.__self__), data.__name__]
+
+        if isinstance(data, batching.Deferred) and data._bridge is self:
+            return data._encode()
+
+        # Subclasses of basic types
+        for type_ in _native_types:
+            if type_ is not type(None) and isinstance(data, type_):
+                return type_(data)
+
         raise RuntimeError("Can't encode {!r}".format(data))
 
-    def decode(self, data: dict) -> Any:
+    def decode(self, data: Any) -> Any:
+        if self.codec.native:
+            return self._decode_native(data)
+
         type_ = data['type']
         value = data['value']
         if type_ in {'string', 'integer', 'NULL', 'boolean'}:
@@ -155,11 +394,25 @@ class PHPBridge:
             elif isinstance(value, dict):
                 return Array((key, self.decode(item))
                              for key, item in value.items())
+        elif type_ == 'scalars':
+            # The values don't need decoding
+            if isinstance(value, list):
+                return Array.list(value)
+            elif isinstance(value, dict):
+                return Array(value.items())
+        elif type_ == 'numbers':
+            return wire.to_array(wire.Numbers(
+                value['format'], base64.b64decode(value['data'])))
         elif type_ == 'object':
-            cls = self.get_class(value['class'])
-            return self.get_object(cls, value['hash'])
+            return self._decode_object(value)
         elif type_ == 'resource':
             return self.get_resource(value['type'], value['hash'])
+        elif type_ == 'value':
+            properties = value['properties'] or {}
+            return values.make_value(
+                value['class'],
+                {name: self.decode(item)
+                 for name, item in properties.items()})
         elif type_ == 'bytes':
             # PHP's strings are just byte arrays
             # Decoding this to a bytes object would be problematic
@@ -169,13 +422,394 @@ class PHPBridge:
             return value.decode(errors='surrogateescape')
         raise RuntimeError("Unknown type {!r}".format(type_))
 
+    def _decode_native(self, data: Any) -> Any:
+        """Decode a value sent by a codec that supports native values."""
+        type_ = type(data)
+        if type_ is list:
+            return Array.list(map(self._decode_native, data))
+        elif type_ is dict:
+            return Array((str(key), self._decode_native(item))
+                         for key, item in data.items())
+        elif type_ is wire.Scalars:
+            return Array.list(data)
+        elif type_ is wire.ScalarMap:
+            return Array(zip(map(str, data), data.values()))
+        elif type_ is wire.Numbers:
+            return wire.to_array(data)
+        elif type_ is wire.ObjectHandle:
+            return self._decode_object(data.key)
+        elif type_ is wire.ResourceHandle:
+            return self.get_resource(data.type, data.key)
+        elif type_ is wire.ObjectValue:
+            return values.make_value(
+                data.cls,
+                {name: self._decode_native(item)
+                 for name, item in data.properties.items()})
+        return data
+
+    def _decode_object(self, key: int) -> objects.PHPObject:
+        obj = self._lookup(key)
+        if obj is not None:
+            return obj          # type: ignore
+        return self.get_object(self.get_class(self._key_classes[key]), key)
+
     def send_command(self, cmd: str, data: Any = None,
                      decode: bool = False) -> Any:
-        self.send(cmd, data)
-        result = self.receive()
-        if decode:
-            result = self.decode(result)
-        return result
+        with self._lock:
+            if self._batch is not None:
+                if cmd in batching.deferrable_commands:
+                    return self._batch.add(cmd, data, decode)
+                # Other commands are needed right away, but they may depend
+                # on the commands that were queued before them
+                self._batch.flush()
+            result = self.exchange(cmd, data)
+            if not decode:
+                # The caller decodes the result, which has to happen before
+                # the garbage is flushed
+                return result
+            with self._decoding():
+                result = self.decode(result)
+            if len(self._collected) >= self.garbage_flush_count:
+                self.flush_garbage()
+            return result
+
+    def negotiate_codec(self, names: Iterable[str]) -> str:
+        """Switch to the first codec from a list that both sides support.
+
+        Returns the name of the codec that's used afterwards. If the server
+        doesn't support any of them, the current codec is kept.
+        """
+        names = [name for name in names if name in wire.codecs]
+        if self.codec.name in names[:1]:
+            return self.codec.name
+        try:
+            chosen = self.send_command('setCodec', names)
+        except Exception:
+            return self.codec.name
+        self.codec = wire.codecs[chosen]()
+        return chosen
+
+    def map(self, func: Any, *iterables: Iterable[Any],
+            chunksize: Optional[int] = None,
+            return_exceptions: bool = True) -> Iterator[Any]:
+        """Call a PHP function or method for each item, like map.
+
+        See starmap.
+        """
+        return self.starmap(func, zip(*iterables), chunksize=chunksize,
+                            return_exceptions=return_exceptions)
+
+    def starmap(self, func: Any, iterable: Iterable[Iterable[Any]],
+                chunksize: Optional[int] = None,
+                return_exceptions: bool = True) -> Iterator[Any]:
+        """Call a PHP function or method for each tuple of arguments.
+
+        func can be a function, a bound method, a function name or an
+        invokable object. The calls are sent chunksize at a time, in a
+        single command per chunk, and the results are yielded in order.
+
+        If a call throws an exception, it's yielded in place of the result,
+        unless return_exceptions is False. Keyword arguments can't be used.
+        """
+        if self.asynchronous:
+            raise TypeError("map can't be used with an asynchronous bridge")
+        if chunksize is None:
+            chunksize = self.map_chunk_size
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1")
+        cmd, target = self._bulk_target(func)
+        iterator = iter(iterable)
+        while True:
+            chunk = list(islice(iterator, chunksize))
+            if not chunk:
+                return
+            data = dict(target)
+            data['args'] = [[self.encode(arg) for arg in args]
+                            for args in chunk]
+            with self._lock:
+                responses = self.send_command(cmd, data)
+                with self._decoding():
+                    results = [self._unpack_call(response)
+                               for response in responses]
+            for response, result in zip(responses, results):
+                if response['type'] != 'result' and not return_exceptions:
+                    raise result
+                yield result
+
+    def _bulk_target(self, func: Any) -> Any:
+        """Get the command and data for calling func on many arguments."""
+        if isinstance(func, str):
+            return 'callFunMany', {'name': func}
+        if (isinstance(func, (functions.PHPFunction, types.FunctionType)) and
+                getattr(func, '_bridge', None) is self):
+            return 'callFunMany', {'name': func.__name__}
+        if (isinstance(func, types.MethodType) and
+                getattr(func.__self__, '_bridge', None) is self):
+            return 'callMethodMany', {'obj': self.encode(func.__self__),
+                                      'name': func.__name__}
+        if isinstance(func, objects.PHPObject) and func._bridge is self:
+            return 'callMethodMany', {'obj': self.encode(func),
+                                      'name': '__invoke'}
+        raise TypeError("Can't call {!r} in bulk".format(func))
+
+    def _unpack_call(self, response: Dict[str, Any]) -> Any:
+        """Decode the result of a call, or the exception it threw."""
+        if response['type'] == 'result':
+            return self.decode(response['data'])
+        try:
+            return self.unpack_response(response)
+        except Exception as exception:
+            return exception
+
+    def batch(self) -> batching.Batch:
+        """Queue commands and send them together in a single message.
+
+        Use as a context manager. Inside the block, calls return Deferred
+        placeholders instead of results. The placeholders can be passed to
+        later calls in the same batch. All queued commands are sent when the
+        block exits, after which the placeholders hold the results.
+        """
+        return batching.Batch(self)
+
+    def scope(self) -> scopes.Scope:
+        """Release the objects and resources created inside a with block.
+
+        When the block exits, PHP is told right away to forget every object
+        that got a proxy inside it, even if the proxy is still alive. Use
+        the scope's keep() method for objects that are needed afterwards.
+        """
+        return scopes.Scope(self)
+
+    def chain(self, value: Any) -> expressions.Expression:
+        """Record a chain of operations on a PHP value.
+
+        Attribute accesses, calls and item accesses on the result are
+        recorded, and sent as a single command when its _run() method is
+        called. The objects in between never get proxies.
+        """
+        return expressions.Expression(self, value)
+
+    def release(self, keys: Iterable[int]) -> None:
+        """Mark objects and resources as garbage, even if they have proxies.
+
+        The proxies stop working once the garbage is sent.
+        """
+        for key in keys:
+            ref = self._remotes.get(key)
+            if ref is not None and ref.detach() is not None:
+                del self._remotes[key]
+                if self._garbage_since is None:
+                    self._garbage_since = time.monotonic()
+                self._collected.add(key)
+
+    def flush_garbage(self) -> None:
+        """Send the pending garbage now instead of with the next command.
+
+        It's split over as many messages as garbage_chunk_size requires. A
+        batch that's being built is sent first, because its commands may
+        still use some of the garbage.
+        """
+        with self._lock:
+            if self._batch is not None:
+                self._batch.flush()
+            if not self._may_send_garbage():
+                return
+            chunks = -(-len(self._collected) // self.garbage_chunk_size)
+            for _ in range(chunks):
+                self.exchange('collectGarbage', None)
+
+    def garbage_due(self) -> bool:
+        """Return whether garbage should be sent right away.
+
+        That's the case if there's enough of it, or if it has waited long
+        enough, to not wait for the next command.
+        """
+        if not self._collected:
+            return False
+        if len(self._collected) >= self.garbage_flush_count:
+            return True
+        since = self._garbage_since
+        return (since is not None and
+                time.monotonic() - since >= self.garbage_flush_age)
+
+    def start_garbage_timer(self, interval: float = 1.0) -> None:
+        """Check for due garbage regularly in a background thread.
+
+        Without the timer, garbage is only sent along with commands, so
+        nothing is freed while the bridge is idle. The timer doesn't
+        interrupt commands that are in progress.
+        """
+        self.stop_garbage_timer()
+        stop = threading.Event()
+        self._garbage_timer = stop
+        threading.Thread(target=self._run_garbage_timer,
+                         args=(interval, stop), daemon=True).start()
+
+    def stop_garbage_timer(self) -> None:
+        """Stop checking for due garbage, if the timer is running."""
+        if self._garbage_timer is not None:
+            self._garbage_timer.set()
+            self._garbage_timer = None
+
+    def _run_garbage_timer(self, interval: float,
+                           stop: threading.Event) -> None:
+        while not stop.wait(interval):
+            if not self.garbage_due():
+                continue
+            if not self._lock.acquire(blocking=False):
+                # The garbage goes along with whatever is being sent
+                continue
+            if ((self._batch is not None and self._batch.commands) or
+                    not self._may_send_garbage()):
+                # Or along with the batch, once it's done, or once pushed
+                # chunks are decoded
+                self._lock.release()
+                continue
+            try:
+                self.flush_garbage()
+            except Exception:
+                # The connection is probably gone
+                return
+            finally:
+                self._lock.release()
+
+    def handle_stats(self) -> Dict[str, int]:
+        """Count the remote objects and resources.
+
+        'live' is the number that have proxies, 'pending' the number that
+        were garbage collected but not confirmed by the server yet, and
+        'confirmed' the total number the server has let go of.
+        """
+        return {'live': len(self._remotes),
+                'pending': len(self._collected),
+                'confirmed': self._confirmed}
+
+    @contextmanager
+    def by_value(self, depth: int = 1) -> Iterator[None]:
+        """Send objects in results by value, inside a with block.
+
+        Objects are nested up to depth levels deep. Deeper objects are sent
+        as references. See phpbridge.values.
+        """
+        outer = self._by_value
+        self._by_value = depth
+        try:
+            yield
+        finally:
+            self._by_value = outer
+
+    @contextmanager
+    def buffers(self) -> Iterator[None]:
+        """Get lists of numbers as array.array objects, inside a with block.
+
+        PHP packs lists of ints and floats into a single binary string,
+        which is copied into an array in one step instead of being decoded
+        value by value. numpy.frombuffer can use the array without copying
+        it.
+        """
+        outer = self._buffers
+        self._buffers = True
+        try:
+            yield
+        finally:
+            self._buffers = outer
+
+    @contextmanager
+    def stream_strings(self, threshold: int = streams.default_buffer_size
+                       ) -> Iterator[None]:
+        """Get long strings as streams, inside a with block.
+
+        Strings in results that are longer than threshold bytes are put in a
+        temporary stream on the PHP side, and come back as a stream
+        resource. Use its open() method to read it in bounded chunks instead
+        of receiving it in a single message.
+
+        This only applies to strings that PHP sends. Strings passed to PHP
+        are always sent whole. To move a long one in chunks, write it to a
+        stream like php://temp with open_stream() instead.
+        """
+        if threshold <= 0:
+            raise ValueError("threshold must be positive")
+        outer = self._stream_strings
+        self._stream_strings = threshold
+        try:
+            yield
+        finally:
+            self._stream_strings = outer
+
+    def set_value_class(self, cls: Union[str, objects.PHPClass],
+                        enabled: bool = True) -> None:
+        """Always send objects of a class and its subclasses by value."""
+        if isinstance(cls, objects.PHPClass):
+            cls = cls._name
+        self.send_command('setValueClass', {'name': cls, 'enabled': enabled})
+
+    def set_value_depth(self, depth: int) -> None:
+        """Set how deeply objects of value classes are nested.
+
+        Deeper objects are sent as references. The default is 8.
+        """
+        self.send_command('setValueDepth', depth)
+
+    def enable_metadata_cache(self, path: Optional[str] = None,
+                              project: Optional[str] = None) -> None:
+        """Store class and function reflection data on disk.
+
+        If path is None, a directory in the user's cache directory is used.
+        Entries are only shared by bridges with the same project, which is
+        PHP's working directory if it's None.
+        """
+        if path is None:
+            path = metacache.default_path()
+        if project is None:
+            project = self.send_command(
+                'callFun', {'name': 'getcwd', 'args': []}, decode=True) or ''
+        self.metadata_cache = metacache.MetadataCache(
+            path, self.get_const('PHP_VERSION'), self.codec.name, project)
+
+    def use_prebuilt(self, package: str) -> None:
+        """Take names and reflection data from a generated package.
+
+        The package is made by phpbridge.prebuilt.generate. Names that
+        aren't in it, or whose files changed since it was generated, are
+        still resolved by asking PHP.
+        """
+        self._prebuilt = prebuilt.Prebuilt(self, package)
+
+    def reflect(self, kind: str, name: str) -> Dict[str, Any]:
+        """Get the result of classInfo or funcInfo, from the cache if possible.
+        """
+        if kind == 'classInfo' and name in self._prefetched:
+            return self._prefetched.pop(name)
+        if self._prebuilt is not None:
+            info = self._prebuilt.info(kind, name)
+            if info is not None:
+                return info
+        cache = self.metadata_cache
+        if cache is not None:
+            info = cache.get(kind, name)
+            if info is not None:
+                return info
+        if kind == 'classInfo':
+            # Get the ancestors as well, because they'll be needed right away
+            infos = self.send_command(
+                'classInfoClosure',
+                {'name': name,
+                 'known': list(self.classes) + list(self._prefetched)})
+            info = infos[0]
+            for ancestor in infos[1:]:
+                self._prefetched[ancestor['name']] = ancestor
+                if cache is not None:
+                    cache.put(kind, ancestor['name'], ancestor)
+        else:
+            info = self.send_command(kind, name)
+        if cache is not None:
+            cache.put(kind, name, info)
+        return info             # type: ignore
+
+    def list_names(self, path: str) -> List[str]:
+        """List the names in a namespace, for dir()."""
+        return self.send_command('listNames', path)  # type: ignore
 
     def resolve(self, path: str, name: str) -> Any:
         if path:
@@ -183,8 +817,18 @@ class PHPBridge:
 
         if name in self.cache:
             return self.cache[name]
+        elif name in self._missing:
+            raise AttributeError("Nothing named '{}' found".format(name))
         else:
-            kind = self.send_command('resolveName', name)
+            kind = None  # type: Optional[str]
+            if self._prebuilt is not None:
+                kind = self._prebuilt.kind(name)
+            if kind is None:
+                resolved = self.send_command('resolveName', name)
+                kind = resolved['kind']
+                if resolved['generation'] != self._names_generation:
+                    self._missing.clear()
+                    self._names_generation = resolved['generation']
 
         if kind == 'class':
             return self.get_class(name)
@@ -195,6 +839,7 @@ class PHPBridge:
         elif kind == 'global':
             return self.get_global(name)
         elif kind == 'none':
+            self._missing.add(name)
             raise AttributeError("Nothing named '{}' found".format(name))
         else:
             raise RuntimeError("Resolved unknown data type {}".format(kind))
@@ -219,32 +864,37 @@ class PHPBridge:
         return self.send_command('getGlobal', name, decode=True)
 
     def get_object(self, cls: objects.PHPClass,
-                   hash_: str) -> objects.PHPObject:
-        obj = self._lookup(hash_)
+                   key: int) -> objects.PHPObject:
+        obj = self._lookup(key)
         if obj is not None:
             return obj          # type: ignore
         new_obj = super(objects.PHPObject, cls).__new__(cls)  # type: ignore
-        object.__setattr__(new_obj, '_hash', hash_)
-        self._register(hash_, new_obj)
+        object.__setattr__(new_obj, '_hash', key)
+        self._register(key, new_obj)
         return new_obj          # type: ignore
 
-    def get_resource(self, type_: str, id_: int) -> objects.PHPResource:
-        resource = self._lookup(id_)
+    def get_resource(self, type_: str, key: int) -> objects.PHPResource:
+        resource = self._lookup(key)
         if resource is not None:
             return resource     # type: ignore
-        new_resource = objects.PHPResource(self, type_, id_)
-        self._register(id_, new_resource)
+        # The key is the negated resource ID
+        new_resource = objects.PHPResource(self, type_, -key)
+        self._register(key, new_resource)
         return new_resource
 
-    def _register(self, ident: Union[int, str],
+    def _register(self, ident: int,
                   entity: Union[objects.PHPResource,
                                 objects.PHPObject]) -> None:
         """Register an object or resource with a weakref."""
         if self._debug:
             print("Registering {}".format(ident))
         self._remotes[ident] = finalize(entity, self._collect, ident)
+        if self._scope is not None:
+            self._scope.keys.add(ident)
+        # If it was about to be reported as garbage, PHP still has it
+        self._collected.discard(ident)
 
-    def _lookup(self, ident: Union[int, str]) -> Optional[
+    def _lookup(self, ident: int) -> Optional[
             Union[objects.PHPResource, objects.PHPObject]]:
         """Look up an existing object for a remote entity."""
         try:
@@ -256,12 +906,73 @@ class PHPBridge:
             return None
         return contents[0]
 
-    def _collect(self, ident: Union[int, str]) -> None:
+    def _collect(self, ident: int) -> None:
         """Mark an object or resource identifier as garbage collected."""
         if self._debug:
             print("Lost {}".format(ident))
+        ref = self._remotes.get(ident)
+        if ref is not None and ref.alive:
+            # A new proxy was already made for the same remote entity
+            return
+        if self._garbage_since is None:
+            self._garbage_since = time.monotonic()
         self._collected.add(ident)
-        del self._remotes[ident]
+        self._remotes.pop(ident, None)
+
+
+# Commands that can't declare new names. Any other command can run arbitrary
+# code, so names that couldn't be resolved before have to be looked up again.
+# resolveName is included because it reports changes itself.
+_name_neutral_commands = {
+    'resolveName', 'listEverything', 'listNames', 'listNamespaces',
+    'listConsts', 'listGlobals', 'listFuns', 'listClasses', 'getConst',
+    'getGlobal', 'funcInfo', 'setCodec', 'setValueClass', 'setValueDepth',
+    'collectGarbage'
+}                               # type: Set[str]
+
+_native_types = {str, int, float, bool, bytes, type(None)}
+
+
+def _is_buffer(data: Any) -> bool:
+    """Return whether a value is a buffer of numbers, like a NumPy array."""
+    # Looking at the type avoids asking PHP objects for a property
+    return (isinstance(data, (array.array, memoryview)) or
+            hasattr(type(data), '__array_interface__'))
+
+
+def _pack_buffer(data: Any) -> Optional[wire.Numbers]:
+    """Send the contents of a buffer as they are, if PHP can unpack them."""
+    try:
+        view = memoryview(data)
+    except (TypeError, ValueError):
+        # NumPy can't do this for arrays of objects, for example
+        return None
+    if view.ndim != 1:
+        return None
+    format_ = wire.php_format(view.format, view.itemsize)
+    if format_ is None:
+        return None
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return wire.Numbers(format_, view)
+
+
+def _is_plain(values: Iterable[Any]) -> bool:
+    """Return whether values can be sent as plain JSON, without tags.
+
+    They have to be of the same scalar type, and JSON has to be able to
+    represent them exactly.
+    """
+    type_ = wire.scalar_type(values)
+    if type_ is float:
+        return all(map(math.isfinite, values))
+    elif type_ is str:
+        try:
+            ''.join(values).encode()
+        except UnicodeEncodeError:
+            # Surrogates, which stand for bytes that aren't UTF-8
+            return False
+    return type_ is not None
 
 
 class Array(OrderedDict):
@@ -305,9 +1016,11 @@ class Array(OrderedDict):
 
     @classmethod
     def list(cls, iterable: Iterable) -> 'Array':
-        """Create by taking values from a list and using indexes as keys."""
-        return cls((str(ind), item)  # type: ignore
-                   for ind, item in enumerate(iterable))
+        """Create by taking values from a list and using indexes as keys.
+
+        The result is a PackedArray.
+        """
+        return PackedArray(iterable)
 
     def __repr__(self) -> str:
         if self and self.listable():
@@ -316,7 +1029,104 @@ class Array(OrderedDict):
         return super().__repr__()
 
 
-def start_process_unix(fname: str, name: str) -> PHPBridge:
+class PackedArray(Array):
+    """An Array with the keys 0, 1, 2 and so on.
+
+    This is what PHP calls a packed array. Because the keys are known,
+    negative indexes and slices only look up the values they need, and
+    listable() doesn't have to check every key. As soon as the keys stop
+    being sequential, the array turns into a regular Array.
+    """
+    def __init__(self, iterable: Iterable[Any] = ()) -> None:
+        super().__init__()
+        for ind, item in enumerate(iterable):
+            OrderedDict.__setitem__(self, str(ind), item)
+
+    def _position(self, key: Any) -> Optional[int]:
+        """Return the index a key refers to, or None if it's not a valid
+        key for a packed array."""
+        if isinstance(key, str):
+            # isdigit() allows characters like '²' that int() rejects
+            if not key.isdecimal():
+                return None
+            position = int(key)
+            if str(position) != key:
+                return None
+            return position
+        if isinstance(key, int) and not isinstance(key, bool) and key >= 0:
+            return key
+        return None
+
+    def _unpack(self) -> None:
+        """Turn into a regular Array."""
+        self.__class__ = Array  # type: ignore
+
+    def __getitem__(self, index: Union[int, str, slice]) -> Any:
+        if isinstance(index, slice):
+            return [OrderedDict.__getitem__(self, str(ind))
+                    for ind in range(*index.indices(len(self)))]
+        if isinstance(index, int) and index < 0:
+            if index < -len(self):
+                raise IndexError("list index out of range")
+            index += len(self)
+        return super().__getitem__(index)
+
+    def __setitem__(self, index: Union[int, str], value: Any) -> None:
+        position = self._position(index)
+        if position is None or position > len(self):
+            self._unpack()
+            self[index] = value
+        else:
+            OrderedDict.__setitem__(self, str(position), value)
+
+    def __delitem__(self, index: Union[int, str]) -> None:
+        position = self._position(index)
+        if position is None or position != len(self) - 1:
+            # Unless it's the last key, the keys that are left aren't
+            # sequential anymore
+            self._unpack()
+        Array.__delitem__(self, index)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        position = self._position(key)
+        if position is None:
+            return default
+        return OrderedDict.get(self, str(position), default)
+
+    def copy(self) -> 'PackedArray':
+        return PackedArray(self.values())
+
+    def listable(self) -> bool:
+        return True
+
+    def __reduce__(self) -> Any:
+        return (PackedArray, (list(self.values()),))
+
+    def __repr__(self) -> str:
+        if self:
+            return "Array.list({!r})".format(list(self.values()))
+        return "Array()"
+
+    # Anything else can change the keys, and is rarely used
+    def pop(self, *args: Any) -> Any:
+        self._unpack()
+        return self.pop(*args)
+
+    def popitem(self, *args: Any) -> Any:
+        self._unpack()
+        return self.popitem(*args)
+
+    def setdefault(self, *args: Any) -> Any:
+        self._unpack()
+        return self.setdefault(*args)
+
+    def move_to_end(self, *args: Any) -> Any:
+        self._unpack()
+        return self.move_to_end(*args)
+
+
+def start_process_unix(fname: str, name: str,
+                       cls: Type[PHPBridge] = PHPBridge) -> PHPBridge:
     """Start a server.php bridge using two pipes.
 
     pass_fds is not supported on Windows. It may be that some other way to
@@ -330,23 +1140,34 @@ def start_process_unix(fname: str, name: str) -> PHPBridge:
              pass_fds=[0, 1, 2, php_in, php_out])
     os.close(php_in)
     os.close(php_out)
-    return PHPBridge(os.fdopen(py_in, 'w'), os.fdopen(py_out, 'r'), name)
+    return cls(os.fdopen(py_in, 'wb'), os.fdopen(py_out, 'rb'), name)
 
 
-def start_process_windows(fname: str, name: str) -> PHPBridge:
+def start_process_windows(fname: str, name: str,
+                          cls: Type[PHPBridge] = PHPBridge) -> PHPBridge:
     """Start a server.php bridge over stdin and stderr."""
     proc = sp.Popen(['php', fname, 'php://stdin', 'php://stderr'],
-                    stdin=sp.PIPE, stderr=sp.PIPE,
-                    universal_newlines=True)
-    return PHPBridge(proc.stdin, proc.stderr, name)
+                    stdin=sp.PIPE, stderr=sp.PIPE)
+    return cls(proc.stdin, proc.stderr, name)
 
 
 def start_process(fname: str = php_server_path,
-                  name: str = 'php') -> PHPBridge:
-    """Start server.php and open a bridge to it."""
+                  name: str = 'php',
+                  codecs: Iterable[str] = ('json',),
+                  cls: Type[PHPBridge] = PHPBridge) -> PHPBridge:
+    """Start server.php and open a bridge to it.
+
+    The first codec in codecs that the server supports is used. Pass
+    ('binary', 'json') to try the binary codec, which isn't the default
+    because it's slower than JSON and no smaller for most traffic. cls can
+    be a subclass of PHPBridge to use instead.
+    """
     if sys.platform.startswith('win32'):
-        return start_process_windows(fname, name)
-    return start_process_unix(fname, name)
+        bridge = start_process_windows(fname, name, cls)
+    else:
+        bridge = start_process_unix(fname, name, cls)
+    bridge.negotiate_codec(codecs)
+    return bridge
 
 
 modules.NamespaceFinder(start_process, 'php').register()
@@ -0,0 +1,441 @@
+"""A bridge for use with asyncio.
+
+The synchronous bridge sends a command and then blocks until the response
+arrives, so only one command can be in flight at a time. AsyncPHPBridge gives
+every command an ID and returns a future right away, so many commands can be
+in flight at once. The server handles them in order, and a single task reads
+the responses and hands them to the right futures.
+
+The same proxy classes and functions are used as with the synchronous bridge.
+Calling a function or method, creating an object and getting a property
+return awaitables:
+
+    bridge = await start_process_async()
+    strlen = await bridge.load('strlen')
+    await strlen('foo')
+    date = await (await bridge.load('DateTime'))('2018-05-03')
+    await date.format('Y-m-d')
+
+Python needs some answers right away, like lengths and truth values, and
+those don't work. Reprs don't show the contents of objects. Names have to be
+loaded with load() before they can be used through namespaces.
+
+Scopes and by_value, buffers and stream_strings blocks only apply to the
+task they're used in, and to tasks it starts inside them.
+"""
+
+import asyncio
+import contextvars
+import os
+import subprocess as sp
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set  # noqa: F401
+
+from phpbridge import (batching, metacache, modules, php_server_path,
+                       scopes, wire)
+from phpbridge.multiplex import MultiplexedBridge
+
+# Responses can be very large, and JSON messages are single lines
+_stream_limit = 2 ** 31
+
+
+class AsyncPHPBridge(MultiplexedBridge):
+    asynchronous = True
+    # Responses are matched to commands, so PHP can't push chunks
+    iteration_window = 0
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, name: str) -> None:
+        # Scopes, by_value, buffers and stream_strings blocks are per task,
+        # and these are needed to set their attributes
+        self._scope_var = contextvars.ContextVar(
+            'scope', default=None
+        )  # type: contextvars.ContextVar[Optional[scopes.Scope]]
+        self._by_value_var = contextvars.ContextVar(
+            'by_value', default=0)  # type: contextvars.ContextVar[int]
+        self._buffers_var = contextvars.ContextVar(
+            'buffers', default=False)  # type: contextvars.ContextVar[bool]
+        self._stream_strings_var = contextvars.ContextVar(
+            'stream_strings', default=0
+        )  # type: contextvars.ContextVar[int]
+        super().__init__(writer, reader, name)  # type: ignore
+        # Futures waiting for a response, in the order the commands were sent
+        self._pending = OrderedDict()  # type: OrderedDict
+        # Futures of collectGarbage commands sent by flush_garbage
+        self._flushes = set()   # type: Set[asyncio.Future]
+        self._reader = None     # type: Optional[asyncio.Future]
+        self._class_fetches = {}  # type: Dict[str, asyncio.Future]
+        self._prefetched_functions = {}  # type: Dict[str, Dict[str, Any]]
+
+    @property                   # type: ignore
+    def _scope(self) -> Optional[scopes.Scope]:
+        return self._scope_var.get()
+
+    @_scope.setter
+    def _scope(self, scope: Optional[scopes.Scope]) -> None:
+        self._scope_var.set(scope)
+
+    @property                   # type: ignore
+    def _by_value(self) -> int:
+        return self._by_value_var.get()
+
+    @_by_value.setter
+    def _by_value(self, depth: int) -> None:
+        self._by_value_var.set(depth)
+
+    @property                   # type: ignore
+    def _buffers(self) -> bool:
+        return self._buffers_var.get()
+
+    @_buffers.setter
+    def _buffers(self, enabled: bool) -> None:
+        self._buffers_var.set(enabled)
+
+    @property                   # type: ignore
+    def _stream_strings(self) -> int:
+        return self._stream_strings_var.get()
+
+    @_stream_strings.setter
+    def _stream_strings(self, threshold: int) -> None:
+        self._stream_strings_var.set(threshold)
+
+    def flush_garbage(self) -> Optional[asyncio.Future]:  # type: ignore
+        """Send the pending garbage now, instead of with the next command.
+
+        Returns a future for the collectGarbage commands, or None if there
+        was nothing to send. Awaiting it is optional.
+        """
+        if not self._collected:
+            return None
+        futures = []
+        while self._collected:
+            futures.append(self.send_command('collectGarbage'))
+        future = asyncio.gather(*futures)
+        self._flushes.add(future)
+        future.add_done_callback(self._flushed)
+        return future
+
+    def _flushed(self, future: asyncio.Future) -> None:
+        self._flushes.discard(future)
+        if not future.cancelled():
+            # A lost connection shows up in the other commands as well
+            future.exception()
+
+    def start_garbage_timer(self, interval: float = 1.0) -> None:
+        """Check for due garbage regularly, on the event loop."""
+        self.stop_garbage_timer()
+        loop = asyncio.get_event_loop()
+
+        def tick() -> None:
+            if self.garbage_due():
+                self.flush_garbage()
+            self._garbage_timer = loop.call_later(  # type: ignore
+                interval, tick)
+
+        self._garbage_timer = loop.call_later(  # type: ignore
+            interval, tick)
+
+    def stop_garbage_timer(self) -> None:
+        if self._garbage_timer is not None:
+            self._garbage_timer.cancel()  # type: ignore
+            self._garbage_timer = None
+
+    def _request(self, cmd: str, data: Any) -> asyncio.Future:
+        """Send a command and return a future for the raw response."""
+        if self._reader is None:
+            self._reader = asyncio.ensure_future(self._read_responses())
+        elif self._reader.done():
+            raise RuntimeError("Connection closed")
+        message = self.make_message(cmd, data)
+        future = asyncio.get_event_loop().create_future()
+        self._pending[self._track(message)] = (future, cmd)
+        self.input.write(self.codec.frame(message))  # type: ignore
+        return future
+
+    async def _read_responses(self) -> None:
+        try:
+            while True:
+                response = await self.codec.read_async(
+                    self.output)  # type: ignore
+                if self._debug:
+                    print(response)
+                self.confirm_collected(response['collected'])
+                self.learn_keys(response)
+                if 'id' in response:
+                    ident = response['id']
+                    future, cmd = self._pending.pop(ident)
+                else:
+                    # The server couldn't even read the command, but it
+                    # answers in order, so it must be the oldest one
+                    ident, (future, cmd) = self._pending.popitem(last=False)
+                    response['id'] = ident
+                self._refused(self._garbage_sent.pop(ident, ()),
+                              response['collected'])
+                if cmd == 'setCodec' and response['type'] == 'result':
+                    # Everything after this response uses the new codec
+                    self.codec = wire.codecs[response['data']]()
+                if future.cancelled():
+                    self._unfinished.pop(ident, None)
+                else:
+                    future.set_result(response)
+        except Exception as e:
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(e)
+            self._pending.clear()
+
+    def send_command(self, cmd: str, data: Any = None,
+                     decode: bool = False) -> asyncio.Future:
+        """Send a command, and return a future for its result."""
+        future = asyncio.ensure_future(
+            self._finish(self._request(cmd, data), decode))
+        if len(self._collected) >= self.garbage_flush_count:
+            self.flush_garbage()
+        return future
+
+    async def _finish(self, future: asyncio.Future, decode: bool,
+                      prepare: bool = True) -> Any:
+        response = None
+        try:
+            response = await future
+            if prepare:
+                # Classes have to be created before objects can be decoded,
+                # and creating them can't wait for responses
+                await self._fetch_classes(
+                    self._classes_in(response['data']))
+            result = self.unpack_response(response)
+            if decode:
+                result = self.decode(result)
+            return result
+        finally:
+            if response is not None:
+                # Objects in it have proxies now, or never will
+                self._unfinished.pop(response['id'], None)
+
+    async def _fetch_classes(self, names: Iterable[str]) -> None:
+        """Make sure info about classes is available before using them."""
+        fetches = []
+        for name in names:
+            if name in self.classes or name in self._prefetched:
+                continue
+            if name not in self._class_fetches:
+                self._class_fetches[name] = asyncio.ensure_future(
+                    self._fetch_class(name))
+            fetches.append(self._class_fetches[name])
+        if fetches:
+            await asyncio.gather(*fetches)
+
+    async def _fetch_class(self, name: str) -> None:
+        try:
+            cache = self.metadata_cache
+            if cache is not None:
+                info = cache.get('classInfo', name)
+                if info is not None:
+                    self._prefetched[name] = info
+                    # The ancestors may not be cached, and they're needed to
+                    # create the class
+                    ancestors = info['interfaces'] + info['traits']
+                    if info['parent']:
+                        ancestors.append(info['parent'])
+                    await self._fetch_classes(ancestors)
+                    return
+            infos = await self._finish(
+                self._request(
+                    'classInfoClosure',
+                    {'name': name,
+                     'known': list(self.classes) + list(self._prefetched)}),
+                decode=False, prepare=False)
+            self._prefetched[name] = infos[0]
+            for info in infos[1:]:
+                self._prefetched.setdefault(info['name'], info)
+            if cache is not None:
+                cache.put('classInfo', name, infos[0])
+                for info in infos[1:]:
+                    cache.put('classInfo', info['name'], info)
+        finally:
+            del self._class_fetches[name]
+
+    async def _fetch_function(self, name: str) -> None:
+        cache = self.metadata_cache
+        info = None
+        if cache is not None:
+            info = cache.get('funcInfo', name)
+        if info is None:
+            info = await self._finish(self._request('funcInfo', name),
+                                      decode=False, prepare=False)
+            if cache is not None:
+                cache.put('funcInfo', name, info)
+        self._prefetched_functions[name] = info
+
+    def _classes_in(self, data: Any) -> Set[str]:
+        """Find the classes of all objects in an encoded value."""
+        names = set()           # type: Set[str]
+        # With native values, dicts are PHP arrays, not tagged values
+        tagged = not self.codec.native
+        stack = [data]
+        while stack:
+            value = stack.pop()
+            type_ = type(value)
+            if type_ is wire.ObjectHandle:
+                names.add(self._key_classes[value.key])
+            elif type_ is wire.ObjectValue:
+                stack.extend(value.properties.values())
+            elif type_ is dict and tagged:
+                if value.get('type') == 'object' and isinstance(
+                        value.get('value'), int):
+                    names.add(self._key_classes[value['value']])
+                elif value.get('type') != 'scalars':
+                    stack.extend(value.values())
+            elif type_ is dict:
+                stack.extend(value.values())
+            elif type_ is list:
+                stack.extend(value)
+        return names
+
+    def reflect(self, kind: str, name: str) -> Dict[str, Any]:
+        """Get the result of classInfo or funcInfo that was fetched earlier.
+        """
+        fetched = (self._prefetched if kind == 'classInfo'
+                   else self._prefetched_functions)
+        if name in fetched:
+            return fetched.pop(name)
+        if self.metadata_cache is not None:
+            info = self.metadata_cache.get(kind, name)
+            if info is not None:
+                return info
+        raise LookupError("'{}' has to be loaded first".format(name))
+
+    async def load(self, name: str) -> Any:
+        """Get a class, function, constant or global variable by its name.
+
+        This is the asynchronous equivalent of accessing a name on a
+        namespace module. Classes, functions and constants are remembered, so
+        afterwards they can be accessed through namespace modules as well.
+        """
+        if name in self.cache:
+            return self.cache[name]
+        elif name in self._missing:
+            raise AttributeError("Nothing named '{}' found".format(name))
+
+        resolved = await self.send_command('resolveName', name)
+        kind = resolved['kind']
+        if resolved['generation'] != self._names_generation:
+            self._missing.clear()
+            self._names_generation = resolved['generation']
+
+        if kind == 'class':
+            await self._fetch_classes([name])
+            return self.get_class(name)
+        elif kind == 'func':
+            if name not in self.functions:
+                await self._fetch_function(name)
+            return self.get_function(name)
+        elif kind == 'const':
+            self.constants[name] = await self.send_command(
+                'getConst', name, decode=True)
+            return self.constants[name]
+        elif kind == 'global':
+            return await self.send_command('getGlobal', name, decode=True)
+        elif kind == 'none':
+            self._missing.add(name)
+            raise AttributeError("Nothing named '{}' found".format(name))
+        else:
+            raise RuntimeError("Resolved unknown data type {}".format(kind))
+
+    def resolve(self, path: str, name: str) -> Any:
+        if path:
+            name = path + '\\' + name
+        if name in self.cache:
+            return self.cache[name]
+        raise AttributeError(
+            "'{}' has to be loaded first, with {}.load()".format(
+                name, self.__class__.__name__))
+
+    def list_names(self, path: str) -> List[str]:
+        """List the names in a namespace that were loaded already.
+
+        Other names can't be used without load() anyway, and dir() can't
+        wait for the server.
+        """
+        prefix = path + '\\' if path else ''
+        return [name[len(prefix):] for name in self.cache
+                if name.startswith(prefix) and
+                '\\' not in name[len(prefix):]]
+
+    def get_const(self, name: str) -> Any:
+        if name not in self.constants:
+            raise LookupError("'{}' has to be loaded first".format(name))
+        return self.constants[name]
+
+    async def negotiate_codec(  # type: ignore
+            self, names: Iterable[str]) -> str:
+        """Switch to the first codec from a list that both sides support.
+
+        This has to be done before any other commands are sent.
+        """
+        names = [name for name in names if name in wire.codecs]
+        if self.codec.name in names[:1]:
+            return self.codec.name
+        try:
+            return await self.send_command(  # type: ignore
+                'setCodec', names)
+        except Exception:
+            return self.codec.name
+
+    async def enable_metadata_cache(  # type: ignore
+            self, path: Optional[str] = None,
+            project: Optional[str] = None) -> None:
+        """Store class and function reflection data on disk."""
+        if path is None:
+            path = metacache.default_path()
+        if project is None:
+            project = await self.send_command(
+                'callFun', {'name': 'getcwd', 'args': []}, decode=True) or ''
+        php_version = await self.load('PHP_VERSION')
+        self.metadata_cache = metacache.MetadataCache(
+            path, php_version, self.codec.name, project)
+
+    def batch(self) -> batching.Batch:
+        raise RuntimeError("Asynchronous bridges can't batch commands, but "
+                           "they can have many commands in flight. Use "
+                           "asyncio.gather instead.")
+
+    def close(self) -> None:
+        """Close the connection."""
+        self.stop_garbage_timer()
+        self.input.close()
+        if self._reader is not None:
+            self._reader.cancel()
+
+
+async def start_process_async(fname: str = php_server_path,
+                              name: str = 'aphp',
+                              codecs: Iterable[str] = ('json',)
+                              ) -> AsyncPHPBridge:
+    """Start server.php and open an asynchronous bridge to it.
+
+    Namespaces are importable under phpbridge.<name>, so name should be
+    unique. This doesn't work on Windows.
+    """
+    loop = asyncio.get_event_loop()
+    php_in, py_in = os.pipe()
+    py_out, php_out = os.pipe()
+    sp.Popen(['php', fname, 'php://fd/{}'.format(php_in),
+              'php://fd/{}'.format(php_out)],
+             pass_fds=[0, 1, 2, php_in, php_out])
+    os.close(php_in)
+    os.close(php_out)
+
+    reader = asyncio.StreamReader(limit=_stream_limit)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(py_out, 'rb', 0))
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, os.fdopen(py_in, 'wb', 0))
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+
+    bridge = AsyncPHPBridge(reader, writer, name)
+    modules.NamespaceFinder(bridge, name).register()
+    await bridge.negotiate_codec(codecs)
+    return bridge
@@ -0,0 +1,31 @@
+<?php
+
+/**
+ * Load the server's classes, with composer's autoloader if it's there.
+ */
+
+declare(strict_types=1);
+
+if (file_exists(__DIR__ . '/../../../../vendor/autoload.php')) {
+    require_once __DIR__ . '/../../../../vendor/autoload.php';
+} else {
+    // Adapted from the PHP-FIG example autoloader
+    spl_autoload_register(function ($class) {
+        $prefix = 'blyxxyz\\PythonServer\\';
+        $base_dir = __DIR__ . '/php-server/';
+
+        $len = strlen($prefix);
+        if (strncmp($prefix, $class, $len) !== 0) {
+            return;
+        }
+
+        $relative_class = substr($class, $len);
+
+        $file = $base_dir . str_replace('\\', '/', $relative_class) . '.php';
+
+        if (file_exists($file)) {
+            /** @noinspection PhpIncludeInspection */
+            require $file;
+        }
+    });
+}
@@ -0,0 +1,177 @@
+"""Sending many commands in a single round trip."""
+
+from typing import Any, Callable, List, Optional, Set  # noqa: F401
+
+from phpbridge import values, wire
+
+MYPY = False
+if MYPY:
+    from phpbridge import PHPBridge  # noqa: F401
+
+# Commands whose results don't have to be known right away. Other commands
+# are used for things like reprs, lengths and class creation, which Python
+# needs an immediate answer for.
+deferrable_commands = {
+    'setConst', 'getGlobal', 'setGlobal', 'callFun', 'callObj', 'callMethod',
+    'getItem', 'setItem', 'delItem', 'createObject', 'getProperty',
+    'setProperty', 'unsetProperty', 'evaluate', 'mapIterable',
+    'filterIterable', 'columnIterable', 'reduceIterable'
+}                               # type: Set[str]
+
+_pending = object()
+
+
+class Deferred:
+    """The future result of a command in a batch.
+
+    Deferred results can be passed as arguments to later commands in the same
+    batch. Calling a method on a pending Deferred queues that method call as
+    well.
+    """
+    def __init__(self, bridge: 'PHPBridge', index: int, cmd: str,
+                 decode: bool) -> None:
+        self._bridge = bridge
+        self._index = index
+        self._cmd = cmd
+        self._decode = decode
+        self._value = _pending      # type: Any
+        self._exception = None      # type: Optional[BaseException]
+
+    def done(self) -> bool:
+        """Return whether the command has been executed."""
+        return self._value is not _pending or self._exception is not None
+
+    def result(self) -> Any:
+        """Return the result, or raise the exception the command raised."""
+        if self._exception is not None:
+            raise self._exception
+        if self._value is _pending:
+            raise RuntimeError("The batch has not been sent yet")
+        return self._value
+
+    def _set_result(self, value: Any) -> None:
+        self._value = self._bridge.decode(value) if self._decode else value
+
+    def _set_exception(self, exception: BaseException) -> None:
+        self._exception = exception
+
+    def _encode(self) -> Any:
+        if self.done():
+            return self._bridge.encode(values.as_plain(self.result()))
+        if not self._decode:
+            raise RuntimeError("The result of '{}' can't be used as a "
+                               "value".format(self._cmd))
+        if self._bridge.codec.native:
+            return wire.DeferredHandle(self._index)
+        return {'type': 'deferred', 'value': self._index}
+
+    def __getattr__(self, attr: str) -> Any:
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self.done():
+            return getattr(self.result(), attr)
+
+        def method(*args: Any) -> Any:
+            return self._bridge.send_command(
+                'callMethod',
+                {'obj': self._bridge.encode(self),
+                 'name': attr,
+                 'args': [self._bridge.encode(arg) for arg in args]},
+                decode=True)
+
+        method.__name__ = attr
+        return method
+
+    def __repr__(self) -> str:
+        if self._exception is not None:
+            state = 'raised {!r}'.format(self._exception)
+        elif self._value is _pending:
+            state = 'pending'
+        else:
+            state = 'returned {!r}'.format(self._value)
+        return "<Deferred {} #{} {}>".format(self._cmd, self._index, state)
+
+
+class Batch:
+    """A context manager that queues commands to send them all at once.
+
+    The server runs the commands in order. If one of them raises an
+    exception, the commands after it are not run, and the exception is
+    raised when the batch is flushed.
+    """
+    def __init__(self, bridge: 'PHPBridge') -> None:
+        self.bridge = bridge
+        self.commands = []      # type: List[dict]
+        self.deferreds = []     # type: List[Deferred]
+        # The proxies that queued commands refer to, so that they aren't
+        # collected before the commands run
+        self.referenced = []    # type: List[Any]
+        self._outer = None      # type: Optional[Batch]
+
+    def add(self, cmd: str, data: Any, decode: bool) -> Deferred:
+        """Queue a command and return a placeholder for its result."""
+        deferred = Deferred(self.bridge, len(self.commands), cmd, decode)
+        self.commands.append({'cmd': cmd, 'data': data})
+        self.deferreds.append(deferred)
+        return deferred
+
+    def keep(self, proxy: Any) -> None:
+        """Keep a proxy alive until the queued commands are sent."""
+        self.referenced.append(proxy)
+
+    def flush(self) -> None:
+        """Send all queued commands and fill in their results."""
+        if not self.commands:
+            return
+        commands, self.commands = self.commands, []
+        deferreds, self.deferreds = self.deferreds, []
+        referenced, self.referenced = self.referenced, []
+        with self.bridge._lock:
+            # Send it as a normal command, not as part of ourselves
+            self.bridge._batch = None
+            try:
+                responses = self.bridge.exchange('batch', commands)
+            finally:
+                self.bridge._batch = self
+            # The commands ran, so PHP may be told about these proxies'
+            # garbage now. Until here, this kept them alive.
+            del referenced
+            exception = None    # type: Optional[BaseException]
+            for deferred, response in zip(deferreds, responses):
+                try:
+                    deferred._set_result(
+                        self.bridge.unpack_response(response))
+                except Exception as e:
+                    deferred._set_exception(e)
+                    exception = e
+        for deferred in deferreds[len(responses):]:
+            deferred._set_exception(RuntimeError(
+                "Not executed because an earlier command failed"))
+        if exception is not None:
+            raise exception
+
+    def discard(self) -> None:
+        """Forget all queued commands without sending them."""
+        for deferred in self.deferreds:
+            deferred._set_exception(RuntimeError("The batch was discarded"))
+        self.commands = []
+        self.deferreds = []
+        self.referenced = []
+
+    def __enter__(self) -> 'Batch':
+        self._outer = self.bridge._batch
+        if self._outer is not None:
+            # Keep the order of the outer batch's commands intact
+            self._outer.flush()
+        self.bridge._batch = self
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any,
+                 traceback: Any) -> None:
+        try:
+            if exc_type is None:
+                self.flush()
+            else:
+                self.discard()
+        finally:
+            self.bridge._batch = self._outer
@@ -10,6 +10,8 @@ import typing
 
 from typing import Any, Callable, Dict, Optional, Type, Union  # noqa: F401
 
+from phpbridge.iteration import (AsyncChunkedIterator, ChunkedIterator,
+                                 PushedIterator)
 from phpbridge.objects import PHPObject
 
 predef_classes = {}             # type: Dict[str, Type]
@@ -69,8 +71,78 @@ class Traversable(PHPObject):
     See also: collections.abc.Iterable.
     """
     def __iter__(self) -> typing.Iterator:
-        return self._bridge.send_command(  # type: ignore
+        return self._iterate()
+
+    def _iterate(self, chunk_size: Optional[int] = None) -> ChunkedIterator:
+        """Iterate, fetching up to chunk_size elements per round trip.
+
+        If chunk_size is None, the bridge's iteration_chunk_size is used.
+        """
+        generator = self._bridge.send_command(
             'startIteration', self._bridge.encode(self), decode=True)
+        return ChunkedIterator(self._bridge, generator, chunk_size)
+
+    def _stream(self, chunk_size: Optional[int] = None,
+                window: Optional[int] = None) -> ChunkedIterator:
+        """Iterate, with PHP sending up to window chunks ahead.
+
+        See phpbridge.iteration.PushedIterator. If window is None, the
+        bridge's iteration_window is used. Bridges that can have several
+        commands in flight fetch every chunk on request instead.
+        """
+        if not self._bridge.iteration_window:
+            return self._iterate(chunk_size)
+        generator = self._bridge.send_command(
+            'startIteration', self._bridge.encode(self), decode=True)
+        return PushedIterator(self._bridge, generator, chunk_size, window)
+
+    def __aiter__(self) -> AsyncChunkedIterator:
+        """Iterate with async for, on an asynchronous bridge."""
+        return AsyncChunkedIterator(self._bridge, self)
+
+    # The p* methods run in PHP and return PHP Generators, so they can be
+    # chained without moving the elements. Callables can be PHP functions,
+    # their names, methods and Closures.
+
+    def pmap(self, func: Any) -> Any:
+        """Call a PHP callable on each value in PHP, keeping the keys."""
+        return self._bridge.send_command(
+            'mapIterable',
+            {'iterable': self._bridge.encode(self),
+             'callable': self._bridge.encode(func)},
+            decode=True)
+
+    def pfilter(self, func: Any = None) -> Any:
+        """Keep the values a PHP callable returns true for, in PHP.
+
+        If func is None, the values that are true themselves are kept.
+        """
+        return self._bridge.send_command(
+            'filterIterable',
+            {'iterable': self._bridge.encode(self),
+             'callable': self._bridge.encode(func)},
+            decode=True)
+
+    def pcolumn(self, name: Union[int, str]) -> Any:
+        """Get an item or property of each value, in PHP."""
+        return self._bridge.send_command(
+            'columnIterable',
+            {'iterable': self._bridge.encode(self),
+             'name': self._bridge.encode(name)},
+            decode=True)
+
+    def preduce(self, func: Any, initial: Any = None) -> Any:
+        """Reduce the values to one value with a PHP callable, in PHP.
+
+        func is called with the result so far and the next value, like
+        array_reduce.
+        """
+        return self._bridge.send_command(
+            'reduceIterable',
+            {'iterable': self._bridge.encode(self),
+             'callable': self._bridge.encode(func),
+             'initial': self._bridge.encode(initial)},
+            decode=True)
 
 
 @predef
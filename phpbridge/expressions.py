@@ -0,0 +1,89 @@
+"""Recording chains of operations to run them in a single command."""
+
+import keyword
+
+from typing import Any, List, Tuple  # noqa: F401
+
+MYPY = False
+if MYPY:
+    from phpbridge import PHPBridge  # noqa: F401
+
+
+class Expression:
+    """A chain of property accesses, calls and item accesses on a PHP value.
+
+    Nothing is sent until _run() is called. Then PHP evaluates the whole
+    chain and returns only the final value, so the objects in between don't
+    get proxies and don't have to be garbage collected.
+
+    Calls only take positional arguments, because the classes of the
+    objects in between aren't known. A trailing underscore is removed from
+    names that are Python keywords, so from_ becomes from.
+    """
+    def __init__(self, bridge: 'PHPBridge', base: Any,
+                 ops: Tuple[tuple, ...] = ()) -> None:
+        self._bridge = bridge
+        self._base = base
+        self._ops = ops
+
+    def _then(self, *op: Any) -> 'Expression':
+        return Expression(self._bridge, self._base, self._ops + (op,))
+
+    def __getattr__(self, name: str) -> 'Expression':
+        if name.startswith('__') and name.endswith('__'):
+            raise AttributeError(name)
+        if name.endswith('_') and keyword.iskeyword(name[:-1]):
+            name = name[:-1]
+        return self._then('get', name)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> 'Expression':
+        if kwargs:
+            raise TypeError("Expressions can't take keyword arguments")
+        if self._ops and self._ops[-1][0] == 'get':
+            # A method call, not a call of a property's value
+            prop = self._ops[-1][1]
+            return Expression(self._bridge, self._base,
+                              self._ops[:-1] + (('call', prop, args),))
+        return self._then('invoke', args)
+
+    def __getitem__(self, key: Any) -> 'Expression':
+        return self._then('item', key)
+
+    def __repr__(self) -> str:
+        parts = [repr(self._base)]
+        for op in self._ops:
+            if op[0] == 'get':
+                parts.append('->{}'.format(op[1]))
+            elif op[0] == 'call':
+                parts.append('->{}({})'.format(op[1], _ellipsis(op[2])))
+            elif op[0] == 'invoke':
+                parts.append('({})'.format(_ellipsis(op[1])))
+            else:
+                parts.append('[{!r}]'.format(op[1]))
+        return "<PHP expression {}>".format(''.join(parts))
+
+    def _encode(self) -> List[list]:
+        encode = self._bridge.encode
+        ops = []
+        for op in self._ops:
+            if op[0] == 'get':
+                ops.append(['get', op[1]])
+            elif op[0] == 'call':
+                ops.append(['call', op[1], [encode(arg) for arg in op[2]]])
+            elif op[0] == 'invoke':
+                ops.append(['invoke', [encode(arg) for arg in op[1]]])
+            else:
+                ops.append(['item', encode(op[1])])
+        return ops
+
+    def _run(self) -> Any:
+        """Evaluate the expression in PHP and return the result."""
+        return self._bridge.send_command(
+            'evaluate',
+            {'base': self._bridge.encode(self._base),
+             'ops': self._encode()},
+            decode=True)
+
+
+def _ellipsis(args: tuple) -> str:
+    return '...' if args else ''
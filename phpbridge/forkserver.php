@@ -0,0 +1,60 @@
+<?php
+
+/**
+ * A warm process that forks a new server for each request.
+ *
+ * $argv[1] and $argv[2] are the files to read requests from and to write
+ * process IDs to. If $argv[3] is given, that file is required once before
+ * anything is forked, so every server starts with whatever it loaded.
+ *
+ * A request is a line with the two files for the new server, separated by a
+ * tab. These are usually named pipes. Once the new server has opened both,
+ * it writes a line saying "ready" to its output before anything else.
+ * Requires the pcntl extension.
+ */
+
+declare(strict_types=1);
+
+require __DIR__ . '/autoload.php';
+
+if (!function_exists('pcntl_fork')) {
+    fwrite(STDERR, "The fork server needs the pcntl extension\n");
+    exit(1);
+}
+
+$requests = fopen($argv[1], 'r');
+$replies = fopen($argv[2], 'w');
+
+if (isset($argv[3])) {
+    // Required at the top level, so its variables are globals
+    /** @noinspection PhpIncludeInspection */
+    require $argv[3];
+}
+
+// Let the servers be reaped without waiting for them
+pcntl_signal(SIGCHLD, SIG_IGN);
+
+fwrite($replies, "ready\n");
+fflush($replies);
+
+while (($line = fgets($requests)) !== false) {
+    list($in, $out) = explode("\t", rtrim($line, "\n"));
+    $pid = pcntl_fork();
+    if ($pid === 0) {
+        fclose($requests);
+        fclose($replies);
+        pcntl_signal(SIGCHLD, SIG_DFL);
+        $server = new \blyxxyz\PythonServer\StdioCommandServer($in, $out);
+        // Tell Python that both files are open, before any response
+        $ready = fopen($out, 'w');
+        fwrite($ready, "ready\n");
+        fclose($ready);
+        try {
+            $server->communicate();
+        } catch (\blyxxyz\PythonServer\Exceptions\ConnectionLostException $e) {
+        }
+        exit(0);
+    }
+    fwrite($replies, "$pid\n");
+    fflush($replies);
+}
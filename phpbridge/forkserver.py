@@ -0,0 +1,153 @@
+"""Starting bridges from a warm PHP process.
+
+Starting PHP, setting up autoloaders and booting an application can take
+much longer than the work a bridge is started for. A fork server does all
+of that once, in a template process, and then forks a copy of it for each
+new bridge. The copies start with everything the bootstrap file loaded.
+
+This needs PHP's pcntl extension and named pipes, so it doesn't work on
+Windows.
+"""
+
+import errno
+import os
+import select
+import shutil
+import signal
+import subprocess as sp
+import tempfile
+import threading
+import time
+
+from typing import IO, Any, Iterable, Optional, Tuple, Type  # noqa: F401
+
+from phpbridge import PHPBridge
+
+php_fork_server_path = os.path.join(
+    os.path.dirname(__file__), 'forkserver.php')
+
+# What a forked server writes once it has opened its files
+_ready = b'ready\n'
+
+
+class ForkServer:
+    """A PHP process that forks a new server for each bridge.
+
+    If bootstrap is given, it's the path of a PHP file that's required once
+    in the template process, before anything is forked. Its variables
+    become globals. Connections and other resources it opens are shared
+    by all the forked servers, so it should usually leave those alone.
+    """
+    # The number of seconds a forked server gets to open its files
+    start_timeout = 10.0
+
+    def __init__(self, bootstrap: Optional[str] = None,
+                 fname: str = php_fork_server_path) -> None:
+        php_requests, py_requests = os.pipe()
+        py_replies, php_replies = os.pipe()
+        args = ['php', fname, 'php://fd/{}'.format(php_requests),
+                'php://fd/{}'.format(php_replies)]
+        if bootstrap is not None:
+            args.append(bootstrap)
+        self.process = sp.Popen(args, pass_fds=[0, 1, 2, php_requests,
+                                                php_replies])
+        os.close(php_requests)
+        os.close(php_replies)
+        self._requests = os.fdopen(py_requests, 'w')
+        self._replies = os.fdopen(py_replies, 'r')
+        # Requests and their replies must not get mixed up
+        self._lock = threading.Lock()
+        if self._replies.readline() != 'ready\n':
+            self.process.wait()
+            raise RuntimeError("The fork server failed to start")
+
+    def start(self, name: str = 'php',
+              codecs: Iterable[str] = ('json',),
+              cls: Type[PHPBridge] = PHPBridge) -> PHPBridge:
+        """Fork a server and open a bridge to it, like start_process."""
+        directory = tempfile.mkdtemp(prefix='phpbridge-')
+        try:
+            php_in = os.path.join(directory, 'in')
+            php_out = os.path.join(directory, 'out')
+            os.mkfifo(php_in)
+            os.mkfifo(php_out)
+            with self._lock:
+                self._requests.write('{}\t{}\n'.format(php_in, php_out))
+                self._requests.flush()
+                reply = self._replies.readline()
+            if not reply or int(reply) < 0:
+                raise RuntimeError("The fork server failed to fork")
+            py_in, py_out = self._connect(int(reply), php_in, php_out)
+        finally:
+            # Once both sides have opened them, the names aren't needed
+            shutil.rmtree(directory)
+        bridge = cls(py_in, py_out, name)
+        bridge.negotiate_codec(codecs)
+        return bridge
+
+    def _connect(self, pid: int, php_in: str,
+                 php_out: str) -> Tuple[IO[bytes], IO[bytes]]:
+        """Open the named pipes of a forked server, and wait until it's
+        ready.
+
+        Opening a named pipe normally blocks until the other side opens it
+        too, which never happens if the server dies first. So they're opened
+        without blocking, and the server is checked on while waiting.
+        """
+        deadline = time.monotonic() + self.start_timeout
+        out_fd = os.open(php_out, os.O_RDONLY | os.O_NONBLOCK)
+        in_fd = None            # type: Optional[int]
+        try:
+            while in_fd is None:
+                try:
+                    in_fd = os.open(php_in, os.O_WRONLY | os.O_NONBLOCK)
+                except OSError as e:
+                    # The server hasn't opened it for reading yet
+                    if e.errno != errno.ENXIO:
+                        raise
+                    self._check_started(pid, deadline)
+            ready = b''
+            while len(ready) < len(_ready):
+                chunk = b''
+                if select.select([out_fd], [], [], 0.01)[0]:
+                    chunk = os.read(out_fd, len(_ready) - len(ready))
+                if not chunk:
+                    self._check_started(pid, deadline)
+                ready += chunk
+            if ready != _ready:
+                raise RuntimeError("The forked server sent {!r}".format(
+                    ready))
+            os.set_blocking(in_fd, True)
+            os.set_blocking(out_fd, True)
+            return os.fdopen(in_fd, 'wb'), os.fdopen(out_fd, 'rb')
+        except BaseException:
+            if in_fd is not None:
+                os.close(in_fd)
+            os.close(out_fd)
+            raise
+
+    def _check_started(self, pid: int, deadline: float) -> None:
+        """Raise an exception if a forked server died or took too long."""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            raise RuntimeError("The forked server exited before starting")
+        if time.monotonic() >= deadline:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            raise RuntimeError("The forked server took too long to start")
+        time.sleep(0.01)
+
+    def close(self) -> None:
+        """Stop the template process. Forked servers keep running."""
+        self._requests.close()
+        self.process.wait()
+        self._replies.close()
+
+    def __enter__(self) -> 'ForkServer':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -1,7 +1,9 @@
 import itertools
+import types
 
 from inspect import Parameter, Signature
-from typing import Any, Callable, Dict, Iterator, Optional, Set  # noqa: F401
+from typing import (Any, Callable, Dict, Iterator, Optional, Set,  # noqa: F401
+                    Sequence, Type)
 
 from phpbridge import modules, utils
 
@@ -113,29 +115,137 @@ default_constructor_signature = Signature(
     return_annotation=Signature.empty)
 
 
+_unset = object()
+
+
+class _LazyDoc:
+    """The docstring of a PHPFunction, built when it's first read.
+
+    Read from the class, it's the docstring of the class itself.
+    """
+    def __init__(self, doc: Optional[str]) -> None:
+        self.doc = doc
+
+    def __get__(self, obj: Any, cls: Optional[Type] = None) -> Optional[str]:
+        if obj is None:
+            return self.doc
+        if obj._doc is _unset:
+            obj._doc = obj._make_doc()
+        return obj._doc         # type: ignore
+
+    def __set__(self, obj: Any, doc: Optional[str]) -> None:
+        obj._doc = doc
+
+
+class PHPFunction:
+    """A PHP function or method.
+
+    These behave like Python functions, but the signature and docstring
+    are only built when they're first needed. Building a signature can
+    take round trips to get the classes in type hints, and most code never
+    looks at them. Calls only need the signature to interpret keyword
+    arguments.
+
+    When accessed through an instance, a PHPFunction becomes a bound method,
+    just like a regular function.
+    """
+    def __init__(self, bridge: 'PHPBridge', name: str, qualname: str,
+                 module: str, info: Dict[str, Any], call: Callable,
+                 add_first: Optional[str] = None,
+                 bases: Sequence[Type] = ()) -> None:
+        self._bridge = bridge
+        self.__name__ = name
+        self.__qualname__ = qualname
+        self.__module__ = module
+        self._info = info
+        self._call = call
+        self._add_first = add_first
+        self._bases = bases
+        self._signature = None  # type: Optional[Signature]
+        self._doc = _unset      # type: Any
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        if kwargs:
+            args = utils.parse_args(self.__signature__, args, kwargs)
+        return self._call(*args)
+
+    def __get__(self, obj: Any, cls: Optional[Type] = None) -> Any:
+        if obj is None:
+            return self
+        return types.MethodType(self, obj)
+
+    @property
+    def __signature__(self) -> Signature:
+        if self._signature is None:
+            self._signature = make_signature(self._bridge, self._info,
+                                             add_first=self._add_first)
+        return self._signature
+
+    @__signature__.setter
+    def __signature__(self, signature: Signature) -> None:
+        self._signature = signature
+
+    def _make_doc(self) -> Optional[str]:
+        doc = self._info['doc']
+        if not isinstance(doc, str):
+            return None
+        doc = utils.convert_docblock(doc)
+        if '@inheritdoc' in doc.lower():
+            # If @inheritdoc is used, we manually look for inheritance.
+            # If __doc__ is empty we leave it empty, and pydoc and inspect
+            # know where to look.
+            for base in self._bases:
+                try:
+                    base_doc = getattr(base, self.__name__).__doc__
+                    if isinstance(base_doc, str):
+                        return base_doc
+                except AttributeError:
+                    pass
+        return doc
+
+    def __repr__(self) -> str:
+        return "<PHP function {}>".format(self.__qualname__)
+
+    __doc__ = _LazyDoc(__doc__)  # type: ignore
+
+
+def _as_function(php_function: PHPFunction) -> Callable:
+    """Wrap a PHPFunction in a regular function.
+
+    pydoc and inspect then treat it like any other function. The signature
+    is still only built when it's needed, through __wrapped__.
+    """
+    def func(*args: Any, **kwargs: Any) -> Any:
+        return php_function(*args, **kwargs)
+
+    func.__name__ = php_function.__name__
+    func.__qualname__ = php_function.__qualname__
+    func.__module__ = php_function.__module__
+    func.__doc__ = php_function.__doc__
+    func.__wrapped__ = php_function  # type: ignore
+    func._bridge = php_function._bridge  # type: ignore
+    func._info = php_function._info  # type: ignore
+    return func
+
+
 def create_function(bridge: 'PHPBridge', name: str) -> None:
     """Create and register a PHP function."""
-    info = bridge.send_command('funcInfo', name)
+    info = bridge.reflect('funcInfo', name)
 
     if info['name'] in bridge.functions:
         bridge.functions[name] = bridge.functions[info['name']]
         return
 
-    def func(*args: Any, **kwargs: Any) -> Any:
-        args = utils.parse_args(
-            func.__signature__, args, kwargs)  # type: ignore
+    def call(*args: Any) -> Any:
         return bridge.send_command(
             'callFun',
             {'name': name,
              'args': [bridge.encode(arg) for arg in args]},
             decode=True)
 
-    func.__doc__ = utils.convert_docblock(info['doc'])
-    func.__module__ = modules.get_module(bridge, name)
-    func.__name__ = info['name']
-    func.__qualname__ = modules.basename(info['name'])
-    func.__signature__ = make_signature(bridge, info)  # type: ignore
-    func._bridge = bridge                              # type: ignore
+    func = _as_function(PHPFunction(
+        bridge, info['name'], modules.basename(info['name']),
+        modules.get_module(bridge, name), info, call))
 
     bridge.functions[name] = func
     bridge.functions[info['name']] = func
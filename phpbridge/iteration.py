@@ -0,0 +1,184 @@
+"""Iterating over PHP iterables without a round trip per element."""
+
+from collections import deque
+from typing import Any, Dict, Optional, Tuple  # noqa: F401
+
+MYPY = False
+if MYPY:
+    from typing import Deque  # noqa: F401
+    from phpbridge import PHPBridge  # noqa: F401
+    from phpbridge.objects import PHPObject  # noqa: F401
+
+
+class ChunkedIterator:
+    """Iterate over a PHP Generator, fetching many elements at a time.
+
+    The first chunk is small, so that breaking out of a loop early doesn't
+    make PHP produce many elements for nothing. Every following chunk is
+    twice as large as the one before, up to chunk_size.
+
+    Elements that were fetched but not consumed yet are kept, so a loop can
+    be broken out of and resumed.
+    """
+    initial_chunk_size = 8
+
+    def __init__(self, bridge: 'PHPBridge', generator: 'PHPObject',
+                 chunk_size: Optional[int] = None) -> None:
+        if chunk_size is None:
+            chunk_size = bridge.iteration_chunk_size
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.bridge = bridge
+        self.generator = generator
+        self.chunk_size = chunk_size
+        self._next_size = min(self.initial_chunk_size, chunk_size)
+        self._buffer = deque()  # type: Deque[Tuple[Any, Any]]
+        self._exhausted = False
+
+    def __iter__(self) -> 'ChunkedIterator':
+        return self
+
+    def __next__(self) -> Tuple[Any, Any]:
+        if not self._buffer:
+            if self._exhausted:
+                raise StopIteration
+            self._fetch()
+            if not self._buffer:
+                raise StopIteration
+        return self._buffer.popleft()
+
+    def _fetch(self) -> None:
+        with self.bridge._lock:
+            chunk = self._request()
+            with self.bridge._decoding():
+                self._store(chunk)
+
+    def _request(self) -> Any:
+        return self.bridge.send_command(
+            'nextIterationChunk',
+            {'obj': self.bridge.encode(self.generator),
+             'size': self._next_size})
+
+    def _store(self, chunk: Dict[str, Any]) -> None:
+        keys = self.bridge.decode(chunk['keys'])
+        values = self.bridge.decode(chunk['values'])
+        self._buffer.extend(zip(keys, values))
+        self._exhausted = chunk['done']
+        if self._exhausted:
+            # Let PHP free the generator right away
+            self.generator = None  # type: ignore
+        self._next_size = min(self._next_size * 2, self.chunk_size)
+
+
+class PushedIterator(ChunkedIterator):
+    """Iterate over a PHP Generator, with PHP sending chunks on its own.
+
+    PHP is allowed to send up to window chunks of chunk_size elements
+    without a command for each. Once half of them were consumed, PHP is
+    allowed to send more, so it can keep producing while Python consumes.
+    Memory use on both sides is limited by the window.
+
+    Other commands wait until all chunks that PHP was allowed to send have
+    arrived, so they're best avoided while iterating.
+    """
+    def __init__(self, bridge: 'PHPBridge', generator: 'PHPObject',
+                 chunk_size: Optional[int] = None,
+                 window: Optional[int] = None) -> None:
+        super().__init__(bridge, generator, chunk_size)
+        if window is None:
+            window = bridge.iteration_window
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        # The number of chunks PHP may still send
+        self._owed = 0
+        # Whether PHP stopped sending chunks
+        self._finished = False
+        # Responses that arrived but weren't decoded yet
+        self._pending = deque()  # type: Deque[Dict[str, Any]]
+        self._error = None  # type: Optional[Exception]
+
+    def __next__(self) -> Tuple[Any, Any]:
+        if not self._finished:
+            self._refill()
+        while not self._buffer:
+            if self._pending:
+                # Decoding can send commands, which receive the chunks that
+                # are still owed, so it's only done here and in order
+                with self.bridge._decoding():
+                    self._unpack(self._pending.popleft())
+                    if not self._pending:
+                        self.bridge._undecoded.discard(self)
+            elif self._owed:
+                self.bridge.receive_push()
+            else:
+                break
+        if not self._buffer:
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+            raise StopIteration
+        return self._buffer.popleft()
+
+    def _refill(self) -> None:
+        buffered = -(-len(self._buffer) // self.chunk_size)
+        buffered += len(self._pending)
+        free = self.window - self._owed - buffered
+        if free * 2 >= self.window:
+            self._owed += free
+            self.bridge.push_iteration(self, free)
+
+    def _request(self) -> Any:
+        raise TypeError("Chunks are pushed")
+
+    def receive(self, response: Dict[str, Any], unsent: int) -> None:
+        """Take a chunk sent by PHP, to be decoded when it's needed.
+
+        unsent is the number of chunks PHP was allowed to send but won't,
+        because the generator finished.
+        """
+        self._owed -= 1 + unsent
+        if self._finished:
+            return
+        self._pending.append(response)
+        self.bridge._undecoded.add(self)
+        if response['type'] != 'result' or response['data']['done']:
+            self._finished = True
+            self.generator = None  # type: ignore
+
+    def _unpack(self, response: Dict[str, Any]) -> None:
+        try:
+            chunk = self.bridge.unpack_response(response)
+        except Exception as error:
+            self._error = error
+            self._exhausted = True
+            return
+        self._store(chunk)
+
+
+class AsyncChunkedIterator(ChunkedIterator):
+    """Like ChunkedIterator, but for use with async for on an async bridge.
+
+    Iteration only starts when the first element is requested.
+    """
+    def __init__(self, bridge: 'PHPBridge', iterable: 'PHPObject',
+                 chunk_size: Optional[int] = None) -> None:
+        super().__init__(bridge, None, chunk_size)  # type: ignore
+        self.iterable = iterable
+
+    def __aiter__(self) -> 'AsyncChunkedIterator':
+        return self
+
+    async def __anext__(self) -> Tuple[Any, Any]:
+        if not self._buffer:
+            if self._exhausted:
+                raise StopAsyncIteration
+            if self.generator is None:
+                self.generator = await self.bridge.send_command(
+                    'startIteration', self.bridge.encode(self.iterable),
+                    decode=True)
+                self.iterable = None  # type: ignore
+            self._store(await self._request())
+            if not self._buffer:
+                raise StopAsyncIteration
+        return self._buffer.popleft()
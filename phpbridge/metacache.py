@@ -0,0 +1,122 @@
+"""A persistent cache for class and function reflection data.
+
+Reflecting on a class or function takes a round trip per name, and a large
+application touches hundreds of names before it does anything useful. The
+cache stores the results of classInfo and funcInfo on disk, so that later
+processes can build classes and functions without asking PHP.
+
+Entries are stored per PHP version, per codec and per project, because
+different applications can define classes with the same names. The project
+is PHP's working directory by default. Each entry also records the
+modification times of the files that define the name, including the files of
+all ancestor classes, interfaces and traits. An entry is only used if none of
+those files have changed. Names that aren't defined in a real file (like
+classes created by eval) are never cached.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+from typing import Any, Dict, Optional, Tuple, Union  # noqa: F401
+
+# Increase this whenever the format of classInfo or funcInfo changes
+FORMAT_VERSION = 1
+
+
+def default_path() -> str:
+    """Get the default location of the cache directory."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'phpbridge')
+
+
+def is_fresh(files: Dict[str, int]) -> bool:
+    """Check that none of the files of a classInfo or funcInfo changed."""
+    for path, mtime in (files or {}).items():
+        try:
+            if int(os.stat(path).st_mtime) != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+class MetadataCache:
+    """Store reflection data in a directory, one file per name."""
+    def __init__(self, path: str, php_version: str, codec: str,
+                 project: str = '') -> None:
+        project_digest = hashlib.sha1(
+            project.encode(errors='surrogateescape')).hexdigest()
+        self.path = os.path.join(
+            path, '{}-{}-{}'.format(FORMAT_VERSION, php_version, codec),
+            project_digest)
+
+    def _filename(self, kind: str, name: str) -> str:
+        digest = hashlib.sha1(name.encode(errors='surrogateescape'))
+        return os.path.join(self.path, kind, digest.hexdigest() + '.json')
+
+    def get(self, kind: str, name: str) -> Optional[Dict[str, Any]]:
+        """Get the cached info for a name, if it's still valid."""
+        try:
+            with open(self._filename(kind, name), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('name') != name:
+            return None
+        if not is_fresh(entry['info']['files']):
+            return None
+        return entry['info']            # type: ignore
+
+    def put(self, kind: str, name: str, info: Dict[str, Any]) -> None:
+        """Store info for a name, if it can be validated later."""
+        files = info.get('files')
+        if files == []:
+            # PHP turns empty associative arrays into empty lists
+            files = {}
+        if (not isinstance(files, dict) or '\0' in name or
+                any(mtime is None for mtime in files.values())):
+            return
+        filename = self._filename(kind, name)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename))
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'name': name, 'info': info}, f)
+            os.replace(tmp, filename)
+        except OSError:
+            # The cache is only an optimization, so don't let it get in the
+            # way if the directory isn't writable
+            pass
+
+
+class SharedCache:
+    """Keep reflection data in memory, so several bridges can share it.
+
+    This is meant for bridges that run the same code, like the workers of a
+    pool. Entries don't have to be validated, because a process can't change
+    a class or function after declaring it. If backing is given, entries
+    that aren't in memory yet are looked up there, and new entries are
+    stored there as well.
+    """
+    def __init__(self, backing: Optional[MetadataCache] = None) -> None:
+        self.backing = backing
+        self._entries = {}      # type: Dict[Tuple[str, str], Dict[str, Any]]
+
+    def get(self, kind: str, name: str) -> Optional[Dict[str, Any]]:
+        info = self._entries.get((kind, name))
+        if info is None and self.backing is not None:
+            info = self.backing.get(kind, name)
+            if info is not None:
+                self._entries[kind, name] = info
+        return info
+
+    def put(self, kind: str, name: str, info: Dict[str, Any]) -> None:
+        self._entries[kind, name] = info
+        if self.backing is not None:
+            self.backing.put(kind, name, info)
+
+
+AnyCache = Union[MetadataCache, SharedCache]
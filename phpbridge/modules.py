@@ -44,10 +44,7 @@ class Namespace(ModuleType):
 
     def __dir__(self) -> Generator:
         yield from super().__dir__()
-        for entry in self._bridge.send_command('listEverything', self._path):
-            if '\\' not in entry:
-                yield entry
-                continue
+        yield from self._bridge.list_names(self._path)
 
     @property
     def __all__(self) -> List[str]:
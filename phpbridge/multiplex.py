@@ -0,0 +1,78 @@
+"""Garbage collection for bridges that have many commands in flight."""
+
+import time
+
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List  # noqa: F401
+
+from phpbridge import PHPBridge
+
+
+class MultiplexedBridge(PHPBridge):
+    """A bridge whose commands get IDs, so their responses can be matched.
+
+    A response can still be on its way, or waiting to be decoded, while
+    other commands send garbage. So each garbage key is only reported once,
+    along with the last ID up to which all responses are processed. The
+    server refuses keys that a later response used, and those go back to
+    the pending garbage unless they have a proxy again.
+
+    Subclasses remove IDs from _unfinished once the objects in a response
+    have proxies.
+    """
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._next_id = 0
+        # The IDs of commands whose responses haven't been processed yet, in
+        # order
+        self._unfinished = OrderedDict()  # type: OrderedDict[int, None]
+        # The garbage keys sent with each command that's still waiting
+        self._garbage_sent = {}  # type: Dict[int, List[int]]
+
+    def make_message(self, command: str, data: Any) -> Dict[str, Any]:
+        message = super().make_message(command, data)
+        # Only report each key once. The server confirms it, or refuses it
+        # if a response that's still being processed used it, because that
+        # would end up with a proxy that PHP already forgot about.
+        self._collected.difference_update(message['garbage'])
+        return message
+
+    def _track(self, message: Dict[str, Any]) -> int:
+        """Give a message the next ID, and remember the garbage it sends."""
+        ident = self._next_id
+        if message['garbage']:
+            message['seen'] = self._seen()
+            self._garbage_sent[ident] = message['garbage']
+        self._next_id += 1
+        self._unfinished[ident] = None
+        message['id'] = ident
+        return ident
+
+    def _seen(self) -> int:
+        """Get the last command ID up to which all responses are processed.
+        """
+        if self._unfinished:
+            return next(iter(self._unfinished)) - 1  # type: ignore
+        return self._next_id - 1
+
+    def _refused(self, sent: Iterable[int], collected: Iterable[int]) -> None:
+        """Put garbage that the server kept back, unless it's in use again.
+        """
+        refused = set(sent).difference(collected)
+        for key in refused:
+            if key not in self._remotes:
+                if self._garbage_since is None:
+                    self._garbage_since = time.monotonic()
+                self._collected.add(key)
+
+    def confirm_collected(self, keys: Iterable[int]) -> None:
+        # Keys are dropped from the pending garbage as soon as they're sent
+        if self._debug:
+            for key in keys:
+                print("Confirmed {} collected".format(key))
+        self._forget_keys(keys)
+
+    def handle_stats(self) -> Dict[str, int]:
+        stats = super().handle_stats()
+        stats['pending'] += sum(map(len, self._garbage_sent.values()))
+        return stats
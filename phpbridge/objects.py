@@ -1,12 +1,12 @@
 """Translation of PHP classes and objects to Python."""
 
 from itertools import product
-from typing import (Any, Callable, Dict, List, Optional, Type,  # noqa: F401
-                    Union)
+from typing import (Any, Callable, Dict, Iterable, List,  # noqa: F401
+                    Optional, Sequence, Type, Union)
 from warnings import warn
 
-from phpbridge.functions import make_signature, default_constructor_signature
-from phpbridge import modules, utils
+from phpbridge.functions import PHPFunction, default_constructor_signature
+from phpbridge import modules, streams, utils
 
 MYPY = False
 if MYPY:
@@ -59,6 +59,10 @@ class PHPObject(metaclass=PHPClass):
     __new__.__signature__ = default_constructor_signature  # type: ignore
 
     def __repr__(self) -> str:
+        if self._bridge.asynchronous:
+            # A repr can't wait for a response
+            return "<{} PHP object {}>".format(
+                self.__class__._name, self._hash)  # type: ignore
         return self._bridge.send_command(  # type: ignore
             'repr', self._bridge.encode(self), decode=True)
 
@@ -86,13 +90,40 @@ class PHPObject(metaclass=PHPClass):
         return super().__dir__() + self._bridge.send_command(  # type: ignore
             'listNonDefaultProperties', self._bridge.encode(self))
 
+    def _snapshot(self, names: Optional[Iterable[str]] = None
+                  ) -> Dict[str, Any]:
+        """Get the values of many properties in a single round trip.
+
+        If names is None, all public properties are included.
+        """
+        return snapshot([self], names)[0]
+
+
+def snapshot(objs: Iterable[PHPObject],
+             names: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """Get the properties of many objects in a single round trip.
+
+    Returns a dict for each object. If names is None, all public properties
+    are included. The objects have to belong to the same bridge.
+    """
+    objs = list(objs)
+    if not objs:
+        return []
+    bridge = objs[0]._bridge
+    if any(obj._bridge is not bridge for obj in objs):
+        raise ValueError("The objects belong to different bridges")
+    result = bridge.send_command(
+        'getProperties',
+        {'objs': [bridge.encode(obj) for obj in objs],
+         'names': None if names is None else list(names)},
+        decode=True)
+    return [dict(properties.items()) for properties in result]
+
 
 def make_method(bridge: 'PHPBridge', classname: str, name: str,
-                info: dict) -> Callable:
+                info: dict, bases: Sequence[Type] = ()) -> Callable:
 
-    def method(*args: Any, **kwargs: Any) -> Any:
-        self, *args = utils.parse_args(
-            method.__signature__, args, kwargs)  # type: ignore
+    def call(self: Any, *args: Any) -> Any:
         return bridge.send_command(
             'callMethod',
             {'obj': bridge.encode(self),
@@ -100,12 +131,10 @@ def make_method(bridge: 'PHPBridge', classname: str, name: str,
              'args': [bridge.encode(arg) for arg in args]},
             decode=True)
 
-    method.__module__ = modules.get_module(bridge, classname)
-    method.__name__ = name
-    method.__qualname__ = modules.basename(classname) + '.' + name
-
-    if info['doc'] is not False:
-        method.__doc__ = utils.convert_docblock(info['doc'])
+    method = PHPFunction(bridge, name,
+                         modules.basename(classname) + '.' + name,
+                         modules.get_module(bridge, classname), info, call,
+                         add_first='self', bases=bases)
 
     if info['static']:
         # mypy doesn't know classmethods are callable
@@ -144,7 +173,7 @@ def create_class(bridge: 'PHPBridge', unresolved_classname: str) -> None:
         bridge: The bridge the class belongs to.
         unresolved_classname: The name of the class.
     """
-    info = bridge.send_command('classInfo', unresolved_classname)
+    info = bridge.reflect('classInfo', unresolved_classname)
 
     classname = info['name']            # type: str
     methods = info['methods']           # type: Dict[str, Dict[str, Any]]
@@ -195,8 +224,6 @@ def create_class(bridge: 'PHPBridge', unresolved_classname: str) -> None:
         property_doc = utils.convert_docblock(property_info['doc'])
         bindings[name] = create_property(name, property_doc)
 
-    created_methods = {}        # type: Dict[str, Callable]
-
     from phpbridge.classes import magic_aliases
     for name, method_info in methods.items():
         if name in bindings:
@@ -206,38 +233,22 @@ def create_class(bridge: 'PHPBridge', unresolved_classname: str) -> None:
             # Make inheritance visible
             continue
 
-        method = make_method(bridge, classname, name, method_info)
-
-        if (isinstance(method.__doc__, str) and
-                '@inheritdoc' in method.__doc__.lower()):
-            # If @inheritdoc is used, we manually look for inheritance.
-            # If method.__doc__ is empty we leave it empty, and pydoc and
-            # inspect know where to look.
-            for base in bases:
-                try:
-                    base_doc = getattr(base, name).__doc__
-                    if isinstance(base_doc, str):
-                        method.__doc__ = base_doc
-                        break
-                except AttributeError:
-                    pass
+        # bases is copied, because it's changed later on
+        method = make_method(bridge, classname, name, method_info,
+                             tuple(bases))
 
         bindings[name] = method
-        created_methods[name] = method
         if name in magic_aliases:
             bindings[magic_aliases[name]] = method
 
         if method_info['isConstructor']:
-
-            def __new__(*args: Any, **kwargs: Any) -> Any:
-                cls, *args = utils.parse_args(
-                    __new__.__signature__, args, kwargs)  # type: ignore
-                return PHPObject.__new__(cls, *args)
-
-            __new__.__module__ = method.__module__
-            __new__.__qualname__ = modules.basename(classname) + '.__new__'
-            __new__.__doc__ = method.__doc__
-            bindings['__new__'] = __new__
+            __new__ = PHPFunction(
+                bridge, '__new__', modules.basename(classname) + '.__new__',
+                modules.get_module(bridge, classname), method_info,
+                PHPObject.__new__, add_first='cls', bases=tuple(bases))
+            # Like regular functions, a __new__ in the class body becomes a
+            # staticmethod, but for other callables we have to do it
+            bindings['__new__'] = staticmethod(__new__)
 
     # Bind the magic methods needed to make these interfaces work
     # TODO: figure out something less ugly
@@ -290,20 +301,6 @@ def create_class(bridge: 'PHPBridge', unresolved_classname: str) -> None:
     bridge.classes[unresolved_classname] = cls
     bridge.classes[classname] = cls
 
-    # Only now do we attach signatures, because the signatures may contain the
-    # class we just registered
-    for name, func in created_methods.items():
-        method_info = methods[name]
-        if method_info['static']:
-            # classmethod
-            func = func.__func__  # type: ignore
-        signature = make_signature(bridge, method_info, add_first='self')
-        func.__signature__ = signature  # type: ignore
-
-        if method_info['isConstructor']:
-            cls.__new__.__signature__ = make_signature(  # type: ignore
-                bridge, method_info, add_first='cls')
-
 
 class PHPResource:
     """A representation of a remote resource value.
@@ -322,6 +319,16 @@ class PHPResource:
         """Mimics print_r output for resources, but more informative."""
         return "<PHP {} resource id #{}>".format(self._type, self._id)
 
+    def open(self, buffering: int = streams.default_buffer_size,
+             encoding: Optional[str] = None, errors: Optional[str] = None,
+             newline: Optional[str] = None, closefd: bool = True) -> Any:
+        """Wrap a stream resource in a file object, like open().
+
+        See phpbridge.streams.open_stream.
+        """
+        return streams.open_stream(self, buffering, encoding, errors,
+                                   newline, closefd)
+
 
 php_types = {
     'int': int,
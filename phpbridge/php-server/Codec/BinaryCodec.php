@@ -0,0 +1,409 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+use blyxxyz\PythonServer\Exceptions\ConnectionLostException;
+
+/**
+ * Send messages in a compact tagged binary format.
+ *
+ * Each frame is a big-endian 32-bit length followed by a single value. Each
+ * value starts with a one-byte tag. Strings are sent as they are, without
+ * checking their encoding, and floats keep NAN and INF.
+ *
+ * Arrays whose values all have the same scalar type are sent as typed
+ * blocks, which are packed and unpacked with a single call instead of value
+ * by value.
+ */
+class BinaryCodec implements CodecInterface
+{
+    const NULL = 0x00;
+    const FALSE = 0x01;
+    const TRUE = 0x02;
+    const INT8 = 0x03;
+    const INT64 = 0x04;
+    const FLOAT = 0x05;
+    const STRING = 0x06;
+    const LIST = 0x07;
+    const MAP = 0x08;
+    const OBJECT = 0x09;
+    const RESOURCE = 0x0a;
+    const DEFERRED = 0x0b;
+    const VALUE = 0x0c;
+    const INT_LIST = 0x0d;
+    const FLOAT_LIST = 0x0e;
+    const STRING_LIST = 0x0f;
+    const BOOL_LIST = 0x10;
+    const COLUMNS = 0x11;
+    const NUMBERS = 0x12;
+
+    /**
+     * Smaller arrays are sent value by value.
+     */
+    const BLOCK_MIN = 8;
+
+    public function getName(): string
+    {
+        return 'binary';
+    }
+
+    public function nativeValues(): bool
+    {
+        return true;
+    }
+
+    public function read($stream): array
+    {
+        $length = unpack('N', static::readExactly($stream, 4))[1];
+        $message = $this->unpack(static::readExactly($stream, $length));
+        if (!is_array($message)) {
+            throw new \RuntimeException("Received a message that's not a map");
+        }
+        return $message;
+    }
+
+    public function encodeMessage(array $message): string
+    {
+        $packed = $this->pack($message);
+        return pack('N', strlen($packed)) . $packed;
+    }
+
+    /**
+     * Read exactly $length bytes, even if they arrive in pieces.
+     *
+     * @param resource $stream
+     * @param int $length
+     *
+     * @return string
+     */
+    protected static function readExactly($stream, int $length): string
+    {
+        $data = '';
+        while (strlen($data) < $length) {
+            $chunk = fread($stream, $length - strlen($data));
+            if ($chunk === false || $chunk === '') {
+                throw new ConnectionLostException("Can't read from input");
+            }
+            $data .= $chunk;
+        }
+        return $data;
+    }
+
+    /**
+     * Serialize a single value.
+     *
+     * @param mixed $value
+     *
+     * @return string
+     */
+    public function pack($value): string
+    {
+        if (is_string($value)) {
+            return pack('CN', self::STRING, strlen($value)) . $value;
+        } elseif (is_int($value)) {
+            if ($value >= -128 && $value < 128) {
+                return pack('Cc', self::INT8, $value);
+            }
+            return pack('CJ', self::INT64, $value);
+        } elseif (is_float($value)) {
+            return pack('CE', self::FLOAT, $value);
+        } elseif (is_bool($value)) {
+            return pack('C', $value ? self::TRUE : self::FALSE);
+        } elseif ($value === null) {
+            return pack('C', self::NULL);
+        } elseif (is_array($value)) {
+            if (count($value) >= self::BLOCK_MIN) {
+                $type = static::blockType($value);
+                if ($type !== null) {
+                    return $this->packBlock($value, $type);
+                }
+            }
+            $parts = [];
+            if (static::isList($value)) {
+                $parts[] = pack('CN', self::LIST, count($value));
+                foreach ($value as $item) {
+                    $parts[] = $this->pack($item);
+                }
+            } else {
+                $parts[] = pack('CN', self::MAP, count($value));
+                foreach ($value as $key => $item) {
+                    $parts[] = $this->pack($key);
+                    $parts[] = $this->pack($item);
+                }
+            }
+            return implode('', $parts);
+        } elseif ($value instanceof Handle) {
+            switch ($value->kind) {
+                case Handle::OBJECT:
+                    return pack('C', self::OBJECT) . $this->pack($value->key);
+                case Handle::RESOURCE:
+                    return pack('C', self::RESOURCE) . $this->pack($value->key)
+                        . $this->pack($value->type);
+                case Handle::DEFERRED:
+                    return pack('C', self::DEFERRED) . $this->pack($value->key);
+            }
+        } elseif ($value instanceof Numbers) {
+            $length = strlen($value->data);
+            return pack('CaN', self::NUMBERS, $value->format, $length)
+                . $value->data;
+        } elseif ($value instanceof ObjectState) {
+            $parts = [
+                pack('C', self::VALUE),
+                $this->pack($value->class),
+                pack('N', count($value->properties))
+            ];
+            foreach ($value->properties as $name => $item) {
+                $parts[] = $this->pack((string)$name);
+                $parts[] = $this->pack($item);
+            }
+            return implode('', $parts);
+        }
+        $type = gettype($value);
+        throw new \RuntimeException("Can't pack value of type '$type'");
+    }
+
+    /**
+     * Get the type of an array's values if they all have the same scalar
+     * type.
+     *
+     * @param array $array
+     *
+     * @return string|null
+     */
+    protected static function blockType(array $array)
+    {
+        $type = gettype(reset($array));
+        if (!in_array($type, ['integer', 'double', 'string', 'boolean'])) {
+            return null;
+        }
+        foreach ($array as $item) {
+            if (gettype($item) !== $type) {
+                return null;
+            }
+        }
+        return $type;
+    }
+
+    /**
+     * Serialize an array whose values all have the same scalar type.
+     *
+     * @param array $array
+     * @param string $type
+     *
+     * @return string
+     */
+    protected function packBlock(array $array, string $type): string
+    {
+        if (!static::isList($array)) {
+            // The keys and the values are sent as separate lists
+            return pack('C', self::COLUMNS)
+                . $this->pack(array_keys($array))
+                . $this->pack(array_values($array));
+        }
+        $count = count($array);
+        switch ($type) {
+            case 'integer':
+                return pack('CN', self::INT_LIST, $count)
+                    . pack('J*', ...$array);
+            case 'double':
+                return pack('CN', self::FLOAT_LIST, $count)
+                    . pack('E*', ...$array);
+            case 'string':
+                return pack('CN', self::STRING_LIST, $count)
+                    . pack('N*', ...array_map('strlen', $array))
+                    . implode('', $array);
+            default:
+                return pack('CN', self::BOOL_LIST, $count)
+                    . pack('C*', ...array_map('intval', $array));
+        }
+    }
+
+    /**
+     * Deserialize a single value, inverts pack.
+     *
+     * @param string $data
+     *
+     * @return mixed
+     */
+    public function unpack(string $data)
+    {
+        $offset = 0;
+        $value = $this->unpackValue($data, $offset);
+        if ($offset !== strlen($data)) {
+            throw new \RuntimeException("Trailing data after message");
+        }
+        return $value;
+    }
+
+    /**
+     * Deserialize the value at $offset and move $offset past it.
+     *
+     * @param string $data
+     * @param int $offset
+     *
+     * @return mixed
+     */
+    protected function unpackValue(string $data, int &$offset)
+    {
+        if ($offset >= strlen($data)) {
+            throw new \RuntimeException("Unexpected end of message");
+        }
+        $tag = ord($data[$offset]);
+        $offset += 1;
+        switch ($tag) {
+            case self::NULL:
+                return null;
+            case self::FALSE:
+                return false;
+            case self::TRUE:
+                return true;
+            case self::INT8:
+                return unpack('c', static::take($data, $offset, 1))[1];
+            case self::INT64:
+                return unpack('J', static::take($data, $offset, 8))[1];
+            case self::FLOAT:
+                return unpack('E', static::take($data, $offset, 8))[1];
+            case self::STRING:
+                $length = unpack('N', static::take($data, $offset, 4))[1];
+                return static::take($data, $offset, $length);
+            case self::LIST:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                $result = [];
+                for ($i = 0; $i < $count; $i++) {
+                    $result[] = $this->unpackValue($data, $offset);
+                }
+                return $result;
+            case self::MAP:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                $result = [];
+                for ($i = 0; $i < $count; $i++) {
+                    $key = $this->unpackValue($data, $offset);
+                    $result[$key] = $this->unpackValue($data, $offset);
+                }
+                return $result;
+            case self::OBJECT:
+                $key = $this->unpackValue($data, $offset);
+                return new Handle(Handle::OBJECT, $key);
+            case self::RESOURCE:
+                $key = $this->unpackValue($data, $offset);
+                $type = $this->unpackValue($data, $offset);
+                return new Handle(Handle::RESOURCE, $key, $type);
+            case self::DEFERRED:
+                $key = $this->unpackValue($data, $offset);
+                return new Handle(Handle::DEFERRED, $key);
+            case self::INT_LIST:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                return static::unpackNumbers('J', 8, $count, $data, $offset);
+            case self::FLOAT_LIST:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                return static::unpackNumbers('E', 8, $count, $data, $offset);
+            case self::STRING_LIST:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                $lengths = static::unpackNumbers(
+                    'N',
+                    4,
+                    $count,
+                    $data,
+                    $offset
+                );
+                $result = [];
+                foreach ($lengths as $length) {
+                    $result[] = static::take($data, $offset, $length);
+                }
+                return $result;
+            case self::BOOL_LIST:
+                $count = unpack('N', static::take($data, $offset, 4))[1];
+                return array_map(
+                    'boolval',
+                    static::unpackNumbers('C', 1, $count, $data, $offset)
+                );
+            case self::NUMBERS:
+                $format = static::take($data, $offset, 1);
+                $length = unpack('N', static::take($data, $offset, 4))[1];
+                return new Numbers(
+                    $format,
+                    static::take($data, $offset, $length)
+                );
+            case self::COLUMNS:
+                $keys = $this->unpackValue($data, $offset);
+                $values = $this->unpackValue($data, $offset);
+                if (!is_array($keys) || !is_array($values)
+                    || count($keys) !== count($values)) {
+                    throw new \RuntimeException("Malformed columns");
+                }
+                if ($keys === []) {
+                    return [];
+                }
+                return array_combine($keys, $values);
+            default:
+                throw new \RuntimeException("Unknown tag $tag");
+        }
+    }
+
+    /**
+     * Unpack a block of numbers that all have the same format.
+     *
+     * @param string $format A format code for unpack
+     * @param int $size The size of each number in bytes
+     * @param int $count
+     * @param string $data
+     * @param int $offset
+     *
+     * @return array
+     */
+    protected static function unpackNumbers(
+        string $format,
+        int $size,
+        int $count,
+        string $data,
+        int &$offset
+    ): array {
+        if ($count === 0) {
+            return [];
+        }
+        $block = static::take($data, $offset, $size * $count);
+        return array_values(unpack("$format*", $block));
+    }
+
+    /**
+     * Get $length bytes starting at $offset and move $offset past them.
+     *
+     * @param string $data
+     * @param int $offset
+     * @param int $length
+     *
+     * @return string
+     */
+    protected static function take(
+        string $data,
+        int &$offset,
+        int $length
+    ): string {
+        if ($offset + $length > strlen($data)) {
+            throw new \RuntimeException("Unexpected end of message");
+        }
+        $result = (string)substr($data, $offset, $length);
+        $offset += $length;
+        return $result;
+    }
+
+    /**
+     * Determine whether an array's keys are 0, 1, 2, etc., in order.
+     *
+     * @param array $array
+     *
+     * @return bool
+     */
+    protected static function isList(array $array): bool
+    {
+        $index = 0;
+        foreach ($array as $key => $_) {
+            if ($key !== $index) {
+                return false;
+            }
+            $index++;
+        }
+        return true;
+    }
+}
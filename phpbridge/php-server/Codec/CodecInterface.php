@@ -0,0 +1,50 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+/**
+ * Serialize messages for the wire.
+ *
+ * A codec takes care of both the framing and the serialization of messages.
+ * Codecs with native values can carry values like binary strings, special
+ * floats and object handles directly. Other codecs need them to be wrapped
+ * in {type, value} arrays by the CommandServer.
+ */
+interface CodecInterface
+{
+    /**
+     * The name used to select the codec.
+     *
+     * @return string
+     */
+    public function getName(): string;
+
+    /**
+     * Whether values can be sent without wrapping them.
+     *
+     * @return bool
+     */
+    public function nativeValues(): bool;
+
+    /**
+     * Read a single message from a stream.
+     *
+     * Throws a ConnectionLostException if the stream is closed, and another
+     * exception if the message can't be decoded.
+     *
+     * @param resource $stream
+     *
+     * @return array
+     */
+    public function read($stream): array;
+
+    /**
+     * Serialize a message into a complete frame, ready to be written.
+     *
+     * @param array $message
+     *
+     * @return string
+     */
+    public function encodeMessage(array $message): string;
+}
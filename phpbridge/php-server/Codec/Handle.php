@@ -0,0 +1,42 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+/**
+ * A reference to something that can't be sent by value.
+ *
+ * Used by codecs with native values to represent objects and resources in
+ * the ObjectStore, and the results of earlier commands in a batch.
+ */
+class Handle
+{
+    const OBJECT = 'object';
+    const RESOURCE = 'resource';
+    const DEFERRED = 'deferred';
+
+    /** @var string */
+    public $kind;
+
+    /** @var string|int */
+    public $key;
+
+    /**
+     * The type of a resource.
+     *
+     * @var string|null
+     */
+    public $type;
+
+    /**
+     * @param string $kind
+     * @param string|int $key
+     * @param string|null $type
+     */
+    public function __construct(string $kind, $key, string $type = null)
+    {
+        $this->kind = $kind;
+        $this->key = $key;
+        $this->type = $type;
+    }
+}
@@ -0,0 +1,49 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+use blyxxyz\PythonServer\Exceptions\ConnectionLostException;
+
+/**
+ * Send messages as lines of JSON.
+ *
+ * This is the codec every connection starts with, so it's always available
+ * as a fallback.
+ */
+class JsonCodec implements CodecInterface
+{
+    public function getName(): string
+    {
+        return 'json';
+    }
+
+    public function nativeValues(): bool
+    {
+        return false;
+    }
+
+    public function read($stream): array
+    {
+        $line = fgets($stream);
+        if ($line === false) {
+            throw new ConnectionLostException("Can't read from input");
+        }
+        $result = json_decode($line, true);
+        if (!is_array($result)) {
+            throw new \RuntimeException(
+                "Error decoding JSON: " . json_last_error_msg()
+            );
+        }
+        return $result;
+    }
+
+    public function encodeMessage(array $message): string
+    {
+        $encoded = json_encode($message, JSON_PRESERVE_ZERO_FRACTION);
+        if ($encoded === false) {
+            throw new \RuntimeException(json_last_error_msg());
+        }
+        return $encoded . "\n";
+    }
+}
@@ -0,0 +1,30 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+/**
+ * A list of numbers in a single binary string.
+ *
+ * Used by codecs with native values. Both sides run on the same machine, so
+ * the numbers are in machine byte order, and the format is a code for pack
+ * and unpack.
+ */
+class Numbers
+{
+    /** @var string */
+    public $format;
+
+    /** @var string */
+    public $data;
+
+    /**
+     * @param string $format
+     * @param string $data
+     */
+    public function __construct(string $format, string $data)
+    {
+        $this->format = $format;
+        $this->data = $data;
+    }
+}
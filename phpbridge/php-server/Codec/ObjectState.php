@@ -0,0 +1,33 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer\Codec;
+
+/**
+ * The public state of an object that's sent by value.
+ *
+ * Used by codecs with native values. The other side gets a copy of the
+ * properties instead of a reference to the object.
+ */
+class ObjectState
+{
+    /** @var string */
+    public $class;
+
+    /**
+     * The encoded values of the public properties, by name.
+     *
+     * @var array<string, mixed>
+     */
+    public $properties;
+
+    /**
+     * @param string $class
+     * @param array<string, mixed> $properties
+     */
+    public function __construct(string $class, array $properties)
+    {
+        $this->class = $class;
+        $this->properties = $properties;
+    }
+}
@@ -3,6 +3,13 @@ declare(strict_types=1);
 
 namespace blyxxyz\PythonServer;
 
+use blyxxyz\PythonServer\Codec\BinaryCodec;
+use blyxxyz\PythonServer\Codec\CodecInterface;
+use blyxxyz\PythonServer\Codec\Handle;
+use blyxxyz\PythonServer\Codec\JsonCodec;
+use blyxxyz\PythonServer\Codec\Numbers;
+use blyxxyz\PythonServer\Codec\ObjectState;
+
 /**
  * Process commands from another process
  *
@@ -14,12 +21,146 @@ namespace blyxxyz\PythonServer;
  */
 abstract class CommandServer
 {
+    /**
+     * Commands whose strings are never sent as streams.
+     *
+     * Python needs the results of str and repr, and the parameter defaults in
+     * reflection data, as real strings. The chunks that readStream returns
+     * are already as big as they should be.
+     */
+    const WHOLE_STRING_COMMANDS = [
+        'str',
+        'repr',
+        'classInfo',
+        'classInfoClosure',
+        'funcInfo',
+        'streamInfo',
+        'readStream'
+    ];
+
+    /**
+     * Commands that can't declare new names.
+     *
+     * The name index is only brought up to date after other commands. The
+     * commands in a batch are each executed on their own.
+     */
+    const NAME_NEUTRAL_COMMANDS = [
+        'resolveName',
+        'listEverything',
+        'listNames',
+        'listNamespaces',
+        'listConsts',
+        'listGlobals',
+        'listFuns',
+        'listClasses',
+        'getConst',
+        'getGlobal',
+        'funcInfo',
+        'setCodec',
+        'setValueClass',
+        'setValueDepth',
+        'collectGarbage',
+        'batch'
+    ];
+
     /** @var ObjectStore */
     private $objectStore;
 
+    /**
+     * Encoded results of the commands in the batch that's being executed.
+     *
+     * @var array<int, mixed>
+     */
+    private $batchResults;
+
+    /** @var CodecInterface */
+    protected $codec;
+
+    /**
+     * A codec to switch to after the current response is sent.
+     *
+     * @var CodecInterface|null
+     */
+    private $nextCodec;
+
+    /**
+     * Classes whose objects are sent by value, by lowercase name.
+     *
+     * @var array<string, string>
+     */
+    private $valueClasses;
+
+    /**
+     * Whether each class that was checked is a value class, by name.
+     *
+     * @var array<string, bool>
+     */
+    private $isValueClass;
+
+    /**
+     * How deeply objects of value classes are nested before handles are
+     * used instead.
+     *
+     * @var int
+     */
+    private $valueDepth;
+
+    /**
+     * How deeply any object is sent by value in the current response.
+     *
+     * @var int
+     */
+    private $byValue;
+
+    /**
+     * How many objects that are sent by value are being encoded.
+     *
+     * @var int
+     */
+    private $valueLevel;
+
+    /**
+     * Whether lists of numbers are sent as binary strings in the current
+     * response.
+     *
+     * @var bool
+     */
+    private $buffers;
+
+    /**
+     * Strings longer than this are sent as temporary streams in the current
+     * response, unless it's 0.
+     *
+     * @var int
+     */
+    private $streamStrings;
+
     public function __construct()
     {
         $this->objectStore = new ObjectStore();
+        $this->batchResults = [];
+        $this->codec = new JsonCodec();
+        $this->nextCodec = null;
+        $this->valueClasses = [];
+        $this->isValueClass = [];
+        $this->valueDepth = 8;
+        $this->byValue = 0;
+        $this->valueLevel = 0;
+        $this->buffers = false;
+        $this->streamStrings = 0;
+    }
+
+    /**
+     * Get the classes of all supported codecs, by name.
+     *
+     * @return array<string, string>
+     */
+    protected static function codecs(): array
+    {
+        return [
+            'binary' => BinaryCodec::class,
+            'json' => JsonCodec::class
+        ];
     }
 
     /**
@@ -43,20 +184,26 @@ abstract class CommandServer
     abstract public function send(array $data);
 
     /**
-     * Encode a value into something JSON-serializable.
+     * Encode a value into something the codec can serialize.
      *
      * @param mixed $data
      *
-     * @return array{type: string, value: mixed}
+     * @return mixed
      */
-    protected function encode($data): array
+    protected function encode($data)
     {
+        if ($this->codec->nativeValues()) {
+            return $this->encodeNative($data);
+        }
         if (is_int($data) || is_null($data) || is_bool($data)) {
             return [
                 'type' => gettype($data),
                 'value' => $data
             ];
         } elseif (is_string($data)) {
+            if ($this->isLong($data)) {
+                return $this->encode(Commands::stringStream($data));
+            }
             if (mb_check_encoding($data)) {
                 return [
                     'type' => 'string',
@@ -76,18 +223,37 @@ abstract class CommandServer
                 'value' => $data
             ];
         } elseif (is_array($data)) {
+            $numbers = $this->packNumbers($data);
+            if ($numbers !== null) {
+                return [
+                    'type' => 'numbers',
+                    'value' => [
+                        'format' => $numbers->format,
+                        'data' => base64_encode($numbers->data)
+                    ]
+                ];
+            }
+            if (static::isPlain($data) && !$this->hasLong($data)) {
+                return [
+                    'type' => 'scalars',
+                    'value' => $data
+                ];
+            }
             return [
                 'type' => 'array',
                 'value' => array_map([$this, 'encode'], $data)
             ];
         } elseif (is_object($data)) {
-            return [
-                'type' => 'object',
-                'value' => [
-                    'class' => get_class($data),
-                    'hash' => $this->objectStore->encode($data)
-                ]
-            ];
+            if ($this->sendsByValue($data)) {
+                return [
+                    'type' => 'value',
+                    'value' => [
+                        'class' => get_class($data),
+                        'properties' => $this->encodeProperties($data)
+                    ]
+                ];
+            }
+            return $this->encodeReference($data);
         } elseif (is_resource($data)) {
             return [
                 'type' => 'resource',
@@ -102,15 +268,284 @@ abstract class CommandServer
         }
     }
 
+    /**
+     * Encode a value for a codec that supports native values.
+     *
+     * Only objects and resources need to be replaced by handles.
+     *
+     * @param mixed $data
+     *
+     * @return mixed
+     */
+    protected function encodeNative($data)
+    {
+        if (is_array($data)) {
+            $type = static::scalarType($data);
+            if ($type !== null && !$this->hasLong($data)) {
+                return $this->packNumbers($data, $type) ?? $data;
+            }
+            return array_map([$this, 'encodeNative'], $data);
+        } elseif (is_object($data)) {
+            if ($this->sendsByValue($data)) {
+                return new ObjectState(
+                    get_class($data),
+                    $this->encodeProperties($data)
+                );
+            }
+            return $this->encodeReference($data);
+        } elseif (is_resource($data)) {
+            return new Handle(
+                Handle::RESOURCE,
+                $this->objectStore->encode($data),
+                get_resource_type($data)
+            );
+        } elseif (is_string($data) && $this->isLong($data)) {
+            return $this->encodeNative(Commands::stringStream($data));
+        }
+        return $data;
+    }
+
+    /**
+     * Encode an object as a reference, even if it would be sent by value.
+     *
+     * Exceptions and objects that are only used by the protocol, like
+     * iteration generators, must stay in the object store.
+     *
+     * @param object $obj
+     *
+     * @return mixed
+     */
+    protected function encodeReference($obj)
+    {
+        if ($this->codec->nativeValues()) {
+            return new Handle(
+                Handle::OBJECT,
+                $this->objectStore->encode($obj)
+            );
+        }
+        return [
+            'type' => 'object',
+            'value' => $this->objectStore->encode($obj)
+        ];
+    }
+
+    /**
+     * Determine whether a string should be sent as a stream.
+     *
+     * @param string $data
+     *
+     * @return bool
+     */
+    private function isLong(string $data): bool
+    {
+        return $this->streamStrings > 0
+            && strlen($data) > $this->streamStrings;
+    }
+
+    /**
+     * Determine whether an array contains strings that should be sent as
+     * streams.
+     *
+     * @param array $array
+     *
+     * @return bool
+     */
+    private function hasLong(array $array): bool
+    {
+        if ($this->streamStrings === 0) {
+            return false;
+        }
+        foreach ($array as $item) {
+            if (is_string($item) && $this->isLong($item)) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    /**
+     * Get the type of an array's values if they all have the same scalar
+     * type.
+     *
+     * @param array $array
+     *
+     * @return string|null
+     */
+    protected static function scalarType(array $array)
+    {
+        if ($array === []) {
+            return null;
+        }
+        $type = gettype(reset($array));
+        if (!in_array($type, ['integer', 'double', 'string', 'boolean'])) {
+            return null;
+        }
+        foreach ($array as $item) {
+            if (gettype($item) !== $type) {
+                return null;
+            }
+        }
+        return $type;
+    }
+
+    /**
+     * Pack a list of ints or floats into a binary string, if the other side
+     * asked for that.
+     *
+     * @param array $array
+     * @param string|null $type The scalar type of the values, if known
+     *
+     * @return Numbers|null
+     */
+    private function packNumbers(array $array, string $type = null)
+    {
+        if (!$this->buffers || $array === []) {
+            return null;
+        }
+        if ($type === null) {
+            $type = static::scalarType($array);
+        }
+        if ($type === 'integer') {
+            $format = 'q';
+        } elseif ($type === 'double') {
+            $format = 'd';
+        } else {
+            return null;
+        }
+        if (array_values($array) !== $array) {
+            // The keys would be lost
+            return null;
+        }
+        return new Numbers($format, pack("$format*", ...$array));
+    }
+
+    /**
+     * Unpack a list of numbers that was packed into a binary string.
+     *
+     * @param string $format
+     * @param string $data
+     *
+     * @return array
+     */
+    private static function unpackNumbers(string $format, string $data): array
+    {
+        // Not Q, because PHP's integers are signed
+        $formats = ['c', 'C', 's', 'S', 'l', 'L', 'q', 'f', 'd'];
+        if (!in_array($format, $formats, true)) {
+            throw new \Exception("Unknown number format '$format'");
+        }
+        if ($data === '') {
+            return [];
+        }
+        return array_values(unpack("$format*", $data));
+    }
+
+    /**
+     * Determine whether an array can be sent as plain JSON, without tags.
+     *
+     * Its values have to have the same scalar type, and JSON has to be able
+     * to represent them exactly.
+     *
+     * @param array $array
+     *
+     * @return bool
+     */
+    private static function isPlain(array $array): bool
+    {
+        switch (static::scalarType($array)) {
+            case 'integer':
+            case 'boolean':
+                return true;
+            case 'double':
+                $valid = array_filter($array, 'is_finite');
+                return count($valid) === count($array);
+            case 'string':
+                $valid = array_filter($array, 'mb_check_encoding');
+                return count($valid) === count($array);
+            default:
+                return false;
+        }
+    }
+
+    /**
+     * Determine whether an object should be sent by value.
+     *
+     * @param object $obj
+     *
+     * @return bool
+     */
+    private function sendsByValue($obj): bool
+    {
+        $depth = $this->byValue;
+        if ($this->valueClasses !== [] && $this->valueDepth > $depth) {
+            $class = get_class($obj);
+            if (!array_key_exists($class, $this->isValueClass)) {
+                $this->isValueClass[$class] = false;
+                foreach ($this->valueClasses as $valueClass) {
+                    if ($obj instanceof $valueClass) {
+                        $this->isValueClass[$class] = true;
+                        break;
+                    }
+                }
+            }
+            if ($this->isValueClass[$class]) {
+                $depth = $this->valueDepth;
+            }
+        }
+        return $this->valueLevel < $depth;
+    }
+
+    /**
+     * Encode the public properties of an object that's sent by value.
+     *
+     * @param object $obj
+     *
+     * @return array<string, mixed>
+     */
+    private function encodeProperties($obj): array
+    {
+        $this->valueLevel += 1;
+        try {
+            // This is called from outside the object, so only the public
+            // properties are included
+            return array_map([$this, 'encode'], get_object_vars($obj));
+        } finally {
+            $this->valueLevel -= 1;
+        }
+    }
+
+    /**
+     * Start or stop sending objects of a class and its subclasses by value.
+     *
+     * @param string $class
+     * @param bool $enabled
+     *
+     * @return null
+     */
+    private function setValueClass(string $class, bool $enabled)
+    {
+        $class = ltrim($class, '\\');
+        if ($enabled) {
+            $this->valueClasses[strtolower($class)] = $class;
+        } else {
+            unset($this->valueClasses[strtolower($class)]);
+        }
+        $this->isValueClass = [];
+        return null;
+    }
+
     /**
      * Convert deserialized data into the value it represents, inverts encode.
      *
-     * @param array{type: string, value: mixed} $data
+     * @param mixed $data
      *
      * @return mixed
      */
-    protected function decode(array $data)
+    protected function decode($data)
     {
+        if ($this->codec->nativeValues()) {
+            return $this->decodeNative($data);
+        }
         $type = $data['type'];
         $value = $data['value'];
         switch ($type) {
@@ -130,20 +565,126 @@ abstract class CommandServer
                 return $value;
             case 'array':
                 return $this->decodeArray($value);
+            case 'scalars':
+                // The values don't need decoding
+                return $value;
+            case 'numbers':
+                return static::unpackNumbers(
+                    $value['format'],
+                    base64_decode($value['data'])
+                );
             case 'object':
+                return $this->objectStore->decode($value);
             case 'resource':
                 return $this->objectStore->decode($value['hash']);
             case 'bytes':
                 return base64_decode($value);
+            case 'deferred':
+                return $this->decodeDeferred($value);
             default:
                 throw new \Exception("Unknown type '$type'");
         }
     }
 
+    /**
+     * Decode a value sent by a codec that supports native values.
+     *
+     * @param mixed $data
+     *
+     * @return mixed
+     */
+    protected function decodeNative($data)
+    {
+        if (is_array($data)) {
+            if (static::scalarType($data) !== null) {
+                return $data;
+            }
+            return array_map([$this, 'decodeNative'], $data);
+        } elseif ($data instanceof Numbers) {
+            return static::unpackNumbers($data->format, $data->data);
+        } elseif ($data instanceof Handle) {
+            if ($data->kind === Handle::DEFERRED) {
+                return $this->decodeDeferred($data->key);
+            }
+            return $this->objectStore->decode($data->key);
+        }
+        return $data;
+    }
+
+    /**
+     * Get the result of an earlier command in the current batch.
+     *
+     * @param int $index
+     *
+     * @return mixed
+     */
+    private function decodeDeferred(int $index)
+    {
+        if (!array_key_exists($index, $this->batchResults)) {
+            throw new \Exception("Deferred result #$index is not available");
+        }
+        return $this->decodeResult($this->batchResults[$index]);
+    }
+
+    /**
+     * Decode an encoded result, including objects that were sent by value.
+     *
+     * Those objects aren't in the object store, so they become arrays of
+     * their properties, like the Python copies do when they're sent back.
+     *
+     * @param mixed $data
+     *
+     * @return mixed
+     */
+    private function decodeResult($data)
+    {
+        if ($this->codec->nativeValues()) {
+            if ($data instanceof ObjectState) {
+                return array_map([$this, 'decodeResult'], $data->properties);
+            } elseif (is_array($data) && static::scalarType($data) === null) {
+                return array_map([$this, 'decodeResult'], $data);
+            }
+            return $this->decodeNative($data);
+        }
+        switch ($data['type']) {
+            case 'value':
+                return array_map(
+                    [$this, 'decodeResult'],
+                    $data['value']['properties']
+                );
+            case 'array':
+                return array_map([$this, 'decodeResult'], $data['value']);
+            default:
+                return $this->decode($data);
+        }
+    }
+
+    /**
+     * Pick the first supported codec from a list of names.
+     *
+     * The codec is only used after the response to this command is sent,
+     * so that the other side can still read it.
+     *
+     * @param array<string> $names
+     *
+     * @return string
+     */
+    private function chooseCodec(array $names): string
+    {
+        $codecs = static::codecs();
+        foreach ($names as $name) {
+            if (array_key_exists($name, $codecs)) {
+                $this->nextCodec = new $codecs[$name]();
+                return $name;
+            }
+        }
+        throw new \Exception("None of the codecs are supported");
+    }
+
     /**
      * Decode an array of values.
      *
-     * @param array<array> $dataItems
+     * @param array $dataItems
      *
      * @return array
      */
@@ -164,34 +705,176 @@ abstract class CommandServer
             $data = $command['data'];
             $garbage = $command['garbage'];
             $collected = [];
+            $this->byValue = $command['byValue'] ?? 0;
+            $this->buffers = $command['buffers'] ?? false;
+            $this->streamStrings = $command['streamStrings'] ?? 0;
+            if (array_key_exists('id', $command)) {
+                $this->objectStore->setEpoch($command['id']);
+            }
+            $seen = $command['seen'] ?? null;
             try {
                 foreach ($garbage as $key) {
                     // It might have been removed before, but ObjectStore
-                    // doesn't mind
-                    $this->objectStore->remove($key);
-                    $collected[] = $key;
+                    // doesn't mind. It's kept if the client hasn't seen
+                    // every response that used it yet.
+                    if ($this->objectStore->remove($key, $seen)) {
+                        $collected[] = $key;
+                    }
                 }
-                $response = $this->execute($cmd, $data);
+                if ($cmd === 'pushIteration') {
+                    // The chunks are sent instead of a response
+                    $this->pushIteration($data, $collected);
+                    continue;
+                }
+                $message = [
+                    'type' => 'result',
+                    'data' => $this->execute($cmd, $data),
+                    'collected' => $collected
+                ];
             } catch (\Throwable $exception) {
-                $this->send($this->encodeThrownException(
+                $message = $this->encodeThrownException(
                     $exception,
                     $collected
-                ));
-                continue;
+                );
+            }
+            if (array_key_exists('id', $command)) {
+                // Asynchronous clients match responses by their ID
+                $message['id'] = $command['id'];
+            }
+            $this->send($this->announce($message));
+            if ($this->nextCodec !== null) {
+                $this->codec = $this->nextCodec;
+                $this->nextCodec = null;
+            }
+        }
+    }
+
+    /**
+     * Make a call for each list of arguments.
+     *
+     * Each call gets its own response, so an exception only replaces the
+     * result of the call that threw it.
+     *
+     * @param callable $call
+     * @param array $argLists
+     *
+     * @return array
+     */
+    private function callMany(callable $call, array $argLists): array
+    {
+        $responses = [];
+        foreach ($argLists as $args) {
+            try {
+                $responses[] = [
+                    'type' => 'result',
+                    'data' => $this->encode($call($this->decodeArray($args)))
+                ];
+            } catch (\Throwable $exception) {
+                $responses[] = $this->encodeThrownException($exception);
+            }
+        }
+        return $responses;
+    }
+
+    /**
+     * Decode the arguments and offsets in an operation for evaluate.
+     *
+     * @param array $op
+     *
+     * @return array
+     */
+    private function decodeOperation(array $op): array
+    {
+        switch ($op[0]) {
+            case 'call':
+                return ['call', $op[1], $this->decodeArray($op[2])];
+            case 'invoke':
+                return ['invoke', $this->decodeArray($op[1])];
+            case 'item':
+                return ['item', $this->decode($op[1])];
+            default:
+                return $op;
+        }
+    }
+
+    /**
+     * Send chunks of a generator without waiting for a command for each.
+     *
+     * Up to $data['count'] chunks of $data['size'] elements are sent, fewer
+     * if the generator finishes or throws an exception. The first one
+     * confirms the collected garbage.
+     *
+     * @param array $data
+     * @param array<int> $collected
+     *
+     * @return void
+     */
+    private function pushIteration(array $data, array $collected)
+    {
+        for ($sent = 0; $sent < $data['count']; $sent++) {
+            $done = true;
+            try {
+                $chunk = Commands::nextIterationChunk(
+                    $this->decode($data['obj']),
+                    $data['size']
+                );
+                $done = $chunk['done'];
+                $chunk['keys'] = $this->encode($chunk['keys']);
+                $chunk['values'] = $this->encode($chunk['values']);
+                $message = [
+                    'type' => 'result',
+                    'data' => $chunk,
+                    'collected' => $collected
+                ];
+            } catch (\Throwable $exception) {
+                $message = $this->encodeThrownException(
+                    $exception,
+                    $collected
+                );
             }
-            $this->send([
-                'type' => 'result',
-                'data' => $response,
-                'collected' => $collected
-            ]);
+            $message['push'] = true;
+            $this->send($this->announce($message));
+            $collected = [];
+            if ($done) {
+                return;
+            }
+        }
+    }
+
+    /**
+     * Add the classes and keys of new objects to a response.
+     *
+     * The other side has to know about these before it can decode the
+     * objects in the response. Announcements that were already added are
+     * kept.
+     *
+     * @param array $message
+     *
+     * @return array
+     */
+    protected function announce(array $message): array
+    {
+        $announcements = $this->objectStore->takeAnnouncements();
+        if ($announcements['classes'] !== []) {
+            $message['classes'] = array_merge(
+                $message['classes'] ?? [],
+                $announcements['classes']
+            );
+        }
+        if ($announcements['keys'] !== []) {
+            $message['keys'] = array_merge(
+                $message['keys'] ?? [],
+                $announcements['keys']
+            );
         }
+        return $message;
     }
 
     /**
      * Encode an exception into a thrownException response.
      *
      * @param \Throwable $exception
-     * @param array<string|int> $collected
+     * @param array<int> $collected
      * @return array
      */
     protected function encodeThrownException(
@@ -201,13 +884,68 @@ abstract class CommandServer
         return [
             'type' => 'exception',
             'data' => [
-                'value' => $this->encode($exception),
+                'value' => $this->encodeReference($exception),
                 'message' => $exception->getMessage()
             ],
             'collected' => $collected
         ];
     }
 
+    /**
+     * Execute a list of commands in order.
+     *
+     * Later commands can refer to the results of earlier commands using the
+     * 'deferred' type. Execution stops at the first exception, so the list of
+     * responses may be shorter than the list of commands.
+     *
+     * @param array<array{cmd: string, data: mixed}> $commands
+     *
+     * @return array
+     */
+    private function executeBatch(array $commands): array
+    {
+        $responses = [];
+        $this->batchResults = [];
+        $streamStrings = $this->streamStrings;
+        try {
+            foreach ($commands as $command) {
+                // An earlier command may have turned it off
+                $this->streamStrings = $streamStrings;
+                try {
+                    $result = $this->execute($command['cmd'], $command['data']);
+                } catch (\Throwable $exception) {
+                    $responses[] = $this->encodeThrownException($exception);
+                    break;
+                }
+                $this->batchResults[] = $result;
+                $responses[] = [
+                    'type' => 'result',
+                    'data' => $result
+                ];
+            }
+        } finally {
+            $this->batchResults = [];
+        }
+        return $responses;
+    }
+
+    /**
+     * Encode the parameter defaults in the result of classInfo.
+     *
+     * @param array $classInfo
+     *
+     * @return array
+     */
+    private function encodeClassInfo(array $classInfo): array
+    {
+        foreach ($classInfo['methods'] as &$method) {
+            foreach ($method['params'] as &$param) {
+                $param['default'] = $this->encode($param['default']);
+            }
+        }
+        return $classInfo;
+    }
+
     /**
      * Execute a command and return the (unencoded) result.
      *
@@ -218,6 +956,12 @@ abstract class CommandServer
      */
     private function execute(string $command, $data)
     {
+        if (in_array($command, self::WHOLE_STRING_COMMANDS, true)) {
+            $this->streamStrings = 0;
+        }
+        if (!in_array($command, self::NAME_NEUTRAL_COMMANDS, true)) {
+            Commands::namesMayHaveChanged();
+        }
         switch ($command) {
             case 'getConst':
                 return $this->encode(Commands::getConst($data));
@@ -270,6 +1014,22 @@ abstract class CommandServer
                     $this->decode($data['obj']),
                     $this->decode($data['offset'])
                 );
+            case 'callFunMany':
+                return $this->callMany(
+                    function (array $args) use ($data) {
+                        return Commands::callFun($data['name'], $args);
+                    },
+                    $data['args']
+                );
+            case 'callMethodMany':
+                $obj = $this->decode($data['obj']);
+                $name = $data['name'];
+                return $this->callMany(
+                    function (array $args) use ($obj, $name) {
+                        return Commands::callMethod($obj, $name, $args);
+                    },
+                    $data['args']
+                );
             case 'createObject':
                 return $this->encode(Commands::createObject(
                     $data['name'],
@@ -280,6 +1040,11 @@ abstract class CommandServer
                     $this->decode($data['obj']),
                     $data['name']
                 ));
+            case 'getProperties':
+                return $this->encode(Commands::getProperties(
+                    $this->decodeArray($data['objs']),
+                    $data['names']
+                ));
             case 'setProperty':
                 return Commands::setProperty(
                     $this->decode($data['obj']),
@@ -294,13 +1059,12 @@ abstract class CommandServer
             case 'listNonDefaultProperties':
                 return Commands::listNonDefaultProperties($this->decode($data));
             case 'classInfo':
-                $classInfo =  Commands::classInfo($data);
-                foreach ($classInfo['methods'] as &$method) {
-                    foreach ($method['params'] as &$param) {
-                        $param['default'] = $this->encode($param['default']);
-                    }
-                }
-                return $classInfo;
+                return $this->encodeClassInfo(Commands::classInfo($data));
+            case 'classInfoClosure':
+                return array_map(
+                    [$this, 'encodeClassInfo'],
+                    Commands::classInfoClosure($data['name'], $data['known'])
+                );
             case 'funcInfo':
                 $funcInfo = Commands::funcInfo($data);
                 foreach ($funcInfo['params'] as &$param) {
@@ -316,7 +1080,14 @@ abstract class CommandServer
             case 'listClasses':
                 return Commands::listClasses();
             case 'listEverything':
-                return iterator_to_array(Commands::listEverything($data));
+                // The generator yields from several sources, so its keys
+                // repeat
+                return iterator_to_array(
+                    Commands::listEverything($data),
+                    false
+                );
+            case 'listNames':
+                return Commands::listNames($data);
             case 'listNamespaces':
                 return Commands::listNamespaces($data);
             case 'resolveName':
@@ -328,13 +1099,96 @@ abstract class CommandServer
             case 'count':
                 return Commands::count($this->decode($data));
             case 'startIteration':
-                return $this->encode(Commands::startIteration(
+                return $this->encodeReference(Commands::startIteration(
                     $this->decode($data)
                 ));
             case 'nextIteration':
                 return $this->encode(Commands::nextIteration(
                     $this->decode($data)
                 ));
+            case 'nextIterationChunk':
+                $chunk = Commands::nextIterationChunk(
+                    $this->decode($data['obj']),
+                    $data['size']
+                );
+                $chunk['keys'] = $this->encode($chunk['keys']);
+                $chunk['values'] = $this->encode($chunk['values']);
+                return $chunk;
+            case 'evaluate':
+                return $this->encode(Commands::evaluate(
+                    $this->decode($data['base']),
+                    array_map([$this, 'decodeOperation'], $data['ops'])
+                ));
+            case 'streamInfo':
+                return $this->encode(Commands::streamInfo(
+                    $this->decode($data)
+                ));
+            case 'readStream':
+                return $this->encode(Commands::readStream(
+                    $this->decode($data['stream']),
+                    $data['length']
+                ));
+            case 'writeStream':
+                return $this->encode(Commands::writeStream(
+                    $this->decode($data['stream']),
+                    $this->decode($data['data'])
+                ));
+            case 'seekStream':
+                return $this->encode(Commands::seekStream(
+                    $this->decode($data['stream']),
+                    $data['offset'],
+                    $data['whence']
+                ));
+            case 'tellStream':
+                return $this->encode(Commands::tellStream(
+                    $this->decode($data['stream'])
+                ));
+            case 'truncateStream':
+                return $this->encode(Commands::truncateStream(
+                    $this->decode($data['stream']),
+                    $data['size']
+                ));
+            case 'flushStream':
+                return $this->encode(Commands::flushStream(
+                    $this->decode($data['stream'])
+                ));
+            case 'closeStream':
+                return $this->encode(Commands::closeStream(
+                    $this->decode($data)
+                ));
+            case 'mapIterable':
+                return $this->encodeReference(Commands::mapIterable(
+                    $this->decode($data['iterable']),
+                    $this->decode($data['callable'])
+                ));
+            case 'filterIterable':
+                return $this->encodeReference(Commands::filterIterable(
+                    $this->decode($data['iterable']),
+                    $this->decode($data['callable'])
+                ));
+            case 'columnIterable':
+                return $this->encodeReference(Commands::columnIterable(
+                    $this->decode($data['iterable']),
+                    $this->decode($data['name'])
+                ));
+            case 'reduceIterable':
+                return $this->encode(Commands::reduceIterable(
+                    $this->decode($data['iterable']),
+                    $this->decode($data['callable']),
+                    $this->decode($data['initial'])
+                ));
+            case 'batch':
+                return $this->executeBatch($data);
+            case 'setCodec':
+                return $this->chooseCodec($data);
+            case 'setValueClass':
+                return $this->setValueClass($data['name'], $data['enabled']);
+            case 'setValueDepth':
+                $this->valueDepth = $data;
+                return null;
+            case 'collectGarbage':
+                // The garbage that comes with every command is enough
+                return null;
             case 'throwException':
                 Commands::throwException(
                     $data['class'],
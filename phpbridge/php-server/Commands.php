@@ -12,6 +12,16 @@ use blyxxyz\PythonServer\Representer\PythonRepresenter;
  */
 class Commands
 {
+    /** @var NameIndex|null */
+    private static $nameIndex = null;
+
+    /**
+     * Whether names may have been declared since the index was refreshed.
+     *
+     * @var bool
+     */
+    private static $namesChanged = false;
+
     /**
      * Get a constant by its name.
      *
@@ -217,6 +227,36 @@ class Commands
         }
     }
 
+    /**
+     * Get many properties of many objects at once.
+     *
+     * If $names is null, all public properties are returned, including
+     * dynamic ones.
+     *
+     * @param array<object> $objs
+     * @param array<string>|null $names
+     *
+     * @return array<array<string, mixed>>
+     */
+    public static function getProperties(array $objs, $names): array
+    {
+        $result = [];
+        foreach ($objs as $obj) {
+            if ($names === null) {
+                // Called from outside the object, so this only gets the
+                // public properties
+                $result[] = get_object_vars($obj);
+                continue;
+            }
+            $properties = [];
+            foreach ($names as $name) {
+                $properties[$name] = static::getProperty($obj, $name);
+            }
+            $result[] = $properties;
+        }
+        return $result;
+    }
+
     /**
      * Set an object property to a value.
      *
@@ -299,7 +339,8 @@ class Commands
             'isAbstract' => $reflectionClass->isAbstract(),
             'isInterface' => $reflectionClass->isInterface(),
             'isTrait' => $reflectionClass->isTrait(),
-            'parent' => $parent
+            'parent' => $parent,
+            'files' => static::definingFiles($reflectionClass)
         ];
 
         foreach ($reflectionClass->getReflectionConstants() as $constant) {
@@ -339,6 +380,49 @@ class Commands
         return $info;
     }
 
+    /**
+     * Get summaries of a class and all of its ancestors.
+     *
+     * Ancestors are parent classes, traits and interfaces. Classes named in
+     * $known are left out, because the other side already has them, but the
+     * requested class always comes first.
+     *
+     * @param string $class
+     * @param array<string> $known
+     *
+     * @return array<array>
+     */
+    public static function classInfoClosure(string $class, array $known): array
+    {
+        $skip = [];
+        foreach ($known as $name) {
+            $skip[strtolower(ltrim($name, '\\'))] = true;
+        }
+        $infos = [static::classInfo($class)];
+        $skip[strtolower($infos[0]['name'])] = true;
+        $queue = [new \ReflectionClass($class)];
+        while ($queue !== []) {
+            $current = array_shift($queue);
+            $ancestors = array_merge(
+                $current->getTraits(),
+                $current->getInterfaces()
+            );
+            $parent = $current->getParentClass();
+            if ($parent !== false) {
+                array_unshift($ancestors, $parent);
+            }
+            foreach ($ancestors as $ancestor) {
+                $key = strtolower($ancestor->getName());
+                if (!isset($skip[$key])) {
+                    $skip[$key] = true;
+                    $infos[] = static::classInfo($ancestor->getName());
+                    $queue[] = $ancestor;
+                }
+            }
+        }
+        return $infos;
+    }
+
     /**
      * Get detailed information about a function.
      *
@@ -356,8 +440,11 @@ class Commands
         } else {
             throw new \Exception("Could not resolve function '$name'");
         }
+        $files = [];
+        static::addDefiningFile($function->getFileName(), $files);
         return [
             'name' => $function->getName(),
+            'files' => $files,
             'doc' => $function->getDocComment(),
             'params' => array_map(
                 [static::class, 'paramInfo'],
@@ -367,6 +454,60 @@ class Commands
         ];
     }
 
+    /**
+     * Get the modification times of all files that a class depends on.
+     *
+     * This includes the files of all ancestor classes, interfaces and traits,
+     * because a change in any of them can change the class. The time is null
+     * if the file doesn't exist, for example for classes created by eval.
+     *
+     * @param \ReflectionClass $class
+     *
+     * @return array<string, int|null>
+     */
+    private static function definingFiles(\ReflectionClass $class): array
+    {
+        $files = [];
+        $seen = [];
+        $queue = [$class];
+        while ($queue !== []) {
+            $current = array_pop($queue);
+            if (isset($seen[$current->getName()])) {
+                continue;
+            }
+            $seen[$current->getName()] = true;
+            static::addDefiningFile($current->getFileName(), $files);
+            $parent = $current->getParentClass();
+            if ($parent !== false) {
+                $queue[] = $parent;
+            }
+            foreach ($current->getInterfaces() as $interface) {
+                $queue[] = $interface;
+            }
+            foreach ($current->getTraits() as $trait) {
+                $queue[] = $trait;
+            }
+        }
+        return $files;
+    }
+
+    /**
+     * Record the modification time of the file something was defined in.
+     *
+     * @param string|false $file
+     * @param array<string, int|null> $files
+     *
+     * @return void
+     */
+    private static function addDefiningFile($file, array &$files)
+    {
+        if ($file === false) {
+            // Internal classes and functions are tied to the PHP version
+            return;
+        }
+        $files[$file] = is_file($file) ? filemtime($file) : null;
+    }
+
     /**
      * Serialize information about a function parameter.
      *
@@ -450,6 +591,35 @@ class Commands
         return array_merge(get_declared_classes(), get_declared_interfaces());
     }
 
+    /**
+     * Note that code ran which may have declared new names.
+     *
+     * @return void
+     */
+    public static function namesMayHaveChanged()
+    {
+        static::$namesChanged = true;
+    }
+
+    /**
+     * Get the name index, updated with everything declared since last time.
+     *
+     * Refreshing lists every declared name, so it's only done if something
+     * may have been declared since the last time.
+     *
+     * @return NameIndex
+     */
+    public static function nameIndex(): NameIndex
+    {
+        if (static::$nameIndex === null) {
+            static::$nameIndex = new NameIndex();
+        } elseif (static::$namesChanged) {
+            static::$nameIndex->refresh();
+        }
+        static::$namesChanged = false;
+        return static::$nameIndex;
+    }
+
     /**
      * List all resolvable names.
      *
@@ -459,22 +629,26 @@ class Commands
      */
     public static function listEverything(string $namespace = ''): \Generator
     {
-        $prefix = $namespace === '' ? '' : "$namespace\\";
-        $names = array_merge(
-            static::listConsts(),
-            static::listFuns(),
-            static::listClasses(),
-            static::listGlobals()
-        );
-        if ($prefix === '') {
-            yield from $names;
-            return;
+        yield from static::nameIndex()->listEverything($namespace);
+        if ($namespace === '') {
+            yield from static::listGlobals();
         }
-        foreach ($names as $name) {
-            if (substr($name, 0, strlen($prefix)) === $prefix) {
-                yield substr($name, strlen($prefix));
-            }
+    }
+
+    /**
+     * List the names directly inside a namespace.
+     *
+     * @param string $namespace
+     *
+     * @return array
+     */
+    public static function listNames(string $namespace = ''): array
+    {
+        $names = static::nameIndex()->listNames($namespace);
+        if ($namespace === '') {
+            $names = array_merge($names, static::listGlobals());
         }
+        return $names;
     }
 
     /**
@@ -486,24 +660,63 @@ class Commands
      */
     public static function listNamespaces(string $namespace = ''): array
     {
-        // We'll use this as a set by only using the keys
-        $namespaces = [];
-        foreach (static::listEverything($namespace) as $name) {
-            if (strpos($name, '\\') !== false) {
-                $namespaces[explode('\\', $name)[0]] = null;
+        return static::nameIndex()->listNamespaces($namespace);
+    }
+
+    /**
+     * Try to guess what a name represents.
+     *
+     * Also returns the generation of the name index. It changes whenever
+     * new names are declared, so that cached failures can be discarded.
+     *
+     * @param string $name
+     *
+     * @return array{kind: string, generation: int}
+     */
+    public static function resolveName(string $name): array
+    {
+        $index = static::nameIndex();
+        $kind = $index->kindOf($name);
+        if ($kind === null) {
+            $classes = static::countClasses();
+            $kind = static::probeName($name);
+            if (static::countClasses() !== $classes) {
+                // Probing autoloaded something, which is indexed the next
+                // time the index is used. Most misses don't, and rebuilding
+                // the index for each of them would be slow.
+                static::namesMayHaveChanged();
             }
         }
-        return array_keys($namespaces);
+        return [
+            'kind' => $kind,
+            'generation' => $index->getGeneration()
+        ];
     }
 
     /**
-     * Try to guess what a name represents.
+     * Count the declared classes, interfaces and traits.
+     *
+     * These are what autoloaders declare.
+     *
+     * @return int
+     */
+    private static function countClasses(): int
+    {
+        return count(get_declared_classes()) +
+            count(get_declared_interfaces()) + count(get_declared_traits());
+    }
+
+    /**
+     * Find out what a name represents, without using the index.
+     *
+     * This is needed for names that aren't declared yet but can be
+     * autoloaded, and for names that are written with a different case.
      *
      * @param string $name
      *
      * @return string
      */
-    public static function resolveName(string $name): string
+    private static function probeName(string $name): string
     {
         if (defined($name)) {
             return 'const';
@@ -582,6 +795,83 @@ class Commands
         }
     }
 
+    /**
+     * Call a function on each value of an iterable, keeping the keys.
+     *
+     * @param iterable $iterable
+     * @param callable $callable
+     *
+     * @return \Generator
+     */
+    public static function mapIterable($iterable, callable $callable)
+    {
+        foreach (static::startIteration($iterable) as $key => $value) {
+            yield $key => $callable($value);
+        }
+    }
+
+    /**
+     * Keep the values of an iterable that a function returns true for.
+     *
+     * If $callable is null, the values that are true themselves are kept.
+     *
+     * @param iterable $iterable
+     * @param callable|null $callable
+     *
+     * @return \Generator
+     */
+    public static function filterIterable($iterable, callable $callable = null)
+    {
+        foreach (static::startIteration($iterable) as $key => $value) {
+            if ($callable === null ? $value : $callable($value)) {
+                yield $key => $value;
+            }
+        }
+    }
+
+    /**
+     * Get an item or property of each value of an iterable.
+     *
+     * Arrays and ArrayAccess objects are indexed, other objects have their
+     * property read.
+     *
+     * @param iterable $iterable
+     * @param int|string $name
+     *
+     * @return \Generator
+     */
+    public static function columnIterable($iterable, $name)
+    {
+        foreach (static::startIteration($iterable) as $key => $value) {
+            if (is_array($value) || $value instanceof \ArrayAccess) {
+                yield $key => $value[$name];
+            } else {
+                yield $key => static::getProperty($value, (string)$name);
+            }
+        }
+    }
+
+    /**
+     * Reduce the values of an iterable to a single value.
+     *
+     * @param iterable $iterable
+     * @param callable $callable Called with the result so far and a value
+     * @param mixed $initial
+     *
+     * @return mixed
+     */
+    public static function reduceIterable(
+        $iterable,
+        callable $callable,
+        $initial
+    ) {
+        $carry = $initial;
+        foreach (static::startIteration($iterable) as $value) {
+            $carry = $callable($carry, $value);
+        }
+        return $carry;
+    }
+
     /**
      * Get the next key and value from a generator.
      *
@@ -599,6 +889,234 @@ class Commands
         return $ret;
     }
 
+    /**
+     * Get up to $size keys and values from a generator.
+     *
+     * Returns an array containing the keys, the values, and a bool
+     * indicating whether the generator is finished.
+     *
+     * @param \Generator $generator
+     * @param int $size
+     *
+     * @return array{keys: array, values: array, done: bool}
+     */
+    public static function nextIterationChunk(
+        \Generator $generator,
+        int $size
+    ): array {
+        $keys = [];
+        $values = [];
+        while ($size > 0 && $generator->valid()) {
+            $keys[] = $generator->key();
+            $values[] = $generator->current();
+            $generator->next();
+            $size -= 1;
+        }
+        return [
+            'keys' => $keys,
+            'values' => $values,
+            'done' => !$generator->valid()
+        ];
+    }
+
+    /**
+     * Apply a chain of operations to a value and return the result.
+     *
+     * Each operation is one of ['get', $name] to get a property,
+     * ['call', $name, $args] to call a method, ['invoke', $args] to call the
+     * value itself and ['item', $offset] to get an item.
+     *
+     * @param mixed $value
+     * @param array $ops
+     *
+     * @return mixed
+     */
+    public static function evaluate($value, array $ops)
+    {
+        foreach ($ops as $op) {
+            switch ($op[0]) {
+                case 'get':
+                    $value = static::getProperty($value, $op[1]);
+                    break;
+                case 'call':
+                    $value = static::callMethod($value, $op[1], $op[2]);
+                    break;
+                case 'invoke':
+                    $value = static::callObj($value, $op[1]);
+                    break;
+                case 'item':
+                    $value = static::getItem($value, $op[1]);
+                    break;
+                default:
+                    throw new \Exception("Unknown operation '{$op[0]}'");
+            }
+        }
+        return $value;
+    }
+
+    /**
+     * Get the mode of a stream and whether it's seekable.
+     *
+     * @param resource $stream
+     *
+     * @return array{mode: string, seekable: bool}
+     */
+    public static function streamInfo($stream): array
+    {
+        $meta = stream_get_meta_data(static::stream($stream));
+        return [
+            'mode' => $meta['mode'],
+            'seekable' => $meta['seekable']
+        ];
+    }
+
+    /**
+     * Read up to $length bytes from a stream.
+     *
+     * Only returns fewer bytes at the end of the stream.
+     *
+     * @param resource $stream
+     * @param int $length
+     *
+     * @return string
+     */
+    public static function readStream($stream, int $length): string
+    {
+        $data = stream_get_contents(static::stream($stream), $length);
+        if ($data === false) {
+            throw new \RuntimeException("Can't read from stream");
+        }
+        return $data;
+    }
+
+    /**
+     * Write to a stream and return the number of bytes written.
+     *
+     * @param resource $stream
+     * @param string $data
+     *
+     * @return int
+     */
+    public static function writeStream($stream, string $data): int
+    {
+        $written = fwrite(static::stream($stream), $data);
+        if ($written === false) {
+            throw new \RuntimeException("Can't write to stream");
+        }
+        return $written;
+    }
+
+    /**
+     * Move the position of a stream and return the new position.
+     *
+     * @param resource $stream
+     * @param int $offset
+     * @param int $whence SEEK_SET, SEEK_CUR or SEEK_END
+     *
+     * @return int
+     */
+    public static function seekStream($stream, int $offset, int $whence): int
+    {
+        if (fseek(static::stream($stream), $offset, $whence) === -1) {
+            throw new \RuntimeException("Can't seek in stream");
+        }
+        return static::tellStream($stream);
+    }
+
+    /**
+     * Get the position of a stream.
+     *
+     * @param resource $stream
+     *
+     * @return int
+     */
+    public static function tellStream($stream): int
+    {
+        $position = ftell(static::stream($stream));
+        if ($position === false) {
+            throw new \RuntimeException("Can't get position of stream");
+        }
+        return $position;
+    }
+
+    /**
+     * Truncate a stream to $size bytes.
+     *
+     * @param resource $stream
+     * @param int $size
+     *
+     * @return int
+     */
+    public static function truncateStream($stream, int $size): int
+    {
+        if (!ftruncate(static::stream($stream), $size)) {
+            throw new \RuntimeException("Can't truncate stream");
+        }
+        return $size;
+    }
+
+    /**
+     * Flush the output of a stream.
+     *
+     * @param resource $stream
+     *
+     * @return null
+     */
+    public static function flushStream($stream)
+    {
+        fflush(static::stream($stream));
+        return null;
+    }
+
+    /**
+     * Close a stream.
+     *
+     * @param resource $stream
+     *
+     * @return null
+     */
+    public static function closeStream($stream)
+    {
+        fclose(static::stream($stream));
+        return null;
+    }
+
+    /**
+     * Put a string into a temporary stream.
+     *
+     * The stream is kept in memory up to a few megabytes, and moves to a
+     * temporary file after that.
+     *
+     * @param string $data
+     *
+     * @return resource
+     */
+    public static function stringStream(string $data)
+    {
+        $stream = fopen('php://temp', 'w+b');
+        if ($stream === false) {
+            throw new \RuntimeException("Can't open temporary stream");
+        }
+        fwrite($stream, $data);
+        rewind($stream);
+        return $stream;
+    }
+
+    /**
+     * Make sure a value is an open stream.
+     *
+     * @param mixed $stream
+     *
+     * @return resource
+     */
+    private static function stream($stream)
+    {
+        if (!is_resource($stream) || get_resource_type($stream) !== 'stream') {
+            throw new \TypeError("Not an open stream");
+        }
+        return $stream;
+    }
+
     /**
      * Throw an exception. Used for throwing an error while receiving a command.
      *
@@ -0,0 +1,229 @@
+<?php
+declare(strict_types=1);
+
+namespace blyxxyz\PythonServer;
+
+/**
+ * Keeps track of all declared names, bucketed by namespace
+ *
+ * Classes, functions and constants can't be undeclared, and PHP lists them in
+ * the order they were declared, so only the names at the end of each list
+ * need to be indexed when refreshing.
+ */
+class NameIndex
+{
+    const CONSTANT = 'const';
+    const FUNCTION = 'func';
+    const CLASS_ = 'class';
+
+    /**
+     * The kinds of each name, by namespace and unqualified name.
+     *
+     * @var array<string, array<string, array<string, bool>>>
+     */
+    private $names;
+
+    /**
+     * The direct subnamespaces of each namespace.
+     *
+     * @var array<string, array<string, bool>>
+     */
+    private $namespaces;
+
+    /**
+     * How many entries of each list have been indexed.
+     *
+     * @var array<string, int>
+     */
+    private $seen;
+
+    /**
+     * Incremented every time a refresh finds new names.
+     *
+     * @var int
+     */
+    private $generation;
+
+    public function __construct()
+    {
+        $this->names = [];
+        $this->namespaces = [];
+        $this->seen = [];
+        $this->generation = 0;
+        foreach (get_class_methods(NonFunctionProxy::class) as $name) {
+            $this->add($name, self::FUNCTION);
+        }
+        $this->refresh();
+    }
+
+    /**
+     * Index everything that was declared since the last refresh.
+     *
+     * @return void
+     */
+    public function refresh()
+    {
+        $functions = get_defined_functions();
+        $added = $this->addNew('classes', get_declared_classes(), self::CLASS_)
+            + $this->addNew(
+                'interfaces',
+                get_declared_interfaces(),
+                self::CLASS_
+            )
+            + $this->addNew('traits', get_declared_traits(), self::CLASS_)
+            + $this->addNew(
+                'internal',
+                $functions['internal'],
+                self::FUNCTION
+            )
+            + $this->addNew('user', $functions['user'], self::FUNCTION)
+            + $this->addNew(
+                'constants',
+                array_keys(get_defined_constants()),
+                self::CONSTANT
+            );
+        if ($added > 0) {
+            $this->generation += 1;
+        }
+    }
+
+    /**
+     * Get a number that changes whenever new names are found.
+     *
+     * @return int
+     */
+    public function getGeneration(): int
+    {
+        return $this->generation;
+    }
+
+    /**
+     * Index the entries of a list that haven't been seen before.
+     *
+     * @param string $list
+     * @param array<int, string> $names
+     * @param string $kind
+     *
+     * @return int The number of new entries
+     */
+    private function addNew(string $list, array $names, string $kind): int
+    {
+        $seen = $this->seen[$list] ?? 0;
+        $count = count($names);
+        for ($i = $seen; $i < $count; $i++) {
+            $this->add($names[$i], $kind);
+        }
+        $this->seen[$list] = $count;
+        return $count - $seen;
+    }
+
+    /**
+     * Add a single name to the index.
+     *
+     * @param string $name
+     * @param string $kind
+     *
+     * @return void
+     */
+    private function add(string $name, string $kind)
+    {
+        list($namespace, $base) = static::split($name);
+        $this->names[$namespace][$base][$kind] = true;
+        while ($namespace !== '') {
+            list($parent, $child) = static::split($namespace);
+            if (isset($this->namespaces[$parent][$child])) {
+                break;
+            }
+            $this->namespaces[$parent][$child] = true;
+            $namespace = $parent;
+        }
+    }
+
+    /**
+     * Split a name into its namespace and its unqualified name.
+     *
+     * @param string $name
+     *
+     * @return array{0: string, 1: string}
+     */
+    private static function split(string $name): array
+    {
+        $pos = strrpos($name, '\\');
+        if ($pos === false) {
+            return ['', $name];
+        }
+        return [substr($name, 0, $pos), substr($name, $pos + 1)];
+    }
+
+    /**
+     * Look up what kind of thing a name is.
+     *
+     * Constants take precedence over functions, and functions over classes.
+     * The lookup is case-sensitive, so a name that isn't found may still
+     * exist.
+     *
+     * @param string $name
+     *
+     * @return string|null
+     */
+    public function kindOf(string $name)
+    {
+        list($namespace, $base) = static::split(ltrim($name, '\\'));
+        $kinds = $this->names[$namespace][$base] ?? [];
+        foreach ([self::CONSTANT, self::FUNCTION, self::CLASS_] as $kind) {
+            if (isset($kinds[$kind])) {
+                return $kind;
+            }
+        }
+        return null;
+    }
+
+    /**
+     * List the names directly inside a namespace.
+     *
+     * @param string $namespace
+     *
+     * @return array<string>
+     */
+    public function listNames(string $namespace): array
+    {
+        return array_map(
+            'strval',
+            array_keys($this->names[$namespace] ?? [])
+        );
+    }
+
+    /**
+     * List the direct subnamespaces of a namespace.
+     *
+     * @param string $namespace
+     *
+     * @return array<string>
+     */
+    public function listNamespaces(string $namespace): array
+    {
+        return array_map(
+            'strval',
+            array_keys($this->namespaces[$namespace] ?? [])
+        );
+    }
+
+    /**
+     * List all names inside a namespace, relative to it.
+     *
+     * @param string $namespace
+     *
+     * @return \Generator
+     */
+    public function listEverything(string $namespace): \Generator
+    {
+        yield from $this->listNames($namespace);
+        foreach ($this->listNamespaces($namespace) as $child) {
+            $childNamespace = $namespace === ''
+                ? $child : "$namespace\\$child";
+            foreach ($this->listEverything($childNamespace) as $name) {
+                yield "$child\\$name";
+            }
+        }
+    }
+}
@@ -5,64 +5,191 @@ namespace blyxxyz\PythonServer;
 
 /**
  * Stores objects and resources so they can be serialized
+ *
+ * Objects get small integer keys that are never reused. The class of an
+ * object is only sent along the first time its key is used, and each class
+ * name is only sent once, after which it's referred to by its position in
+ * the list of class names that were sent. Resources get their negated
+ * resource ID as their key.
+ *
+ * Clients that have many commands in flight can say which responses they've
+ * processed when they release keys. A key that was sent in a later response
+ * is kept, because the client will make a new proxy for it.
  */
 class ObjectStore
 {
-    /** @var array<string, object> */
+    /** @var array<int, object> */
     private $objects;
 
+    /**
+     * The keys of stored objects, by spl_object_hash.
+     *
+     * @var array<string, int>
+     */
+    private $keys;
+
     /** @var array<int, resource> */
     private $resources;
 
+    /** @var int */
+    private $nextKey;
+
+    /**
+     * The ID of the last command whose response used each key.
+     *
+     * @var array<int, int>
+     */
+    private $lastUse;
+
+    /**
+     * The ID of the command that's being executed.
+     *
+     * @var int
+     */
+    private $epoch;
+
+    /**
+     * The positions of class names that were announced, by name.
+     *
+     * @var array<string, int>
+     */
+    private $classIds;
+
+    /**
+     * Class names that still have to be announced.
+     *
+     * @var array<int, string>
+     */
+    private $newClasses;
+
+    /**
+     * Keys and class IDs of objects that still have to be announced.
+     *
+     * @var array<int, array{0: int, 1: int}>
+     */
+    private $newKeys;
+
     public function __construct()
     {
         $this->objects = [];
+        $this->keys = [];
         $this->resources = [];
+        $this->nextKey = 1;
+        $this->lastUse = [];
+        $this->epoch = 0;
+        $this->classIds = [];
+        $this->newClasses = [];
+        $this->newKeys = [];
     }
 
     /**
      * @param object|resource $object
      *
-     * @return string|int
+     * @return int
      */
-    public function encode($object)
+    public function encode($object): int
     {
         if (is_resource($object)) {
             // This uses an implementation detail, but it's the best we have
-            $key = intval($object);
+            $key = -intval($object);
             $this->resources[$key] = $object;
-        } else {
-            $key = spl_object_hash($object);
-            $this->objects[$key] = $object;
+            $this->lastUse[$key] = $this->epoch;
+            return $key;
+        }
+        $hash = spl_object_hash($object);
+        if (isset($this->keys[$hash])) {
+            $key = $this->keys[$hash];
+            $this->lastUse[$key] = $this->epoch;
+            return $key;
         }
+        $key = $this->nextKey++;
+        $this->lastUse[$key] = $this->epoch;
+        $this->objects[$key] = $object;
+        $this->keys[$hash] = $key;
+        $class = get_class($object);
+        if (!isset($this->classIds[$class])) {
+            $this->classIds[$class] = count($this->classIds);
+            $this->newClasses[] = $class;
+        }
+        $this->newKeys[] = [$key, $this->classIds[$class]];
         return $key;
     }
 
     /**
-     * @param string|int $key
+     * @param int $key
      *
      * @return object|resource
      */
-    public function decode($key)
+    public function decode(int $key)
     {
-        if (is_int($key)) {
+        if ($key < 0) {
+            if (!isset($this->resources[$key])) {
+                $id = -$key;
+                throw new \Exception("Resource id #$id was released");
+            }
             return $this->resources[$key];
-        } else {
-            return $this->objects[$key];
         }
+        if (!isset($this->objects[$key])) {
+            throw new \Exception("Object #$key was released");
+        }
+        return $this->objects[$key];
     }
 
     /**
-     * @param string|int $key
+     * Set the ID of the command that's being executed.
+     *
+     * @param int $epoch
      *
      * @return void
      */
-    public function remove($key)
+    public function setEpoch(int $epoch)
+    {
+        $this->epoch = $epoch;
+    }
+
+    /**
+     * Remove an object or resource.
+     *
+     * If $seen is given, it's the ID of the last command whose response the
+     * client has processed, along with the responses before it. Keys that
+     * were used in the response to a later command are kept.
+     *
+     * @param int $key
+     * @param int|null $seen
+     *
+     * @return bool Whether the key is gone
+     */
+    public function remove(int $key, int $seen = null): bool
     {
-        if (is_int($key)) {
+        if ($seen !== null && ($this->lastUse[$key] ?? $seen) > $seen) {
+            return false;
+        }
+        unset($this->lastUse[$key]);
+        if ($key < 0) {
             unset($this->resources[$key]);
-        } else {
+        } elseif (isset($this->objects[$key])) {
+            unset($this->keys[spl_object_hash($this->objects[$key])]);
             unset($this->objects[$key]);
         }
+        return true;
+    }
+
+    /**
+     * Get the classes and keys that were added since the last call.
+     *
+     * 'classes' is a list of new class names, in order. 'keys' is a list
+     * of [key, class ID] pairs.
+     *
+     * @return array{classes: array<int, string>, keys: array}
+     */
+    public function takeAnnouncements(): array
+    {
+        $announcements = [
+            'classes' => $this->newClasses,
+            'keys' => $this->newKeys
+        ];
+        $this->newClasses = [];
+        $this->newKeys = [];
+        return $announcements;
     }
 }
@@ -28,34 +28,41 @@ class StdioCommandServer extends CommandServer
 
     public function receive(): array
     {
-        $line = fgets($this->in);
-        if ($line === false) {
-            throw new ConnectionLostException("Can't read from input");
-        }
-        $result = json_decode($line, true);
-        if (!is_array($result)) {
+        try {
+            return $this->codec->read($this->in);
+        } catch (ConnectionLostException $exception) {
+            throw $exception;
+        } catch (\Exception $exception) {
             return [
                 'cmd' => 'throwException',
                 'data' => [
                     'class' => \RuntimeException::class,
-                    'message' => "Error decoding JSON: " . json_last_error_msg()
-                ]
+                    'message' => $exception->getMessage()
+                ],
+                'garbage' => []
             ];
         }
-        return $result;
     }
 
     public function send(array $data)
     {
-        $encoded = json_encode($data, JSON_PRESERVE_ZERO_FRACTION);
-        if ($encoded === false) {
-            $encoded = json_encode($this->encodeThrownException(
-                new \RuntimeException(json_last_error_msg()),
+        try {
+            $encoded = $this->codec->encodeMessage($data);
+        } catch (\Exception $exception) {
+            $response = $this->encodeThrownException(
+                new \RuntimeException($exception->getMessage()),
                 $data['collected']
-            ));
+            );
+            // Objects that were announced in the original response are
+            // still announced, even though they're not sent
+            foreach (['id', 'push', 'classes', 'keys'] as $field) {
+                if (array_key_exists($field, $data)) {
+                    $response[$field] = $data[$field];
+                }
+            }
+            $encoded = $this->codec->encodeMessage($this->announce($response));
         }
         fwrite($this->out, $encoded);
-        fwrite($this->out, "\n");
     }
 
     /**
@@ -0,0 +1,217 @@
+"""Spreading work over several PHP processes.
+
+A bridge talks to a single PHP process, and PHP runs one command at a time,
+so a single bridge can only keep one core busy. A pool starts several
+processes and runs function calls on whichever one is idle.
+
+Objects and resources live in the process that created them. Their proxies
+belong to that process's bridge, so methods on them keep running there, and
+calls that get them as arguments are sent there too.
+"""
+
+import os
+import queue
+import threading
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import (Any, Callable, Iterable, Iterator, List,  # noqa: F401
+                    Optional)
+
+from phpbridge import (PHPBridge, metacache, modules, objects,
+                       php_server_path, start_process)
+
+MYPY = False
+if MYPY:
+    from phpbridge.forkserver import ForkServer  # noqa: F401
+
+
+class PoolWorker(PHPBridge):
+    """A bridge that can be used from several threads, one at a time."""
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # Reentrant, because decoding a response can send more commands
+        self.lock = threading.RLock()
+
+    def send_command(self, cmd: str, data: Any = None,
+                     decode: bool = False) -> Any:
+        with self.lock:
+            return super().send_command(cmd, data, decode)
+
+
+class PHPBridgePool:
+    """A number of PHP processes that take turns running function calls.
+
+    All processes run the same server, so the reflection data of classes
+    and functions is shared between them, and each class or function is
+    only reflected on once.
+
+    Each worker's namespaces can be imported as phpbridge.<name><index>.
+    If forkserver is given, the workers are forked from it instead of
+    started from scratch, and fname is ignored.
+    """
+    # The number of chunks per worker that map and starmap send ahead
+    chunks_ahead = 2
+
+    def __init__(self, size: Optional[int] = None,
+                 fname: str = php_server_path,
+                 name: str = 'php_pool',
+                 codecs: Iterable[str] = ('json',),
+                 forkserver: 'Optional[ForkServer]' = None) -> None:
+        if size is None:
+            size = os.cpu_count() or 1
+        if size < 1:
+            raise ValueError("A pool needs at least one worker")
+        self.metadata = metacache.SharedCache()
+        self.workers = []       # type: List[PoolWorker]
+        self._idle = queue.Queue()  # type: queue.Queue
+        self._executor = None   # type: Optional[ThreadPoolExecutor]
+        for index in range(size):
+            worker_name = '{}{}'.format(name, index)
+            if forkserver is not None:
+                worker = forkserver.start(worker_name, codecs, PoolWorker)
+            else:
+                worker = start_process(fname, worker_name, codecs,
+                                       PoolWorker)
+            worker.metadata_cache = self.metadata
+            modules.NamespaceFinder(worker, worker_name).register()
+            self.workers.append(worker)  # type: ignore
+            self._idle.put(worker)
+
+    def call(self, name: str, *args: Any, **kwargs: Any) -> Any:
+        """Call a PHP function on one of the workers.
+
+        If an argument is an object or resource, the call runs on the worker
+        it belongs to. Otherwise it runs on the first worker that's idle.
+        """
+        owner = self._owner(list(args) + list(kwargs.values()))
+        if owner is not None:
+            return owner.get_function(name)(*args, **kwargs)
+        worker = self._idle.get()
+        try:
+            return worker.get_function(name)(*args, **kwargs)
+        finally:
+            self._idle.put(worker)
+
+    def map(self, name: str, *iterables: Iterable[Any],
+            chunksize: int = 1,
+            return_exceptions: bool = True) -> Iterator[Any]:
+        """Call a PHP function for each item, using all workers at once.
+
+        This works like the built-in map. Results are yielded in order.
+        See starmap.
+        """
+        return self.starmap(name, zip(*iterables), chunksize,
+                            return_exceptions)
+
+    def starmap(self, name: str, iterable: Iterable[Iterable[Any]],
+                chunksize: int = 1,
+                return_exceptions: bool = True) -> Iterator[Any]:
+        """Call a PHP function for each tuple of arguments, on all workers.
+
+        The calls are handed to the workers in chunks of chunksize, and each
+        chunk is sent in a single command. Results are yielded in order.
+        Only a few chunks per worker are taken from iterable ahead of the
+        results that were yielded.
+
+        If a call throws an exception, it's yielded in place of the result,
+        unless return_exceptions is False.
+        """
+        if chunksize < 1:
+            raise ValueError("chunksize must be at least 1")
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(len(self.workers))
+        iterator = iter(iterable)
+        chunks = iter(lambda: list(islice(iterator, chunksize)), [])
+        return self._run_chunks(
+            partial(self._call_chunk, name,
+                    return_exceptions=return_exceptions),
+            chunks)
+
+    def _run_chunks(self, call: Callable[[List[Iterable[Any]]], List[Any]],
+                    chunks: Iterator[List[Iterable[Any]]]) -> Iterator[Any]:
+        executor = self._executor
+        assert executor is not None
+        window = deque(executor.submit(call, chunk) for chunk in islice(
+            chunks, self.chunks_ahead * len(self.workers)))
+        try:
+            while window:
+                results = window.popleft().result()
+                for chunk in islice(chunks, 1):
+                    window.append(executor.submit(call, chunk))
+                yield from results
+        finally:
+            for future in window:
+                future.cancel()
+
+    def _call_chunk(self, name: str, chunk: List[Iterable[Any]],
+                    return_exceptions: bool) -> List[Any]:
+        owners = {self._owner(list(args)) for args in chunk}
+        if len(owners) > 1:
+            # The calls have to be split up between the workers
+            results = []
+            for args in chunk:
+                try:
+                    results.append(self.call(name, *args))
+                except Exception as exception:
+                    if not return_exceptions:
+                        raise
+                    results.append(exception)
+            return results
+        owner = owners.pop()
+        if owner is not None:
+            return list(owner.starmap(name, chunk, len(chunk),
+                                      return_exceptions))
+        worker = self._idle.get()
+        try:
+            return list(worker.starmap(name, chunk, len(chunk),
+                                       return_exceptions))
+        finally:
+            self._idle.put(worker)
+
+    def _owner(self, values: List[Any]) -> Optional[PoolWorker]:
+        """Find the worker that the objects among some values belong to."""
+        owner = None            # type: Optional[PoolWorker]
+        while values:
+            value = values.pop()
+            if isinstance(value, (objects.PHPObject, objects.PHPResource)):
+                if owner is not None and value._bridge is not owner:
+                    raise ValueError("Arguments belong to different workers")
+                owner = value._bridge  # type: ignore
+            elif isinstance(value, dict):
+                values.extend(value.values())
+            elif isinstance(value, (list, tuple)):
+                values.extend(value)
+        return owner
+
+    def enable_metadata_cache(self, path: Optional[str] = None,
+                              project: Optional[str] = None) -> None:
+        """Also store the shared reflection data on disk.
+
+        path and project are used like PHPBridge.enable_metadata_cache.
+        """
+        if path is None:
+            path = metacache.default_path()
+        worker = self.workers[0]
+        if project is None:
+            project = worker.send_command(
+                'callFun', {'name': 'getcwd', 'args': []}, decode=True) or ''
+        self.metadata.backing = metacache.MetadataCache(
+            path, worker.get_const('PHP_VERSION'), worker.codec.name,
+            project)
+
+    def close(self) -> None:
+        """Stop all workers."""
+        if self._executor is not None:
+            self._executor.shutdown()
+        for worker in self.workers:
+            # PHP exits when its input is closed
+            worker.input.close()
+
+    def __enter__(self) -> 'PHPBridgePool':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
@@ -0,0 +1,402 @@
+"""Reflection data generated ahead of time.
+
+Importing a PHP namespace resolves every name when it's first used, and
+reflects on every class and function before it can be built. For a large
+API that's many round trips before anything useful happens.
+
+generate() reflects on whole namespaces once and writes the results as
+Python modules in a package. A bridge that uses that package with
+use_prebuilt() builds classes and functions from it without asking PHP. An
+entry is only used if the files that define it haven't changed since it was
+generated, so an outdated package falls back to asking PHP.
+
+generate() also writes .pyi stubs with the signatures and class hierarchies,
+as a partial stub package for type checkers and editors.
+
+Only names that are declared when generate() runs are included, so classes
+that haven't been autoloaded yet are left out.
+
+Run python -m phpbridge.prebuilt --help to generate from the command line.
+"""
+
+import argparse
+import collections.abc
+import copy
+import importlib
+import inspect
+import json
+import os
+import re
+
+from inspect import Parameter
+from typing import (Any, Callable, Dict, Iterable, List,  # noqa: F401
+                    Optional, Union)
+
+from phpbridge import docblocks, metacache, modules, objects
+
+MYPY = False
+if MYPY:
+    from phpbridge import PHPBridge  # noqa: F401
+
+# Increase this whenever the format of the generated modules changes
+FORMAT_VERSION = 1
+
+# The kinds of names that are generated, and the reflection command for each
+_commands = {'class': 'classInfo', 'func': 'funcInfo'}
+
+
+class Prebuilt:
+    """Look up names and reflection data in a generated package."""
+    def __init__(self, bridge: 'PHPBridge', package: str) -> None:
+        self.bridge = bridge
+        self.package = package
+        self._modules = {}      # type: Dict[str, Any]
+
+    def _module(self, namespace: str) -> Any:
+        if namespace not in self._modules:
+            name = self.package
+            if namespace:
+                name += '.' + namespace.replace('\\', '.')
+            try:
+                module = importlib.import_module(name)
+            except ImportError:
+                module = None
+            if (getattr(module, 'FORMAT_VERSION', None) != FORMAT_VERSION or
+                    module.PHP_VERSION != self.bridge.get_const(
+                        'PHP_VERSION')):
+                module = None
+            self._modules[namespace] = module
+        return self._modules[namespace]
+
+    def kind(self, name: str) -> Optional[str]:
+        """Get the kind of a name, if it was generated and is still valid."""
+        namespace, _, basename = name.lstrip('\\').rpartition('\\')
+        module = self._module(namespace)
+        if module is None:
+            return None
+        kind = module.NAMES.get(basename.lower())
+        if kind is None or self.info(_commands[kind], name) is None:
+            return None
+        return kind             # type: ignore
+
+    def info(self, kind: str, name: str) -> Optional[Dict[str, Any]]:
+        """Get the classInfo or funcInfo of a name, if it's still valid."""
+        name = name.lstrip('\\')
+        module = self._module(name.rpartition('\\')[0])
+        if module is None:
+            return None
+        info = module.INFO.get(kind, {}).get(name.lower())
+        if info is None or not metacache.is_fresh(info['files']):
+            return None
+        info = copy.deepcopy(info)
+        # Default values are stored as plain values, but the bridge expects
+        # them to be encoded by its codec
+        for func_info in _func_infos(kind, info):
+            for param in func_info['params']:
+                param['default'] = self.bridge.encode(param['default'])
+        return info             # type: ignore
+
+
+def _func_infos(kind: str, info: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if kind == 'funcInfo':
+        return [info]
+    return list((info['methods'] or {}).values())
+
+
+def generate(bridge: 'PHPBridge', namespaces: Iterable[str], path: str,
+             package: str = 'phpbridge_prebuilt') -> None:
+    """Reflect on the names in namespaces and write them to a package.
+
+    The package is created in the directory path. Sub-namespaces are
+    included. The stubs are written to path/phpbridge-stubs.
+    """
+    found = {}                  # type: Dict[str, Dict[str, str]]
+    for namespace in namespaces:
+        namespace = namespace.strip('\\')
+        found.setdefault(namespace, {})
+        for relative in bridge.send_command('listEverything', namespace):
+            name = namespace + '\\' + relative if namespace else relative
+            kind = bridge.send_command('resolveName', name)['kind']
+            if kind in _commands:
+                parent, _, basename = name.rpartition('\\')
+                found.setdefault(parent, {})[basename] = kind
+
+    for namespace, names in found.items():
+        infos = {}              # type: Dict[str, Dict[str, Any]]
+        kept = {}               # type: Dict[str, str]
+        for basename, kind in sorted(names.items()):
+            name = namespace + '\\' + basename if namespace else basename
+            command = _commands[kind]
+            info = bridge.send_command(command, name)
+            if info['files'] == []:
+                # PHP turns empty associative arrays into empty lists
+                info['files'] = {}
+            if any(mtime is None for mtime in info['files'].values()):
+                # Not defined in a real file, so it can't be validated
+                continue
+            _plain_defaults(bridge, command, info)
+            try:
+                json.dumps(info)
+            except (TypeError, ValueError):
+                # Something like an object in a constant
+                continue
+            # PHP names are case insensitive
+            infos.setdefault(command, {})[name.lower()] = info
+            kept[basename.lower()] = kind
+        _write_module(path, package, namespace, kept, infos,
+                      bridge.get_const('PHP_VERSION'))
+        _write_stub(bridge, path, namespace, names)
+
+
+def _plain_defaults(bridge: 'PHPBridge', kind: str,
+                    info: Dict[str, Any]) -> None:
+    """Decode the default values in an info, so they don't need a codec."""
+    for func_info in _func_infos(kind, info):
+        for param in func_info['params']:
+            if not param['hasDefault']:
+                continue
+            try:
+                param['default'] = _plain(bridge.decode(param['default']))
+            except TypeError:
+                # An object, which can't be stored
+                param['hasDefault'] = False
+                param['default'] = None
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, dict):
+        if getattr(value, 'listable', lambda: False)():
+            return [_plain(item) for item in value.values()]
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    raise TypeError("Can't store {!r}".format(value))
+
+
+def _make_package(parts: List[str], start: int, init: str,
+                  content: str) -> str:
+    """Create a directory, with an init file in each level from start."""
+    directory = os.path.join(*parts)
+    os.makedirs(directory, exist_ok=True)
+    for depth in range(start, len(parts) + 1):
+        filename = os.path.join(*(parts[:depth] + [init]))
+        if not os.path.exists(filename):
+            with open(filename, 'w') as f:
+                f.write(content)
+    return directory
+
+
+def _namespace_parts(namespace: str) -> List[str]:
+    return namespace.split('\\') if namespace else []
+
+
+def _write_module(path: str, package: str, namespace: str,
+                  names: Dict[str, str],
+                  infos: Dict[str, Dict[str, Any]],
+                  php_version: str) -> None:
+    # Every level has to be importable, but the levels of package itself
+    # might belong to something else
+    parts = [path] + package.split('.')
+    directory = _make_package(parts + _namespace_parts(namespace),
+                              len(parts), '__init__.py',
+                              '"""Generated by phpbridge.prebuilt."""\n')
+    with open(os.path.join(directory, '__init__.py'), 'w') as f:
+        f.write(_module_template.format(
+            namespace=namespace or '(global)',
+            version=FORMAT_VERSION,
+            php_version=php_version,
+            names=json.dumps(names, sort_keys=True),
+            infos=json.dumps(infos, sort_keys=True)))
+
+
+_module_template = '''\
+"""Reflection data for the PHP namespace {namespace}.
+
+Generated by phpbridge.prebuilt. Generate it again instead of editing it.
+"""
+
+import json
+
+FORMAT_VERSION = {version}
+
+PHP_VERSION = {php_version!r}
+
+NAMES = json.loads({names!r})
+
+INFO = json.loads({infos!r})
+'''
+
+
+_stub_header = """\
+# Generated by phpbridge.prebuilt.
+
+import typing
+"""
+
+# Names that weren't declared when the stubs were generated, and
+# sub-namespaces, can still be imported
+_stub_fallback = """
+
+def __getattr__(name: str) -> typing.Any: ...
+"""
+
+# Attributes that create_class adds to every class
+_internal = {'_bridge', '_name', '_is_abstract', '_is_interface', '_is_trait'}
+
+
+class _Source:
+    """Something that's shown as a piece of source code in a signature."""
+    def __init__(self, source: str) -> None:
+        self.source = source
+
+    def __repr__(self) -> str:
+        return self.source
+
+
+def _write_stub(bridge: 'PHPBridge', path: str, namespace: str,
+                names: Dict[str, str]) -> None:
+    # The finder's prefix starts with phpbridge, which is the package the
+    # stubs are for. Its own files are left alone, so they're still found.
+    parts = [path, 'phpbridge-stubs'] + modules.bridges[bridge].split('.')[1:]
+    directory = _make_package(parts + _namespace_parts(namespace),
+                              len(parts), '__init__.pyi',
+                              _stub_header + _stub_fallback)
+    with open(os.path.join(path, 'phpbridge-stubs', 'py.typed'), 'w') as f:
+        f.write('partial\n')
+    lines = []                  # type: List[str]
+    for basename, kind in sorted(names.items()):
+        name = namespace + '\\' + basename if namespace else basename
+        if kind == 'class':
+            lines += _class_stub(bridge, bridge.get_class(name))
+        else:
+            lines += _function_stub(bridge, basename,
+                                    bridge.get_function(name))
+    body = '\n'.join(lines)
+    imported = [
+        match.group(1) for match in re.finditer(r'\b(\w+(?:\.\w+)*)\.\w+\b',
+                                                body)]
+    imported.append('typing')
+    header = [_stub_header.splitlines()[0], '']
+    header += ['import {}'.format(module) for module in sorted(set(imported))]
+    with open(os.path.join(directory, '__init__.pyi'), 'w') as f:
+        f.write('\n'.join(header + ['', ''] + lines) + '\n' + _stub_fallback)
+
+
+def _class_stub(bridge: 'PHPBridge', cls: objects.PHPClass) -> List[str]:
+    bases = ', '.join(_annotation(base) for base in cls.__bases__)
+    lines = ['class {}({}):'.format(modules.basename(cls._name), bases)]
+    for name, value in sorted(vars(cls).items()):
+        if name in _internal or (name.startswith('__') and
+                                 name != '__new__'):
+            continue
+        if isinstance(value, property):
+            lines.append('    {}: typing.Any'.format(name))
+        elif isinstance(value, classmethod):
+            lines.append('    @classmethod')
+            lines += _function_stub(bridge, name, value.__func__, 'cls',
+                                    indent='    ')
+        elif isinstance(value, staticmethod):
+            # The constructor
+            lines += _function_stub(bridge, '__init__', value.__func__,
+                                    'self', indent='    ', returns='None')
+        elif callable(value) and hasattr(value, '_info'):
+            lines += _function_stub(bridge, name, value, indent='    ')
+        elif not callable(value):
+            lines.append('    {}: {}'.format(name, _annotation(type(value))))
+    if len(lines) == 1:
+        lines.append('    ...')
+    return lines + ['', '']
+
+
+def _function_stub(bridge: 'PHPBridge', name: str, func: Any,
+                   first: Optional[str] = None, indent: str = '',
+                   returns: Optional[str] = None) -> List[str]:
+    signature = inspect.signature(func)
+    doc = func._info['doc']
+    doc_params, doc_return = ({}, '') if not isinstance(doc, str) else (
+        _docblock_types(bridge, doc))
+    parameters = []
+    for index, param in enumerate(signature.parameters.values()):
+        annotation = param.annotation
+        if annotation is Parameter.empty:
+            annotation = doc_params.get(param.name, Parameter.empty)
+        param = param.replace(
+            annotation=(Parameter.empty if annotation is Parameter.empty else
+                        _Source(_annotation(annotation))),
+            default=(Parameter.empty if param.default is Parameter.empty else
+                     _Source('...')))
+        if index == 0 and first is not None:
+            param = param.replace(name=first, annotation=Parameter.empty)
+        parameters.append(param)
+    annotation = signature.return_annotation
+    if annotation is inspect.Signature.empty and doc_return != '':
+        annotation = doc_return
+    if returns is not None:
+        annotation = _Source(returns)
+    elif annotation is not inspect.Signature.empty:
+        annotation = _Source(_annotation(annotation))
+    rendered = signature.replace(parameters=parameters,
+                                 return_annotation=annotation)
+    return ['{}def {}{}: ...'.format(indent, name, rendered)]
+
+
+def _docblock_types(bridge: 'PHPBridge', doc: str) -> Any:
+    try:
+        return docblocks.get_signature(bridge, doc)
+    except Exception:
+        # Something like bool|false, which typing can't represent, or a
+        # namespaced class that doesn't exist
+        return {}, ''
+
+
+def _annotation(annotation: Any) -> str:
+    """Turn an annotation into source code for a stub."""
+    if annotation is None or annotation is type(None):
+        return 'None'
+    if (annotation is Any or isinstance(annotation, (bool, str)) or
+            type(annotation).__name__ in {'ForwardRef', '_ForwardRef'}):
+        # true, false, self, static, a type spec that couldn't be parsed, or
+        # a missing class
+        return 'typing.Any'
+    origin = getattr(annotation, '__origin__', None)
+    if origin is Union:
+        args = [_annotation(arg) for arg in annotation.__args__]
+        if 'typing.Any' in args:
+            return 'typing.Any'
+        if len(args) == 2 and 'None' in args:
+            args.remove('None')
+            return 'typing.Optional[{}]'.format(args[0])
+        return 'typing.Union[{}]'.format(', '.join(args))
+    if origin in (dict, Dict):
+        return 'typing.Dict[{}]'.format(
+            ', '.join(_annotation(arg) for arg in annotation.__args__))
+    if annotation is Callable or origin is collections.abc.Callable:
+        return 'typing.Callable'
+    if origin is not None or not isinstance(annotation, type):
+        return 'typing.Any'
+    return inspect.formatannotation(annotation)
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog='python -m phpbridge.prebuilt',
+        description="Generate reflection data for PHP namespaces.")
+    parser.add_argument('path', help="the directory to write to")
+    parser.add_argument('namespaces', nargs='+', metavar='namespace')
+    parser.add_argument('--package', default='phpbridge_prebuilt',
+                        help="the name of the generated package")
+    parser.add_argument('--bootstrap', action='append', default=[],
+                        help="a PHP file to require first, like "
+                        "vendor/autoload.php")
+    options = parser.parse_args(args)
+
+    # The default bridge, so the stubs describe phpbridge.php
+    from phpbridge import php
+    bridge = php._bridge
+    for bootstrap in options.bootstrap:
+        bridge.resolve('', 'require')(bootstrap)
+    generate(bridge, options.namespaces, options.path, options.package)
+
+
+if __name__ == '__main__':
+    main()
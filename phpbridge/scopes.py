@@ -0,0 +1,55 @@
+"""Releasing many remote objects at once."""
+
+from typing import Any, Optional, Set  # noqa: F401
+
+from phpbridge import objects
+
+MYPY = False
+if MYPY:
+    from phpbridge import PHPBridge  # noqa: F401
+
+
+class Scope:
+    """A context manager that releases the objects created inside it.
+
+    Normally PHP keeps an object around until its proxy is garbage
+    collected, and is only told about that along with the next command.
+    Every object and resource that gets a proxy inside a scope is released
+    when the block exits, in a single message that's sent right away.
+
+    Proxies of released objects can't be used anymore. Use keep() to let one
+    outlive the scope.
+    """
+    def __init__(self, bridge: 'PHPBridge') -> None:
+        self.bridge = bridge
+        self.keys = set()       # type: Set[int]
+        self._outer = None      # type: Optional[Scope]
+
+    def keep(self, entity: Any) -> Any:
+        """Don't release an object or resource when the scope exits.
+
+        If the scope is nested, it's released by the scope around it
+        instead. Returns the entity.
+        """
+        if isinstance(entity, objects.PHPObject):
+            key = entity._hash  # type: ignore
+        elif isinstance(entity, objects.PHPResource):
+            key = -entity._id
+        else:
+            raise TypeError("Can't keep {!r}".format(entity))
+        self.keys.discard(key)
+        if self._outer is not None:
+            self._outer.keys.add(key)
+        return entity
+
+    def __enter__(self) -> 'Scope':
+        self._outer = self.bridge._scope
+        self.bridge._scope = self
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any,
+                 traceback: Any) -> None:
+        self.bridge._scope = self._outer
+        keys, self.keys = self.keys, set()
+        self.bridge.release(keys)
+        self.bridge.flush_garbage()
@@ -0,0 +1,151 @@
+"""Reading and writing PHP streams as Python files."""
+
+import io
+
+from typing import Any, List, Optional, Union, cast  # noqa: F401
+
+MYPY = False
+if MYPY:
+    from phpbridge import objects  # noqa: F401
+
+# The default buffer size for files that wrap a stream. Every read or write
+# of the underlying stream is a round trip, so it's a lot bigger than usual.
+default_buffer_size = 1 << 20
+
+
+class PHPStream(io.RawIOBase):
+    """A PHP stream resource as an unbuffered binary file.
+
+    Each call is a single command. Use open_stream() to get a buffered file
+    that moves the data in large chunks. A single call moves at most
+    max_chunk_size bytes, so that no message gets too big.
+    """
+    max_chunk_size = 16 << 20
+
+    def __init__(self, resource: 'objects.PHPResource',
+                 closefd: bool = True) -> None:
+        if resource._type != 'stream':
+            raise TypeError("{!r} is not a stream".format(resource))
+        bridge = resource._bridge
+        if bridge.asynchronous:
+            raise TypeError("Streams can't be used with an asynchronous "
+                            "bridge")
+        super().__init__()
+        self.resource = resource
+        self.closefd = closefd
+        self._bridge = bridge
+        info = bridge.send_command('streamInfo', bridge.encode(resource),
+                                   decode=True)
+        self.mode = info['mode']  # type: str
+        self._seekable = info['seekable']  # type: bool
+
+    def __repr__(self) -> str:
+        return "<{} {!r} mode={!r}>".format(
+            type(self).__name__, self.resource, self.mode)
+
+    def _command(self, cmd: str, **data: Any) -> Any:
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        data['stream'] = self._bridge.encode(self.resource)
+        return self._bridge.send_command(cmd, data, decode=True)
+
+    def readable(self) -> bool:
+        return 'r' in self.mode or '+' in self.mode
+
+    def writable(self) -> bool:
+        return any(char in self.mode for char in 'waxc+')
+
+    def seekable(self) -> bool:
+        return self._seekable
+
+    def readinto(self, buffer: Any) -> int:
+        view = memoryview(buffer).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return self.readall()
+        length = min(size, self.max_chunk_size)
+        data = self._command('readStream', length=length)  # type: str
+        # PHP strings are bytes, but they're decoded like all strings
+        return data.encode(errors='surrogateescape')
+
+    def readall(self) -> bytes:
+        chunks = []  # type: List[bytes]
+        while True:
+            chunk = self.read(self.max_chunk_size)
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    def write(self, data: Any) -> int:
+        data = bytes(memoryview(data).cast('B')[:self.max_chunk_size])
+        written = self._command('writeStream',
+                                data=self._bridge.encode(data))  # type: int
+        return written
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        position = self._command('seekStream', offset=offset,
+                                 whence=whence)  # type: int
+        return position
+
+    def tell(self) -> int:
+        position = self._command('tellStream')  # type: int
+        return position
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        if size is None:
+            size = self.tell()
+        size = self._command('truncateStream', size=size)
+        return size
+
+    def flush(self) -> None:
+        if not self.closed:
+            self._command('flushStream')
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            super().close()
+            if self.closefd:
+                self._bridge.send_command(
+                    'closeStream', self._bridge.encode(self.resource))
+
+
+def open_stream(resource: 'objects.PHPResource',
+                buffering: int = default_buffer_size,
+                encoding: Optional[str] = None,
+                errors: Optional[str] = None,
+                newline: Optional[str] = None,
+                closefd: bool = True) -> Union[io.IOBase, PHPStream]:
+    """Wrap a PHP stream resource in a file object, like open().
+
+    If buffering is 0, the raw PHPStream is returned. If encoding is given,
+    a text file is returned. Closing the file closes the PHP stream as well,
+    unless closefd is False.
+    """
+    raw = PHPStream(resource, closefd=closefd)
+    if buffering == 0:
+        if encoding is not None:
+            raise ValueError("Can't have unbuffered text I/O")
+        return raw
+    if buffering < 0:
+        buffering = default_buffer_size
+    file = None  # type: Any
+    if raw.readable() and raw.writable():
+        if raw.seekable():
+            file = io.BufferedRandom(raw, buffering)
+        else:
+            file = io.BufferedRWPair(raw, raw, buffering)
+    elif raw.writable():
+        file = io.BufferedWriter(raw, buffering)
+    else:
+        file = io.BufferedReader(raw, buffering)
+    if encoding is not None:
+        file = io.TextIOWrapper(file, encoding, errors, newline)
+    return cast(io.IOBase, file)
@@ -0,0 +1,253 @@
+"""A bridge that can be shared between threads.
+
+Each command gets an ID that the server echoes in its response. Any number
+of threads can have a command in flight at the same time. Writing a command
+only takes a short lock. Instead of a dedicated reader thread, whichever
+waiting thread gets there first reads responses and hands them to the
+threads they belong to, until its own response arrives. Then another
+waiting thread takes over.
+
+    bridge = start_process(cls=ThreadSafePHPBridge)
+"""
+
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import (Any, Dict, Iterable, Iterator, List,  # noqa: F401
+                    Optional, Set)
+
+from phpbridge import batching, objects, scopes, wire
+from phpbridge.multiplex import MultiplexedBridge
+
+
+class ThreadSafePHPBridge(MultiplexedBridge):
+    # Responses are matched to commands, so PHP can't push chunks
+    iteration_window = 0
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        # Batches, scopes, by_value, buffers and stream_strings blocks are
+        # per thread, and this is needed to set their attributes
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+        # Commands don't have to wait for each other, and the garbage timer
+        # doesn't have to wait for them either
+        self._lock = _NoLock()  # type: ignore
+        # Held while writing a message
+        self._write_lock = threading.Lock()
+        # Guards everything below, and is notified when a response arrives
+        # or a reader stops reading
+        self._cond = threading.Condition(threading.Lock())
+        # The commands still waiting for a response, in the order they were
+        # sent
+        self._waiting = OrderedDict()  # type: OrderedDict
+        # Responses read by another thread
+        self._responses = {}    # type: Dict[int, Dict[str, Any]]
+        self._reading = False
+        # Held while making classes and functions, so that each is only made
+        # once
+        self._create_lock = threading.RLock()
+        # Held while looking up and registering proxies, which finalizers can
+        # do from any thread
+        self._remotes_lock = threading.RLock()
+
+    @property                   # type: ignore
+    def _batch(self) -> Optional[batching.Batch]:
+        return getattr(self._local, 'batch', None)
+
+    @_batch.setter
+    def _batch(self, batch: Optional[batching.Batch]) -> None:
+        self._local.batch = batch
+
+    @property                   # type: ignore
+    def _scope(self) -> Optional[scopes.Scope]:
+        return getattr(self._local, 'scope', None)
+
+    @_scope.setter
+    def _scope(self, scope: Optional[scopes.Scope]) -> None:
+        self._local.scope = scope
+
+    @property                   # type: ignore
+    def _by_value(self) -> int:
+        return getattr(self._local, 'by_value', 0)
+
+    @_by_value.setter
+    def _by_value(self, depth: int) -> None:
+        self._local.by_value = depth
+
+    @property                   # type: ignore
+    def _buffers(self) -> bool:
+        return getattr(self._local, 'buffers', False)
+
+    @_buffers.setter
+    def _buffers(self, enabled: bool) -> None:
+        self._local.buffers = enabled
+
+    @property                   # type: ignore
+    def _stream_strings(self) -> int:
+        return getattr(self._local, 'stream_strings', 0)
+
+    @_stream_strings.setter
+    def _stream_strings(self, threshold: int) -> None:
+        self._local.stream_strings = threshold
+
+    def batch(self) -> batching.Batch:
+        return _Batch(self)
+
+    @contextmanager
+    def _active(self) -> Iterator[None]:
+        """Count the commands a thread sends as unfinished until it's done.
+
+        The results of commands are only decoded after the exchange, and
+        decoding can send more commands. They're all finished once the
+        outermost block exits.
+        """
+        depth = getattr(self._local, 'active', 0)
+        self._local.active = depth + 1
+        if depth == 0:
+            self._local.sent = []
+        try:
+            yield
+        finally:
+            self._local.active = depth
+            if depth == 0:
+                self._finish(self._local.sent)
+
+    def _finish(self, idents: Iterable[int]) -> None:
+        """Note that the responses to commands are processed."""
+        with self._cond:
+            for ident in idents:
+                self._unfinished.pop(ident, None)
+
+    def send_command(self, cmd: str, data: Any = None,
+                     decode: bool = False) -> Any:
+        with self._active():
+            return super().send_command(cmd, data, decode)
+
+    @contextmanager
+    def _decoding(self) -> Iterator[None]:
+        # The responses count as unfinished instead, so PHP refuses their
+        # garbage
+        with self._active():
+            yield
+
+    def _refused(self, sent: Iterable[int], collected: Iterable[int]) -> None:
+        with self._remotes_lock:
+            super()._refused(sent, collected)
+
+    def flush_garbage(self) -> None:
+        # Counted like any other command
+        with self._active():
+            super().flush_garbage()
+
+    def handle_stats(self) -> Dict[str, int]:
+        with self._cond:
+            return super().handle_stats()
+
+    def exchange(self, command: str, data: Any) -> Any:
+        # The response counts as unfinished until whoever sent the command
+        # is done with it
+        with self._active():
+            with self._write_lock:
+                message = self.make_message(command, data)
+                with self._cond:
+                    ident = self._track(message)
+                    self._waiting[ident] = command
+                self._local.sent.append(ident)
+                self.codec.write(self.input, message)
+                if command == 'setCodec':
+                    # Everything written after this has to use the new
+                    # codec, so nothing can be written until we know which
+                    # one it is
+                    response = self._wait(ident)
+            if command != 'setCodec':
+                response = self._wait(ident)
+            return self.unpack_response(response)
+
+    def _wait(self, ident: int) -> Dict[str, Any]:
+        """Wait for the response to a command, reading it if needed."""
+        with self._cond:
+            while ident not in self._responses and self._reading:
+                self._cond.wait()
+            if ident in self._responses:
+                return self._responses.pop(ident)
+            self._reading = True
+        try:
+            while True:
+                response = self.codec.read(self.output)
+                if self._debug:
+                    print(response)
+                self.confirm_collected(response['collected'])
+                self.learn_keys(response)
+                with self._cond:
+                    if 'id' in response:
+                        other = response['id']
+                        command = self._waiting.pop(other)
+                    else:
+                        # The server couldn't even read the command, but it
+                        # answers in order, so it must be the oldest one
+                        other, command = self._waiting.popitem(last=False)
+                    sent = self._garbage_sent.pop(other, ())
+                    if command == 'setCodec' and response['type'] == 'result':
+                        self.codec = wire.codecs[response['data']]()
+                self._refused(sent, response['collected'])
+                if other == ident:
+                    return response
+                with self._cond:
+                    self._responses[other] = response
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._reading = False
+                self._cond.notify_all()
+
+    def get_class(self, name: str) -> objects.PHPClass:
+        if name not in self.classes:
+            with self._create_lock:
+                return super().get_class(name)
+        return self.classes[name]
+
+    def get_function(self, name: str) -> Any:
+        if name not in self.functions:
+            with self._create_lock:
+                return super().get_function(name)
+        return self.functions[name]
+
+    def get_object(self, cls: objects.PHPClass,
+                   key: int) -> objects.PHPObject:
+        with self._remotes_lock:
+            return super().get_object(cls, key)
+
+    def get_resource(self, type_: str, key: int) -> objects.PHPResource:
+        with self._remotes_lock:
+            return super().get_resource(type_, key)
+
+    def release(self, keys: Iterable[int]) -> None:
+        with self._remotes_lock:
+            super().release(keys)
+
+    def _collect(self, ident: int) -> None:
+        with self._remotes_lock:
+            super()._collect(ident)
+
+
+class _NoLock:
+    """A lock that's always available."""
+    def acquire(self, blocking: bool = True) -> bool:
+        return True
+
+    def release(self) -> None:
+        pass
+
+    def __enter__(self) -> bool:
+        return True
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+class _Batch(batching.Batch):
+    def flush(self) -> None:
+        # The results are decoded after the exchange is over
+        with self.bridge._active():  # type: ignore
+            super().flush()
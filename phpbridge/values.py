@@ -0,0 +1,105 @@
+"""Plain Python copies of PHP objects.
+
+Normally an object is sent as a reference. The PHP side keeps it alive, and
+reading each property takes a round trip. Objects can also be sent by
+value, as their public properties. That's meant for immutable data objects
+that are only read.
+
+There are two ways to send objects by value:
+  - PHPBridge.set_value_class makes it happen for all objects of a class
+    and its subclasses, nested up to PHPBridge.set_value_depth levels deep
+  - Inside a "with bridge.by_value(depth):" block, every object in a result
+    is sent by value, up to depth levels deep
+
+Deeper objects are sent as references, as usual.
+
+The copies are instances of PHPValue subclasses. They are generated for
+each PHP class and set of property names, and use __slots__.
+"""
+
+from collections import OrderedDict
+from typing import Any, Dict, Sequence, Tuple, Type  # noqa: F401
+
+from phpbridge import modules
+
+
+class PHPValue:
+    """The base class of copies of PHP objects."""
+    __slots__ = ()
+    _name = None                # type: str
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        for name, value in zip(self.__slots__, args):
+            object.__setattr__(self, name, value)
+        for name, value in kwargs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, attr: str, value: Any) -> None:
+        raise AttributeError("{} is read-only".format(self.__class__._name))
+
+    def __delattr__(self, attr: str) -> None:
+        raise AttributeError("{} is read-only".format(self.__class__._name))
+
+    def _asdict(self) -> 'OrderedDict[str, Any]':
+        """Return the properties as an ordered dictionary."""
+        return OrderedDict((name, getattr(self, name))
+                           for name in self.__slots__)
+
+    def __eq__(self, other: Any) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._asdict() == other._asdict()
+
+    def __repr__(self) -> str:
+        return "<{} PHP value ({})>".format(
+            self.__class__._name,
+            ', '.join('{}={!r}'.format(name, value)
+                      for name, value in self._asdict().items()))
+
+
+# Generated classes, by PHP class name and property names
+_classes = {}                   # type: Dict[Tuple[str, Tuple[str, ...]], Type]
+
+
+def value_class(name: str, fields: Sequence[str]) -> Type[PHPValue]:
+    """Get the PHPValue subclass for a PHP class and its properties.
+
+    Objects of the same class can have different dynamic properties, so
+    there can be more than one class per PHP class.
+    """
+    key = (name, tuple(fields))
+    if key not in _classes:
+        cls = type(modules.basename(name).replace('\0', '$'), (PHPValue,),
+                   {'__slots__': key[1], '_name': name})
+        cls.__module__ = __name__
+        _classes[key] = cls
+    return _classes[key]
+
+
+def make_value(name: str, properties: Dict[str, Any]) -> Any:
+    """Create a copy of a PHP object from its decoded properties.
+
+    If a property name can't be used as an attribute, the properties are
+    returned as a dict instead.
+    """
+    if not all(isinstance(field, str) and field.isidentifier() and
+               not hasattr(PHPValue, field) for field in properties):
+        return properties
+    return value_class(name, list(properties))(**properties)
+
+
+def as_plain(value: Any) -> Any:
+    """Replace copies of PHP objects by dicts of their properties.
+
+    This is how a by-value result is passed back to PHP, the same way as
+    when it's used before the batch it came from was sent.
+    """
+    if isinstance(value, PHPValue):
+        return OrderedDict((name, as_plain(item))
+                           for name, item in value._asdict().items())
+    if isinstance(value, list):
+        return [as_plain(item) for item in value]
+    if isinstance(value, dict):
+        return OrderedDict((key, as_plain(item))
+                           for key, item in value.items())
+    return value
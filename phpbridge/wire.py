@@ -0,0 +1,413 @@
+"""Codecs that serialize messages for the wire.
+
+A codec takes care of both the framing and the serialization of messages.
+Every connection starts out using JSON. A different codec can be negotiated
+with the setCodec command.
+
+Codecs with native values don't need values to be wrapped in
+{'type': ..., 'value': ...} dicts. They carry strings, floats, lists and maps
+directly, and use handles for objects and resources.
+
+Arrays whose values all have the same scalar type are sent as typed blocks,
+without a tag for each value. They're unpacked into Scalars and ScalarMap,
+so the bridge knows it doesn't have to look at every value.
+
+Numbers can also be sent as a single binary string in machine byte order,
+straight from a buffer like array.array. Both sides run on the same machine,
+so they agree on the byte order.
+"""
+
+import abc
+import array
+import asyncio
+import json
+import struct
+import sys
+
+from collections import namedtuple
+from typing import (Any, Callable, Dict, IO, Iterable,  # noqa: F401
+                    List, Optional, Tuple, Type)
+
+ObjectHandle = namedtuple('ObjectHandle', ['key'])
+ResourceHandle = namedtuple('ResourceHandle', ['key', 'type'])
+DeferredHandle = namedtuple('DeferredHandle', ['index'])
+# The public properties of an object that was sent by value
+ObjectValue = namedtuple('ObjectValue', ['cls', 'properties'])
+# Packed numbers, with a format code that PHP's pack and unpack understand
+Numbers = namedtuple('Numbers', ['format', 'data'])
+
+
+class Scalars(list):
+    """A list that was sent as a typed block, so it only holds scalars."""
+
+
+class ScalarMap(dict):
+    """A map whose values were sent as a typed block."""
+
+
+_scalar_types = {int, float, str, bool}
+
+
+# PHP's integers are signed 64-bit integers, so unsigned 64-bit items aren't
+# packed. Large ones would silently become negative.
+_php_formats = {
+    'signed': {1: 'c', 2: 's', 4: 'l', 8: 'q'},
+    'unsigned': {1: 'C', 2: 'S', 4: 'L'},
+    'float': {4: 'f', 8: 'd'},
+}                               # type: Dict[str, Dict[int, str]]
+_kinds = dict.fromkeys('bhilqn', 'signed')
+_kinds.update(dict.fromkeys('BHILQN', 'unsigned'))
+_kinds.update(dict.fromkeys('fd', 'float'))
+
+
+def php_format(format_: str, itemsize: int) -> Optional[str]:
+    """Get the PHP pack code for the items of a buffer.
+
+    format_ is a struct format, like memoryview.format. Returns None if PHP
+    can't unpack the items.
+    """
+    if format_[:1] in {'<', '>', '!'}:
+        order = 'little' if format_[0] == '<' else 'big'
+        if order != sys.byteorder:
+            return None
+        format_ = format_[1:]
+    elif format_[:1] in {'@', '='}:
+        format_ = format_[1:]
+    kind = _kinds.get(format_)
+    if kind is None:
+        return None
+    return _php_formats[kind].get(itemsize)
+
+
+# array typecodes for PHP pack codes
+_typecodes = {}                 # type: Dict[str, str]
+for _typecode in 'bBhHiIlLqQfd':
+    _php_format = php_format(_typecode, array.array(_typecode).itemsize)
+    if _php_format is not None:
+        _typecodes.setdefault(_php_format, _typecode)
+
+
+def to_array(numbers: Numbers) -> array.array:
+    """Copy packed numbers into an array.array, in a single step."""
+    return array.array(_typecodes[numbers.format], numbers.data)
+
+
+def scalar_type(values: Iterable[Any]) -> Optional[type]:
+    """Return the type of some values if they all have the same scalar type.
+
+    Otherwise, return None.
+    """
+    types = set(map(type, values))
+    if len(types) == 1:
+        type_ = types.pop()
+        if type_ in _scalar_types:
+            return type_
+    return None
+
+
+class Codec(abc.ABC):
+    """Read and write messages."""
+    name = None                 # type: str
+    native = False
+
+    @abc.abstractmethod
+    def frame(self, message: Any) -> bytes:
+        """Serialize a message into a complete frame."""
+
+    def write(self, stream: IO[bytes], message: Any) -> None:
+        stream.write(self.frame(message))
+        stream.flush()
+
+    @abc.abstractmethod
+    def read(self, stream: IO[bytes]) -> Any:
+        """Read a message, or raise RuntimeError if the stream is closed."""
+
+    @abc.abstractmethod
+    async def read_async(self, stream: asyncio.StreamReader) -> Any:
+        """Like read, but for an asyncio stream."""
+
+
+class JSONCodec(Codec):
+    """Send messages as lines of JSON."""
+    name = 'json'
+
+    def frame(self, message: Any) -> bytes:
+        return json.dumps(message).encode() + b'\n'
+
+    def read(self, stream: IO[bytes]) -> Any:
+        return self._parse(stream.readline())
+
+    async def read_async(self, stream: asyncio.StreamReader) -> Any:
+        return self._parse(await stream.readline())
+
+    @staticmethod
+    def _parse(line: bytes) -> Any:
+        if not line:
+            # Empty response, not even a newline
+            raise RuntimeError("Connection closed")
+        return json.loads(line.decode())
+
+
+NULL = 0x00
+FALSE = 0x01
+TRUE = 0x02
+INT8 = 0x03
+INT64 = 0x04
+FLOAT = 0x05
+STRING = 0x06
+LIST = 0x07
+MAP = 0x08
+OBJECT = 0x09
+RESOURCE = 0x0a
+DEFERRED = 0x0b
+VALUE = 0x0c
+INT_LIST = 0x0d
+FLOAT_LIST = 0x0e
+STRING_LIST = 0x0f
+BOOL_LIST = 0x10
+COLUMNS = 0x11
+NUMBERS = 0x12
+
+# Smaller arrays are sent value by value
+_block_min = 8
+
+_tag = struct.Struct('>B')
+_int8 = struct.Struct('>Bb')
+_int64 = struct.Struct('>Bq')
+_float = struct.Struct('>Bd')
+_sized = struct.Struct('>BI')
+_uint32 = struct.Struct('>I')
+
+
+class BinaryCodec(Codec):
+    """Send messages in a compact tagged binary format.
+
+    Each frame is a big-endian 32-bit length followed by a single value. Each
+    value starts with a one-byte tag. PHP strings can be any sequence of
+    bytes, so str is encoded with surrogateescape and decoded the same way.
+    """
+    name = 'binary'
+    native = True
+
+    def frame(self, message: Any) -> bytes:
+        parts = [b'']           # type: List[bytes]
+        pack(message, parts)
+        length = sum(map(len, parts))
+        parts[0] = _uint32.pack(length)
+        return b''.join(parts)
+
+    def read(self, stream: IO[bytes]) -> Any:
+        header = stream.read(4)
+        if len(header) < 4:
+            raise RuntimeError("Connection closed")
+        length, = _uint32.unpack(header)
+        payload = stream.read(length)
+        if len(payload) < length:
+            raise RuntimeError("Connection closed")
+        return self._parse(payload)
+
+    async def read_async(self, stream: asyncio.StreamReader) -> Any:
+        try:
+            header = await stream.readexactly(4)
+            length, = _uint32.unpack(header)
+            payload = await stream.readexactly(length)
+        except asyncio.IncompleteReadError:
+            raise RuntimeError("Connection closed")
+        return self._parse(payload)
+
+    @staticmethod
+    def _parse(payload: bytes) -> Any:
+        value, offset = unpack(payload, 0)
+        if offset != len(payload):
+            raise RuntimeError("Trailing data after message")
+        return value
+
+
+def pack(value: Any, parts: List[bytes]) -> None:
+    """Serialize a value and append the pieces to parts."""
+    type_ = type(value)
+    if type_ is str:
+        encoded = value.encode(errors='surrogateescape')
+        parts.append(_sized.pack(STRING, len(encoded)))
+        parts.append(encoded)
+    elif type_ is int:
+        if -0x80 <= value < 0x80:
+            parts.append(_int8.pack(INT8, value))
+        elif -0x8000000000000000 <= value < 0x8000000000000000:
+            parts.append(_int64.pack(INT64, value))
+        else:
+            # PHP does the same with integer literals that are too large
+            parts.append(_float.pack(FLOAT, value))
+    elif type_ is float:
+        parts.append(_float.pack(FLOAT, value))
+    elif type_ is bool:
+        parts.append(_tag.pack(TRUE if value else FALSE))
+    elif value is None:
+        parts.append(_tag.pack(NULL))
+    elif type_ is bytes:
+        parts.append(_sized.pack(STRING, len(value)))
+        parts.append(value)
+    elif type_ is list:
+        if len(value) < _block_min or not _pack_block(value, parts):
+            parts.append(_sized.pack(LIST, len(value)))
+            for item in value:
+                pack(item, parts)
+    elif type_ is dict:
+        if (len(value) >= _block_min and
+                scalar_type(value.values()) is not None):
+            # The keys and the values are sent as separate lists
+            parts.append(_tag.pack(COLUMNS))
+            pack(list(value), parts)
+            pack(list(value.values()), parts)
+        else:
+            parts.append(_sized.pack(MAP, len(value)))
+            for key, item in value.items():
+                pack(key, parts)
+                pack(item, parts)
+    elif type_ is ObjectHandle:
+        parts.append(_tag.pack(OBJECT))
+        pack(value.key, parts)
+    elif type_ is ResourceHandle:
+        parts.append(_tag.pack(RESOURCE))
+        pack(value.key, parts)
+        pack(value.type, parts)
+    elif type_ is DeferredHandle:
+        parts.append(_tag.pack(DEFERRED))
+        pack(value.index, parts)
+    elif type_ is Numbers:
+        parts.append(_tag.pack(NUMBERS))
+        parts.append(value.format.encode())
+        parts.append(_uint32.pack(memoryview(value.data).nbytes))
+        parts.append(value.data)
+    elif type_ is ObjectValue:
+        parts.append(_tag.pack(VALUE))
+        pack(value.cls, parts)
+        parts.append(_uint32.pack(len(value.properties)))
+        for name, item in value.properties.items():
+            pack(name, parts)
+            pack(item, parts)
+    else:
+        raise RuntimeError("Can't pack {!r}".format(value))
+
+
+def _pack_block(value: List[Any], parts: List[bytes]) -> bool:
+    """Pack a list as a typed block, if its items allow it."""
+    type_ = scalar_type(value)
+    count = len(value)
+    if type_ is int:
+        if (min(value) < -0x8000000000000000 or
+                max(value) >= 0x8000000000000000):
+            return False
+        parts.append(_sized.pack(INT_LIST, count))
+        parts.append(struct.pack('>{}q'.format(count), *value))
+    elif type_ is float:
+        parts.append(_sized.pack(FLOAT_LIST, count))
+        parts.append(struct.pack('>{}d'.format(count), *value))
+    elif type_ is str:
+        encoded = [item.encode(errors='surrogateescape') for item in value]
+        parts.append(_sized.pack(STRING_LIST, count))
+        parts.append(struct.pack('>{}I'.format(count), *map(len, encoded)))
+        parts.extend(encoded)
+    elif type_ is bool:
+        parts.append(_sized.pack(BOOL_LIST, count))
+        parts.append(bytes(value))
+    else:
+        return False
+    return True
+
+
+def unpack(data: bytes, offset: int) -> Tuple[Any, int]:
+    """Deserialize the value at offset, and return it with the new offset."""
+    tag = data[offset]
+    offset += 1
+    if tag == STRING:
+        length, = _uint32.unpack_from(data, offset)
+        offset += 4
+        end = offset + length
+        return data[offset:end].decode(errors='surrogateescape'), end
+    elif tag == INT8:
+        return struct.unpack_from('>b', data, offset)[0], offset + 1
+    elif tag == INT64:
+        return struct.unpack_from('>q', data, offset)[0], offset + 8
+    elif tag == FLOAT:
+        return struct.unpack_from('>d', data, offset)[0], offset + 8
+    elif tag == NULL:
+        return None, offset
+    elif tag == FALSE:
+        return False, offset
+    elif tag == TRUE:
+        return True, offset
+    elif tag == LIST:
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        items = []
+        for _ in range(count):
+            item, offset = unpack(data, offset)
+            items.append(item)
+        return items, offset
+    elif tag == MAP:
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        mapping = {}
+        for _ in range(count):
+            key, offset = unpack(data, offset)
+            mapping[key], offset = unpack(data, offset)
+        return mapping, offset
+    elif tag == OBJECT:
+        key, offset = unpack(data, offset)
+        return ObjectHandle(key), offset
+    elif tag == RESOURCE:
+        key, offset = unpack(data, offset)
+        type_, offset = unpack(data, offset)
+        return ResourceHandle(key, type_), offset
+    elif tag == DEFERRED:
+        index, offset = unpack(data, offset)
+        return DeferredHandle(index), offset
+    elif tag == VALUE:
+        cls, offset = unpack(data, offset)
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        properties = {}
+        for _ in range(count):
+            name, offset = unpack(data, offset)
+            properties[name], offset = unpack(data, offset)
+        return ObjectValue(cls, properties), offset
+    elif tag == INT_LIST or tag == FLOAT_LIST:
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        format_ = '>{}{}'.format(count, 'q' if tag == INT_LIST else 'd')
+        return (Scalars(struct.unpack_from(format_, data, offset)),
+                offset + 8 * count)
+    elif tag == STRING_LIST:
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        lengths = struct.unpack_from('>{}I'.format(count), data, offset)
+        offset += 4 * count
+        strings = Scalars()
+        for length in lengths:
+            end = offset + length
+            strings.append(data[offset:end].decode(errors='surrogateescape'))
+            offset = end
+        return strings, offset
+    elif tag == BOOL_LIST:
+        count, = _uint32.unpack_from(data, offset)
+        offset += 4
+        end = offset + count
+        return Scalars(map(bool, data[offset:end])), end
+    elif tag == NUMBERS:
+        format_ = chr(data[offset])
+        length, = _uint32.unpack_from(data, offset + 1)
+        offset += 5
+        end = offset + length
+        return Numbers(format_, data[offset:end]), end
+    elif tag == COLUMNS:
+        keys, offset = unpack(data, offset)
+        items, offset = unpack(data, offset)
+        return ScalarMap(zip(keys, items)), offset
+    raise RuntimeError("Unknown tag {}".format(tag))
+
+
+codecs = {
+    'binary': BinaryCodec,
+    'json': JSONCodec,
+}                               # type: Dict[str, Type[Codec]]
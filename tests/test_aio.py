@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from typing import Any, List  # noqa: F401
+
+from phpbridge.aio import AsyncPHPBridge
+from phpbridge.metacache import SharedCache
+
+
+def class_info(name: str, parent: Any = False) -> Any:
+    return {'name': name, 'interfaces': [], 'traits': [], 'parent': parent}
+
+
+class TaskStateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # Nothing is sent, so the streams are never used
+        self.bridge = AsyncPHPBridge(None, None, 'test')  # type: ignore
+
+    def test_blocks_stay_in_their_task(self) -> None:
+        bridge = self.bridge
+        inside = asyncio.Event()
+        checked = asyncio.Event()
+
+        async def first() -> None:
+            with bridge.by_value(2), bridge.buffers(), \
+                    bridge.stream_strings(10), bridge.scope() as scope:
+                inside.set()
+                await checked.wait()
+                self.assertIs(bridge._scope, scope)
+                message = bridge.make_message('getItem', None)
+                self.assertEqual(message['byValue'], 2)
+                self.assertTrue(message['buffers'])
+                self.assertEqual(message['streamStrings'], 10)
+
+        async def second() -> None:
+            await inside.wait()
+            self.assertIsNone(bridge._scope)
+            message = bridge.make_message('getItem', None)
+            self.assertNotIn('byValue', message)
+            self.assertNotIn('buffers', message)
+            self.assertNotIn('streamStrings', message)
+            checked.set()
+
+        async def main() -> None:
+            await asyncio.gather(first(), second())
+
+        asyncio.run(main())
+        self.assertIsNone(bridge._scope)
+        self.assertEqual(bridge._by_value, 0)
+
+
+class LoadingTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.bridge = AsyncPHPBridge(None, None, 'test')  # type: ignore
+
+    def test_cached_class_fetches_its_ancestors(self) -> None:
+        bridge = self.bridge
+        bridge.metadata_cache = SharedCache()
+        bridge.metadata_cache.put('classInfo', 'Child',
+                                  class_info('Child', 'Base'))
+        requested = []  # type: List[str]
+
+        def request(cmd: str, data: Any) -> Any:
+            requested.append(data['name'])
+            return None
+
+        async def finish(future: Any, decode: bool,
+                         prepare: bool = True) -> Any:
+            return [class_info('Base')]
+
+        bridge._request = request  # type: ignore
+        bridge._finish = finish  # type: ignore
+        asyncio.run(bridge._fetch_classes(['Child']))
+        self.assertEqual(requested, ['Base'])
+        self.assertEqual(bridge.reflect('classInfo', 'Base')['name'], 'Base')
+
+    def test_dir_lists_loaded_names(self) -> None:
+        bridge = self.bridge
+        bridge.constants['Foo\\BAR'] = 1
+        bridge.constants['Foo\\Bar\\BAZ'] = 2
+        bridge.constants['QUX'] = 3
+        self.assertEqual(bridge.list_names('Foo'), ['BAR'])
+        self.assertEqual(bridge.list_names(''), ['QUX'])
+
+
+if __name__ == '__main__':
+    unittest.main()
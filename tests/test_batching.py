@@ -0,0 +1,19 @@
+import unittest
+
+from phpbridge import PHPBridge, values
+from phpbridge.batching import Deferred
+
+
+class DeferredTest(unittest.TestCase):
+    def setUp(self) -> None:
+        # Nothing is sent, so the streams are never used
+        self.bridge = PHPBridge(None, None, 'test')  # type: ignore
+
+    def test_value_result_is_passed_as_plain_value(self) -> None:
+        deferred = Deferred(self.bridge, 0, 'callFun', True)
+        point = values.make_value('Point', {'x': 1, 'y': 2})
+        deferred._value = [point]
+        self.assertEqual(self.bridge.encode(deferred),
+                         {'type': 'array',
+                          'value': [{'type': 'scalars',
+                                     'value': {'x': 1, 'y': 2}}]})
@@ -0,0 +1,68 @@
+import time
+import unittest
+from typing import Any, List  # noqa: F401
+
+from phpbridge import PHPBridge
+from phpbridge.iteration import ChunkedIterator, PushedIterator
+
+
+class FakeBridge(PHPBridge):
+    """A bridge that answers iteration commands without PHP."""
+    garbage_flush_count = 1
+
+    def __init__(self) -> None:
+        super().__init__(None, None, 'test')  # type: ignore
+        self.events = []  # type: List[str]
+
+    def exchange(self, command: str, data: Any) -> Any:
+        message = self.make_message(command, data)
+        if message['garbage']:
+            self.events.append('garbage')
+        if command == 'nextIterationChunk':
+            self.events.append('received')
+            return {'keys': [0], 'values': [1], 'done': False}
+        return None
+
+    def encode(self, data: Any) -> Any:
+        return None
+
+    def decode(self, data: Any) -> Any:
+        # Give the timer plenty of chances to get in between
+        time.sleep(0.02)
+        self.events.append('decoded')
+        return data
+
+
+class GarbageTimerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.bridge = FakeBridge()
+        self.bridge._collected.add(1)
+        self.bridge.start_garbage_timer(0.001)
+
+    def tearDown(self) -> None:
+        self.bridge.stop_garbage_timer()
+
+    def test_waits_for_chunk_decoding(self) -> None:
+        iterator = ChunkedIterator(self.bridge, None, 1)  # type: ignore
+        for _ in range(5):
+            next(iterator)
+        events = self.bridge.events
+        for ind, event in enumerate(events):
+            if event == 'received':
+                self.assertEqual(events[ind + 1:ind + 3],
+                                 ['decoded', 'decoded'])
+
+    def test_waits_for_pushed_chunks(self) -> None:
+        bridge = self.bridge
+        iterator = PushedIterator(bridge, None, 1, 2)  # type: ignore
+        iterator._owed = 1
+        iterator.receive({'type': 'result',
+                          'data': {'keys': [0], 'values': [1],
+                                   'done': False}}, 0)
+        # Don't ask for more
+        iterator._finished = True
+        self.assertFalse(bridge._may_send_garbage())
+        time.sleep(0.05)
+        self.assertNotIn('garbage', bridge.events)
+        next(iterator)
+        self.assertTrue(bridge._may_send_garbage())
@@ -0,0 +1,31 @@
+import unittest
+from typing import Any, List  # noqa: F401
+
+from phpbridge import PHPBridge
+from phpbridge.iteration import PushedIterator
+
+
+class FakeBridge(PHPBridge):
+    """A bridge that records the commands it sends."""
+    def __init__(self) -> None:
+        super().__init__(None, None, 'test')  # type: ignore
+        self.sent = []  # type: List[str]
+
+    def send(self, command: str, data: Any) -> None:
+        self.sent.append(command)
+
+    def receive(self) -> Any:
+        return [{'type': 'result', 'data': None}]
+
+    def encode(self, data: Any) -> Any:
+        return None
+
+
+class PushedIteratorTest(unittest.TestCase):
+    def test_flushes_batch_first(self) -> None:
+        bridge = FakeBridge()
+        with bridge.batch():
+            bridge.send_command('setGlobal', None)
+            iterator = PushedIterator(bridge, None, 1, 2)  # type: ignore
+            iterator._refill()
+            self.assertEqual(bridge.sent, ['batch', 'pushIteration'])